@@ -0,0 +1,152 @@
+"""Recent and trending messages for the home page sidebar.
+
+Every home page shows the newest messages site-wide. Rather than querying for
+them on each view, each process keeps the latest ones in a ring buffer:
+messages posted or deleted through this process are applied to it straight
+away, and the buffer is reloaded from the database every `refresh_interval`
+seconds to pick up other workers' posts (and authors' profile changes).
+
+The same refresh ranks "trending" messages by how many likes they got in the
+last `trending_window` seconds. Between refreshes, the sidebar costs no
+queries at all.
+"""
+
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Lock
+
+from sqlalchemy import func, select
+
+from models import db, LikedWarble, Message
+
+
+class Author:
+    """The parts of a message's author shown on a message card."""
+
+    __slots__ = ('id', 'username', 'image_url', 'version')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.image_url = user.image_url
+        self.version = user.version
+
+
+class RecentMessage:
+    """Snapshot of a message and its author, for rendering message cards."""
+
+    __slots__ = ('id', 'text', 'timestamp', 'user_id', 'user')
+
+    def __init__(self, msg, author):
+        self.id = msg.id
+        self.text = msg.text
+        self.timestamp = msg.timestamp
+        self.user_id = msg.user_id
+        self.user = Author(author)
+
+
+class RecentActivity:
+    """Ring buffer of the newest messages, plus the trending ones."""
+
+    def __init__(self, size=10, refresh_interval=30,
+                 trending_window=3600, trending_size=5):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.trending_window = trending_window
+        self.trending_size = trending_size
+
+        self._lock = Lock()
+        self._refreshed_at = None
+        # Twice what's shown, so deletes don't leave the sidebar short.
+        self._recent = deque(maxlen=2 * size)
+        self._trending = []
+
+    def init_app(self, app):
+        self.size = app.config['RECENT_MESSAGES']
+        self.refresh_interval = app.config['ACTIVITY_REFRESH']
+        self.trending_window = app.config['TRENDING_WINDOW']
+        self.trending_size = app.config['TRENDING_SIZE']
+
+        with self._lock:
+            self._recent = deque(maxlen=2 * self.size)
+            self._refreshed_at = None
+
+    def refresh(self):
+        """Reload recent and trending messages from the database."""
+
+        recent = (Message.with_authors()
+                  .order_by(Message.timestamp.desc(), Message.id.desc())
+                  .limit(self._recent.maxlen)
+                  .all())
+
+        since = datetime.utcnow() - timedelta(seconds=self.trending_window)
+        likes = func.count(LikedWarble.id)
+        ranked = db.session.execute(
+            select(LikedWarble.message_id)
+            .where(LikedWarble.created_at >= since)
+            .group_by(LikedWarble.message_id)
+            .order_by(likes.desc(), func.max(LikedWarble.created_at).desc())
+            .limit(self.trending_size)).scalars().all()
+
+        trending = []
+        if ranked:
+            by_id = {msg.id: msg for msg in
+                     Message.with_authors().filter(Message.id.in_(ranked))}
+            trending = [by_id[msg_id] for msg_id in ranked if msg_id in by_id]
+
+        with self._lock:
+            self._recent.clear()
+            self._recent.extend(RecentMessage(msg, msg.user) for msg in recent)
+            self._trending = [RecentMessage(msg, msg.user) for msg in trending]
+            self._refreshed_at = time.monotonic()
+
+    def _ensure_current(self):
+        refreshed_at = self._refreshed_at
+
+        if (refreshed_at is None
+                or time.monotonic() - refreshed_at > self.refresh_interval):
+            self.refresh()
+
+    def recent(self):
+        """The newest messages, newest first."""
+
+        self._ensure_current()
+
+        with self._lock:
+            return list(self._recent)[:self.size]
+
+    def trending(self):
+        """Messages with the most likes in the trending window, best first."""
+
+        self._ensure_current()
+
+        with self._lock:
+            return list(self._trending)
+
+    def add(self, recent):
+        """Put a newly-posted message (a `RecentMessage`) at the front."""
+
+        with self._lock:
+            self._recent.appendleft(recent)
+
+    def remove(self, message_id):
+        """Drop a deleted message."""
+
+        self._discard(lambda msg: msg.id == message_id)
+
+    def remove_user(self, user_id):
+        """Drop the messages of a deleted user."""
+
+        self._discard(lambda msg: msg.user_id == user_id)
+
+    def _discard(self, matches):
+        with self._lock:
+            kept = [msg for msg in self._recent if not matches(msg)]
+            self._recent.clear()
+            self._recent.extend(kept)
+            self._trending = [msg for msg in self._trending if not matches(msg)]
+
+
+# Shared by every app in the process, configured by `create_app`.
+recent_activity = RecentActivity()
@@ -0,0 +1,433 @@
+"""JSON API, version 1, mounted at `/api/v1`.
+
+Clients log in through the HTML `/login` form and send the session cookie.
+Writes must have a JSON body, which browsers won't send cross-site without
+CORS; that stands in for the CSRF token the HTML forms carry.
+
+List endpoints are paginated like the HTML pages: each response has a
+`next_cursor` to pass back as `?after=`. `?limit=` sets the page size (at
+most `MAX_LIMIT`), and `?fields=id,text` returns only the named fields.
+
+Reads select just the columns needed for the requested fields and serialize
+the rows directly, without loading ORM objects or rendering templates.
+Responses are encoded with orjson when it's installed.
+"""
+
+import json
+from datetime import datetime
+
+from flask import Blueprint, current_app, g, request
+from sqlalchemy import select
+from werkzeug.exceptions import (
+    BadRequest, Forbidden, HTTPException, NotFound, Unauthorized,
+)
+
+from forms import MessageForm
+from models import db, User, Message, Follows, LikedWarble
+from notifications import inbox, mark_read
+from pagination import (
+    PAGE_SIZE, MESSAGE_KEYS, USER_KEYS, current_cursor, next_cursor, paginate,
+)
+from replicas import reads_from_replica
+import services
+import timeline
+from user_cache import user_cache
+
+try:
+    import orjson
+except ImportError:     # pragma: no cover
+    orjson = None
+
+MAX_LIMIT = 100
+
+# Most ids accepted by one batch request or `?ids=` lookup.
+MAX_BATCH = 1000
+
+# Fields clients may ask for, and the columns they come from.
+MESSAGE_FIELDS = {
+    'id': Message.id,
+    'text': Message.text,
+    'timestamp': Message.timestamp,
+    'user_id': Message.user_id,
+    'username': User.username,
+    'user_image_url': User.image_url,
+}
+
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'image_url': User.image_url,
+    'header_image_url': User.header_image_url,
+    'bio': User.bio,
+    'location': User.location,
+    'messages_count': User.messages_count,
+    'following_count': User.following_count,
+    'followers_count': User.followers_count,
+    'liked_messages_count': User.liked_messages_count,
+}
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+##############################################################################
+# Encoding
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload):
+    """Encode `payload` as compact JSON bytes."""
+
+    if orjson is not None:
+        return orjson.dumps(payload)
+
+    return json.dumps(payload, separators=(',', ':'), default=_default).encode()
+
+
+def json_response(payload, status=200):
+    return current_app.response_class(dumps(payload),
+                                      status=status,
+                                      mimetype='application/json')
+
+
+@api.errorhandler(HTTPException)
+def http_error(error):
+    return json_response({'error': error.description}, error.code)
+
+
+##############################################################################
+# Fields and rows
+
+
+def requested_fields(allowed):
+    """Return field names from `?fields=` (default: all of `allowed`).
+
+    Aborts with a 400 on unknown fields.
+    """
+
+    if 'fields' not in request.args:
+        return list(allowed)
+
+    fields = [name for name in request.args['fields'].split(',') if name]
+    unknown = set(fields) - set(allowed)
+
+    if not fields or unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(sorted(unknown))}"
+                         if unknown else "No fields requested.")
+
+    return list(dict.fromkeys(fields))
+
+
+def columns_for(fields, allowed, keys):
+    """Columns selecting `fields`, followed by any pagination `keys` that
+    weren't asked for (needed to compute the next cursor)."""
+
+    columns = [allowed[name].label(name) for name in fields]
+    columns += [key.label(key.key) for key in keys if key.key not in fields]
+
+    return columns
+
+
+def serialize(rows, fields):
+    """Turn rows from `columns_for` into dicts of `fields`."""
+
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def page_size():
+    return max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_LIMIT))
+
+
+def message_page(query_for):
+    """Respond with one page of messages.
+
+    `query_for(columns)` returns the query for the page's messages, with
+    `Message` and its author `User` available to select from.
+    """
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    columns = columns_for(fields, MESSAGE_FIELDS, MESSAGE_KEYS)
+    rows, cursor = paginate(query_for(columns), MESSAGE_KEYS, page_size())
+
+    return json_response({'messages': serialize(rows, fields),
+                          'next_cursor': cursor})
+
+
+def message_rows(columns):
+    return (db.session.query(*columns)
+            .select_from(Message)
+            .join(User, User.id == Message.user_id))
+
+
+def user_page(query):
+    """Respond with one page of users, where `query(columns)` selects them."""
+
+    fields = requested_fields(USER_FIELDS)
+    columns = columns_for(fields, USER_FIELDS, USER_KEYS)
+    rows, cursor = paginate(query(columns), USER_KEYS, page_size())
+
+    return json_response({'users': serialize(rows, fields),
+                          'next_cursor': cursor})
+
+
+def check_user_exists(user_id):
+    if db.session.scalar(select(User.id).where(User.id == user_id)) is None:
+        raise NotFound("No such user.")
+
+
+def parse_ids(values):
+    """Return `values` as a list of distinct ints, in order.
+
+    Aborts with a 400 if they aren't ids or there are more than `MAX_BATCH`.
+    """
+
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise BadRequest("ids must be a list of integers.")
+
+    if len(ids) > MAX_BATCH:
+        raise BadRequest(f"At most {MAX_BATCH} ids per request.")
+
+    return ids
+
+
+def batch_ids():
+    """Ids from a JSON body like `{"ids": [1, 2, 3]}`."""
+
+    payload = request.get_json()
+
+    if not isinstance(payload, dict) or not isinstance(payload.get('ids'), list):
+        raise BadRequest('Send {"ids": [...]}.')
+
+    return parse_ids(payload['ids'])
+
+
+def batch_response(results):
+    """Respond with the per-id `results` of a batch write, in request order."""
+
+    return json_response({'results': [
+        {'id': item_id, 'status': status}
+        for item_id, status in results.items()
+    ]})
+
+
+##############################################################################
+# Routes
+
+
+@api.before_request
+def require_login():
+    if not g.user:
+        raise Unauthorized("Log in first.")
+
+
+@api.get('/timeline')
+@reads_from_replica
+def home_timeline():
+    """The logged-in user's home timeline."""
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    columns = columns_for(fields, MESSAGE_FIELDS, MESSAGE_KEYS)
+    per_page = page_size()
+
+    rows = timeline.home_timeline(g.user,
+                                  limit=per_page + 1,
+                                  before=current_cursor(MESSAGE_KEYS),
+                                  columns=columns)
+
+    return json_response({
+        'messages': serialize(rows[:per_page], fields),
+        'next_cursor': next_cursor(rows, MESSAGE_KEYS, per_page),
+    })
+
+
+@api.get('/users')
+@reads_from_replica
+def list_users():
+    """All users, or with `?ids=1,2,3`, just those users (in that order;
+    unknown ids are left out)."""
+
+    if 'ids' not in request.args:
+        return user_page(lambda columns: db.session.query(*columns))
+
+    ids = parse_ids(value for value in request.args['ids'].split(',') if value)
+    fields = requested_fields(USER_FIELDS)
+    columns = columns_for(fields, USER_FIELDS, USER_KEYS)
+
+    rows = {row.id: row for row in (db.session.query(*columns)
+                                    .filter(User.id.in_(ids)))}
+
+    return json_response({'users': serialize(
+        (rows[user_id] for user_id in ids if user_id in rows), fields)})
+
+
+@api.get('/users/<int:user_id>')
+@reads_from_replica
+def show_user(user_id):
+    """A user's profile."""
+
+    fields = requested_fields(USER_FIELDS)
+    row = (db.session.query(*columns_for(fields, USER_FIELDS, ()))
+           .filter(User.id == user_id)
+           .first())
+
+    if row is None:
+        raise NotFound("No such user.")
+
+    return json_response({'user': dict(zip(fields, row))})
+
+
+@api.get('/users/<int:user_id>/messages')
+@reads_from_replica
+def user_messages(user_id):
+    """Messages by a user, newest first."""
+
+    check_user_exists(user_id)
+
+    return message_page(lambda columns: (message_rows(columns)
+                                         .filter(Message.user_id == user_id)))
+
+
+@api.get('/users/<int:user_id>/following')
+@reads_from_replica
+def show_following(user_id):
+    """Users a user follows."""
+
+    check_user_exists(user_id)
+
+    return user_page(lambda columns: (
+        db.session.query(*columns)
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user_id)))
+
+
+@api.get('/users/<int:user_id>/followers')
+@reads_from_replica
+def show_followers(user_id):
+    """Users following a user."""
+
+    check_user_exists(user_id)
+
+    return user_page(lambda columns: (
+        db.session.query(*columns)
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user_id)))
+
+
+@api.get('/users/<int:user_id>/likes')
+@reads_from_replica
+def liked_messages(user_id):
+    """Messages a user has liked."""
+
+    check_user_exists(user_id)
+
+    return message_page(lambda columns: (
+        message_rows(columns)
+        .join(LikedWarble, LikedWarble.message_id == Message.id)
+        .filter(LikedWarble.user_id == user_id)))
+
+
+@api.post('/messages')
+def create_message():
+    """Post a message: `{"text": "..."}`. Responds 201 with the message."""
+
+    request.get_json()      # 415 unless the body is JSON
+    form = MessageForm(meta={'csrf': False})
+
+    if not form.validate():
+        return json_response({'errors': form.errors}, 400)
+
+    msg = services.post_message(g.user, form.text.data)
+
+    return json_response({'message': {
+        'id': msg.id,
+        'text': msg.text,
+        'timestamp': msg.timestamp,
+        'user_id': msg.user_id,
+    }}, 201)
+
+
+@api.delete('/messages/<int:message_id>')
+def delete_message(message_id):
+    """Delete one of the logged-in user's messages. Responds 204."""
+
+    msg = db.session.get(Message, message_id)
+
+    if msg is None:
+        raise NotFound("No such message.")
+
+    if msg.user_id != g.user.id:
+        raise Forbidden("You can only delete your own messages.")
+
+    services.delete_message(msg)
+
+    return current_app.response_class(status=204)
+
+
+@api.post('/follows')
+def follow_users():
+    """Follow every user in `{"ids": [...]}`."""
+
+    return batch_response(services.follow_users(g.user.id, batch_ids()))
+
+
+@api.delete('/follows')
+def unfollow_users():
+    """Stop following every user in `{"ids": [...]}`."""
+
+    return batch_response(services.unfollow_users(g.user.id, batch_ids()))
+
+
+@api.post('/likes')
+def like_messages():
+    """Like every message in `{"ids": [...]}`."""
+
+    return batch_response(services.like_messages(g.user.id, batch_ids()))
+
+
+@api.delete('/likes')
+def unlike_messages():
+    """Unlike every message in `{"ids": [...]}`."""
+
+    return batch_response(services.unlike_messages(g.user.id, batch_ids()))
+
+
+@api.get('/notifications')
+def list_notifications():
+    """The logged-in user's newest notifications, and how many are unread."""
+
+    return json_response({
+        'unread': g.user.unread_notifications,
+        'notifications': [{
+            'id': note.id,
+            'kind': note.kind,
+            'count': note.count,
+            'message_id': note.message_id,
+            'actor': note.actor and {'id': note.actor.id,
+                                     'username': note.actor.username},
+            'updated_at': note.updated_at,
+            'read': note.read_at is not None,
+        } for note in inbox(g.user.id, limit=page_size())],
+    })
+
+
+@api.post('/notifications/read')
+def read_notifications():
+    """Mark all of the logged-in user's notifications read: `{}`. Responds
+    204."""
+
+    # There's nothing to send, but a JSON body is what keeps cross-site
+    # forms from posting here.
+    if request.get_json(silent=True) is None:
+        raise BadRequest("Send a JSON body, e.g. {}.")
+
+    mark_read(g.user.id)
+    db.session.commit()
+    user_cache.invalidate(g.user.id)
+
+    return current_app.response_class(status=204)
@@ -1,49 +1,120 @@
+"""Chirper: a small Twitter clone.
+
+`create_app(config)` builds the app from a profile in config.py; the routes
+live on the `bp` blueprint. `app` is the app for the profile named by
+`CHIRPER_ENV` (default "development"), for `flask run` and gunicorn.
+"""
+
+import logging
 import os
-from dotenv import load_dotenv
+import time
+from datetime import datetime
+
+import click
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import (
+    Blueprint, Flask, Response, render_template, request, flash, redirect,
+    session, g, url_for, jsonify, current_app,
+)
 from flask_debugtoolbar import DebugToolbarExtension
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
-from werkzeug.exceptions import Unauthorized
+from werkzeug.exceptions import NotFound, Unauthorized
+from werkzeug.local import LocalProxy
 
+from activity import recent_activity
+from api import api
+from config import PROFILES
 from forms import UserAddForm, LoginForm, MessageForm, CsrfForm, EditUserProfile
-from models import db, connect_db, User, Message, LikedWarble
-
-load_dotenv()
+from fragments import fragment_cache
+from models import db, connect_db, User, Message, LikedWarble, Follows
+from http_cache import init_http_cache, validated_by
+from instrumentation import init_instrumentation, pool_options
+from membership import Membership
+from jobs import enqueue, queue, Worker
+from live import (
+    KEEPALIVE_FRAME, RETRY_FRAME, format_event, message_event, timeline_hub,
+)
+import migrations
+from notifications import inbox, mark_read, notification_buffer
+from pagination import (
+    PAGE_SIZE, MESSAGE_KEYS, USER_KEYS, current_cursor, next_cursor, paginate,
+)
+from passwords import hasher, ConcurrencyLimiter
+from replicas import reads_from_replica
+from search import UsernameIndex
+import services
+import timeline
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+TIMELINE_PAGE_SIZE = 100
+
+# Per-process state, configured by `create_app`.
+search_index = UsernameIndex()
+password_limiter = ConcurrencyLimiter()
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-toolbar = DebugToolbarExtension(app)
+toolbar = DebugToolbarExtension()
 
-connect_db(app)
+bp = Blueprint('chirper', __name__, cli_group=None)
 
 ##############################################################################
 # User signup/login/logout
 
-@app.before_request
+def get_csrf_form():
+    """Return this request's CsrfForm, building it on first use."""
+
+    if 'csrf_form' not in g:
+        g.csrf_form = CsrfForm()
+
+    return g.csrf_form
+
+
+@bp.before_app_request
 def add_user_and_form_to_g():
     """If we're logged in, add curr user to Flask global.
-    Adds CsrfForm to g whether user is logged in or not."""
-    g.csrf = CsrfForm()
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-        print(session[CURR_USER_KEY], 'the session')
-        print(g.user, 'the user')
+    The user comes from `user_cache`, so most requests don't query for it.
+    Static files and anonymous visitors (without a guest user) skip the
+    lookup entirely. `g.csrf` is only built if a route or template uses it.
+    """
 
-    else:
-        # G.USER in TESTING = NONE
-        # g.user = None
-        # G.USER in DEV = 304
-        # g.user = User.query.get(304)
-        # G.USER in PROD = 310
-        g.user = User.query.get(310)
+    # `connect_db` keeps an app context pushed, so `g` outlives a request;
+    # drop the previous request's form, and the CSRF token Flask-WTF keeps
+    # in `g`, which is signed for the previous request's session.
+    g.pop('csrf_form', None)
+    g.pop(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), None)
+    g.csrf = LocalProxy(get_csrf_form)
+    g.user = None
+    g.membership = None
+
+    if request.endpoint == 'static':
+        return
+
+    user_id = session.get(CURR_USER_KEY, current_app.config['GUEST_USER_ID'])
+
+    if user_id is not None:
+        g.user = user_cache.get(user_id)
+
+    if g.user:
+        g.membership = Membership(g.user.id)
+
+
+@bp.app_template_global()
+def is_following(user):
+    """Does the logged-in user follow `user`? For use in templates."""
+
+    return bool(g.membership) and g.membership.is_following(user)
+
+
+@bp.app_template_global()
+def has_liked(message):
+    """Has the logged-in user liked `message`? For use in templates."""
+
+    return bool(g.membership) and g.membership.has_liked(message)
 
 
 def do_login(user):
@@ -59,7 +130,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def handle_signup():
     """Handle user signup.
 
@@ -76,43 +147,46 @@ def handle_signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
-        print("GOT INSIDE FORM VALIDATION FOR SIGNUP POST ROUTE")
         try:
-            user = User.signup(
-                username=form.username.data,
-                password=form.password.data,
-                email=form.email.data,
-                image_url=form.image_url.data or User.image_url.default.arg,
-            )
+            with password_limiter.hold(ip=request.remote_addr):
+                user = User.signup(
+                    username=form.username.data,
+                    password=form.password.data,
+                    email=form.email.data,
+                    image_url=form.image_url.data or User.image_url.default.arg,
+                )
             db.session.commit()
+            search_index.add(user.id, user.username)
 
         except IntegrityError:
-            print("GOT INTEGRITY ERROR WHEN CREATING NEW USER")
+            logger.info("Signup failed: username or email already taken")
             db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
         do_login(user)
-        print("SUCCESSFUL POST SIGNUP, USER CREATED AND ABOUT TO REDIRECT")
+        logger.info("New user #%s signed up", user.id)
         return redirect("/")
 
     else:
-        print("FORM DIDN'T VALIDATE, EITHER A GET REQUEST OR INVALID FORM SUBMISSION")
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def handle_login():
     """Handle user login and redirect to homepage on success."""
 
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(
-            form.username.data,
-            form.password.data)
+        with password_limiter.hold(form.username.data, request.remote_addr):
+            user = User.authenticate(
+                form.username.data,
+                form.password.data)
 
         if user:
+            # Saves the password hash if it was upgraded to a new cost.
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -122,7 +196,7 @@ def handle_login():
     return render_template('users/login.html', form=form)
 
 
-@app.post('/logout')
+@bp.post('/logout')
 def handle_logout():
     """Handle logout of user and redirect to homepage."""
 
@@ -134,10 +208,50 @@ def handle_logout():
     else:
         raise Unauthorized()
 
+
+##############################################################################
+# Pagination (see pagination.py)
+
+
+@bp.app_template_global()
+def next_page_url(cursor):
+    """URL of the current page with its `after` cursor set to `cursor`."""
+
+    args = {**request.view_args, **request.args.to_dict(), 'after': cursor}
+    return url_for(request.endpoint, **args)
+
+
 ##############################################################################
 # General user routes:
 
-@app.get('/users')
+def user_page_versions(user_id):
+    """Versions of user `user_id` and the viewer, for validating their pages."""
+
+    versions = User.versions(user_id, g.user.id)
+
+    if user_id not in versions:
+        return None
+
+    return versions[user_id], versions.get(g.user.id)
+
+
+def message_page_versions(message_id):
+    """Versions of the message's author and the viewer, in one query."""
+
+    viewer_version = (select(User.version)
+                      .where(User.id == g.user.id)
+                      .scalar_subquery())
+
+    row = db.session.execute(
+        select(User.version, viewer_version)
+        .join(Message, Message.user_id == User.id)
+        .where(Message.id == message_id)).first()
+
+    return None if row is None else tuple(row)
+
+
+@bp.get('/users')
+@reads_from_replica
 def list_users():
     """Page with listing of users.
 
@@ -151,16 +265,54 @@ def list_users():
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
+        users, cursor = paginate(User.query, USER_KEYS)
     else:
-        users = User.query.filter(User
-                                  .username
-                                  .like(f"%{search}%")).all()
+        users, cursor = search_users(search, limit=PAGE_SIZE), None
+
+    g.membership.load(users=users)
+
+    return render_template('users/index.html', users=users, next_cursor=cursor)
+
+
+def search_users(search, limit):
+    """Return up to `limit` users whose username contains `search`, best first.
+
+    Matching ids come from the in-memory `search_index`; the rows are
+    loaded by primary key and re-checked, in case the index is stale.
+    """
+
+    ids = search_index.search(search, limit=limit)
+    by_id = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+    search = search.strip().lower()
+
+    return [by_id[user_id] for user_id in ids
+            if user_id in by_id and search in by_id[user_id].username.lower()]
+
+
+@bp.get('/users/typeahead')
+def users_typeahead():
+    """Return JSON list of users matching the `q` param, for search-as-you-type.
+
+    Takes an optional `limit` param (default 10, at most 20).
+    """
+
+    if not g.user:
+        raise Unauthorized()
+
+    search = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 20)
 
-    return render_template('users/index.html', users=users)
+    users = search_users(search, limit=limit) if search else []
 
+    return jsonify(users=[
+        {'id': user.id, 'username': user.username, 'image_url': user.image_url}
+        for user in users
+    ])
 
-@app.get('/users/<int:user_id>')
+
+@bp.get('/users/<int:user_id>')
+@reads_from_replica
+@validated_by(user_page_versions)
 def show_user(user_id):
     """Show user profile."""
 
@@ -169,11 +321,19 @@ def show_user(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
+    messages, cursor = paginate(Message.with_authors().filter_by(user_id=user.id),
+                                MESSAGE_KEYS)
+    g.membership.load(users=[user], messages=messages)
 
-    return render_template('users/show.html', user=user)
+    return render_template('users/show.html',
+                           user=user,
+                           messages=messages,
+                           next_cursor=cursor)
 
 
-@app.get('/users/<int:user_id>/following')
+@bp.get('/users/<int:user_id>/following')
+@reads_from_replica
+@validated_by(user_page_versions)
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -182,10 +342,22 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
-
-
-@app.get('/users/<int:user_id>/followers')
+    following, cursor = paginate(
+        User.query
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .filter(Follows.user_following_id == user.id),
+        USER_KEYS)
+    g.membership.load(users=[user, *following])
+
+    return render_template('users/following.html',
+                           user=user,
+                           following=following,
+                           next_cursor=cursor)
+
+
+@bp.get('/users/<int:user_id>/followers')
+@reads_from_replica
+@validated_by(user_page_versions)
 def show_followers(user_id):
     """Show list of followers of this user."""
 
@@ -194,10 +366,20 @@ def show_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    followers, cursor = paginate(
+        User.query
+        .join(Follows, Follows.user_following_id == User.id)
+        .filter(Follows.user_being_followed_id == user.id),
+        USER_KEYS)
+    g.membership.load(users=[user, *followers])
 
+    return render_template('users/followers.html',
+                           user=user,
+                           followers=followers,
+                           next_cursor=cursor)
 
-@app.post('/users/follow/<int:follow_id>')
+
+@bp.post('/users/follow/<int:follow_id>')
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user.
 
@@ -212,7 +394,14 @@ def start_following(follow_id):
 
         followed_user = User.query.get_or_404(follow_id)
         g.user.following.append(followed_user)
+        db.session.flush()
+        User.adjust_counts(g.user.id, following_count=1)
+        User.adjust_counts(followed_user.id, followers_count=1)
+        enqueue(services.backfill_timeline,
+                follower_id=g.user.id, followed_ids=[followed_user.id])
         db.session.commit()
+        user_cache.invalidate(g.user.id, followed_user.id)
+        notification_buffer.add(followed_user.id, 'follow', g.user.id)
 
         return redirect(f"/users/{g.user.id}/following")
 
@@ -220,7 +409,7 @@ def start_following(follow_id):
         raise Unauthorized()
 
 
-@app.post('/users/stop-following/<int:follow_id>')
+@bp.post('/users/stop-following/<int:follow_id>')
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user.
 
@@ -234,7 +423,12 @@ def stop_following(follow_id):
 
         followed_user = User.query.get(follow_id)
         g.user.following.remove(followed_user)
+        db.session.flush()
+        User.adjust_counts(g.user.id, following_count=-1)
+        User.adjust_counts(followed_user.id, followers_count=-1)
+        timeline.remove_follow(g.user.id, follow_id)
         db.session.commit()
+        user_cache.invalidate(g.user.id, follow_id)
 
         return redirect(f"/users/{g.user.id}/following")
 
@@ -243,7 +437,7 @@ def stop_following(follow_id):
 
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def update_profile():
     """GET: Render template for user to edit their profile.
 
@@ -251,21 +445,28 @@ def update_profile():
     if not g.user:
         raise Unauthorized()
 
-    form = EditUserProfile(obj=g.user)
+    current_user = g.user.instance
+    form = EditUserProfile(obj=current_user)
 
     if form.validate_on_submit():
-        g.user.username = form.username.data
-        g.user.email = form.email.data
-        g.user.image_url = form.image_url.data
-        g.user.header_image_url = form.header_image_url.data
-        g.user.bio = form.bio.data
-        password = form.password.data
+        with password_limiter.hold(current_user.username, request.remote_addr):
+            password_ok = current_user.check_password(form.password.data)
 
-        user = g.user.authenticate(g.user.username, password)
+        if password_ok:
+            if form.username.data != current_user.username:
+                current_user.renamed_at = datetime.utcnow()
+
+            current_user.username = form.username.data
+            current_user.email = form.email.data
+            current_user.image_url = form.image_url.data
+            current_user.header_image_url = form.header_image_url.data
+            current_user.bio = form.bio.data
+            current_user.version = User.version + 1
 
-        if user:
             db.session.commit()
-            return redirect(f"/users/{g.user.id}")
+            user_cache.invalidate(current_user.id)
+            search_index.add(current_user.id, current_user.username)
+            return redirect(f"/users/{current_user.id}")
         else:
             form.password.errors = ["Invalid password."]
             return render_template("/users/edit.html", form=form)
@@ -274,7 +475,7 @@ def update_profile():
         return render_template("/users/edit.html", form=form)
 
 
-@app.post('/users/delete')
+@bp.post('/users/delete')
 def delete_user():
     """Delete user.
 
@@ -287,14 +488,16 @@ def delete_user():
 
     do_logout()
 
-    deleted_messages = Message.query.filter(Message.user_id == g.user.id).all()
-
-    for message in deleted_messages:
-        db.session.delete(message)
-
-    db.session.delete(g.user)
+    timeline.purge_user(g.user.id)
+    User.purge(g.user.id)
     db.session.commit()
 
+    # Followers', followees' and likers' counters changed; rather than
+    # finding them all, start the cache over.
+    user_cache.clear()
+    search_index.remove(g.user.id)
+    recent_activity.remove_user(g.user.id)
+
     return redirect("/signup")
 
 
@@ -302,7 +505,7 @@ def delete_user():
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def add_message():
     """Add a message:
 
@@ -316,16 +519,16 @@ def add_message():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
-        db.session.commit()
+        services.post_message(g.user, form.text.data)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/create.html', form=form)
 
 
-@app.get('/messages/<int:message_id>')
+@bp.get('/messages/<int:message_id>')
+@reads_from_replica
+@validated_by(message_page_versions)
 def show_message(message_id):
     """Show a message."""
 
@@ -333,11 +536,11 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
+    msg = Message.with_authors().get_or_404(message_id)
     return render_template('messages/show.html', message=msg)
 
 
-@app.post('/messages/<int:message_id>/delete')
+@bp.post('/messages/<int:message_id>/delete')
 def delete_message(message_id):
     """Delete a message.
 
@@ -352,8 +555,7 @@ def delete_message(message_id):
             return redirect("/")
 
         msg = Message.query.get_or_404(message_id)
-        db.session.delete(msg)
-        db.session.commit()
+        services.delete_message(msg)
 
         return redirect(f"/users/{g.user.id}")
 
@@ -364,7 +566,7 @@ def delete_message(message_id):
 ##############################################################################
 # Liked Warbles Routes
 
-@app.post('/messages/<int:message_id>/like')
+@bp.post('/messages/<int:message_id>/like')
 def add_liked_warble(message_id):
     """Adds liked warble to the LikedWarble table. Redirects user back to the page that they were currently visiting."""
 
@@ -383,11 +585,14 @@ def add_liked_warble(message_id):
     liked_warble = LikedWarble(user_id = g.user.id, message_id=message.id)
 
     db.session.add(liked_warble)
+    User.adjust_counts(g.user.id, liked_messages_count=1)
     db.session.commit()
+    user_cache.invalidate(g.user.id)
+    notification_buffer.add(message.user_id, 'like', g.user.id, message.id)
 
     return redirect(origin_page)
 
-@app.post('/messages/<int:message_id>/unlike')
+@bp.post('/messages/<int:message_id>/unlike')
 def remove_liked_warble(message_id):
     """Removes likedWarble instance and removes from the likedWarbles table. Redirects user to the page they were previously on"""
 
@@ -403,12 +608,15 @@ def remove_liked_warble(message_id):
                                              message.id == LikedWarble.message_id).first()
 
     db.session.delete(liked_warble)
+    User.adjust_counts(g.user.id, liked_messages_count=-1)
 
     db.session.commit()
+    user_cache.invalidate(g.user.id)
 
     return redirect(origin_page)
 
-@app.get('/users/<int:user_id>/liked_messages')
+@bp.get('/users/<int:user_id>/liked_messages')
+@reads_from_replica
 def show_liked_warbles(user_id):
     """Displays user profile and a list of the users liked messages."""
 
@@ -416,61 +624,280 @@ def show_liked_warbles(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get(user_id)
+    user = User.query.get_or_404(user_id)
+    messages, cursor = paginate(
+        Message
+        .with_authors()
+        .join(LikedWarble, LikedWarble.message_id == Message.id)
+        .filter(LikedWarble.user_id == user.id),
+        MESSAGE_KEYS)
 
-    return render_template('/users/liked_warbles.html', user=user)
+    if g.membership:
+        g.membership.load(messages=messages)
+
+    return render_template('/users/liked_warbles.html',
+                           user=user,
+                           messages=messages,
+                           next_cursor=cursor)
+
+
+##############################################################################
+# Notifications
+
+
+@bp.get('/notifications')
+def show_notifications():
+    """Show the current user's notifications and mark them all read."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    notifications = inbox(g.user.id)
+
+    if g.user.unread_notifications:
+        mark_read(g.user.id)
+        db.session.commit()
+        user_cache.invalidate(g.user.id)
+        g.user = user_cache.get(g.user.id)
+
+    return render_template('notifications.html', notifications=notifications)
+
+
+##############################################################################
+# Live updates
+
+
+def open_timeline_stream(loop=None):
+    """Subscribe `g.user` to new messages from the users they follow.
+
+    Returns the subscription (an `AsyncSubscription` read on `loop`, if
+    given) and the events missed since the request's `Last-Event-ID`. Used
+    by `stream_timeline` and by the ASGI app, which serves the stream itself.
+    """
+
+    if not g.user:
+        raise Unauthorized()
+
+    author_ids = db.session.scalars(
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == g.user.id)).all()
+
+    subscription = timeline_hub.subscribe(g.user.id, author_ids, loop)
+
+    try:
+        missed = []
+        last_id = request.headers.get('Last-Event-ID', type=int)
+
+        if last_id is not None:
+            missed = (Message
+                      .with_authors()
+                      .filter(Message.user_id.in_(subscription.author_ids))
+                      .filter(Message.id > last_id)
+                      .order_by(Message.id)
+                      .limit(TIMELINE_PAGE_SIZE)
+                      .all())
+            missed = [message_event(msg, msg.user) for msg in missed]
+    except BaseException:
+        timeline_hub.unsubscribe(subscription)
+        raise
+
+    return subscription, missed
+
+
+@bp.get('/stream/timeline')
+def stream_timeline():
+    """Stream new messages for the home timeline as Server-Sent Events.
+
+    A browser reconnecting with `Last-Event-ID` is first sent the messages
+    it missed. The stream ends after `STREAM_MAX_AGE` seconds, and the
+    browser reconnects.
+
+    Only served here under gevent with `STREAM_WSGI` set (see live.py);
+    otherwise the ASGI app serves it.
+    """
+
+    if not timeline_hub.serve_wsgi:
+        raise NotFound()
+
+    subscription, missed = open_timeline_stream()
+
+    heartbeat = timeline_hub.heartbeat
+    deadline = time.monotonic() + timeline_hub.max_age
+
+    # Runs after the request has ended, so it must not touch the database.
+    def events():
+        try:
+            yield RETRY_FRAME
+
+            for event in missed:
+                yield format_event(event)
+
+            while not subscription.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                event = subscription.get(timeout=min(heartbeat, remaining))
+                yield format_event(event) if event else KEEPALIVE_FRAME
+        finally:
+            timeline_hub.unsubscribe(subscription)
+
+    return Response(events(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+##############################################################################
+# Maintenance commands
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade():
+    """Create missing tables and apply pending schema migrations."""
+
+    for version in migrations.upgrade():
+        print(f"Applied {version}")
+
+
+@bp.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Rebuild every user's message/follow/like counters from base tables."""
+
+    User.reconcile_counts()
+    db.session.commit()
+
+
+@bp.cli.command('worker')
+@click.option('--concurrency', type=int, default=None,
+              help="Threads running jobs (default: WORKER_CONCURRENCY).")
+@click.option('--once', is_flag=True,
+              help="Run the jobs that are due now, then exit.")
+def run_worker(concurrency, once):
+    """Run background jobs (see jobs.py)."""
+
+    worker = Worker(current_app._get_current_object(),
+                    queue,
+                    concurrency=concurrency or current_app.config['WORKER_CONCURRENCY'],
+                    poll_interval=current_app.config['WORKER_POLL_INTERVAL'])
+
+    if once:
+        while worker.work_once(limit=100):
+            pass
+    else:
+        logger.info("Worker running with %s threads", worker.concurrency)
+        worker.run()
+
+    for name, stats in worker.stats().items():
+        logger.info("%s: %s", name, stats)
+
+
+@bp.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild every stored home timeline from follows and messages."""
+
+    timeline.rebuild_all()
+    db.session.commit()
 
 
 ##############################################################################
 # Homepage and error pages
 
 
-@app.get('/')
+@bp.get('/')
+@reads_from_replica
 def display_homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, read from
+      the user's precomputed timeline, with a cursor to the next 100
     """
 
     if g.user:
 
-        followed_users = g.user.following
-        followed_users.append(g.user)
-        ids = [user.id for user in followed_users]
-
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        messages = timeline.home_timeline(g.user,
+                                          limit=TIMELINE_PAGE_SIZE + 1,
+                                          before=current_cursor(MESSAGE_KEYS))
+        cursor = next_cursor(messages, MESSAGE_KEYS, TIMELINE_PAGE_SIZE)
+        messages = messages[:TIMELINE_PAGE_SIZE]
 
-        recent_messages = (Message.query.order_by(Message.timestamp.desc()).limit(10).all())
-        print(recent_messages[0].user.id)
+        recent_messages = recent_activity.recent()
+        trending_messages = recent_activity.trending()
+        g.membership.load(
+            messages=[*messages, *recent_messages, *trending_messages])
 
-        return render_template('home.html', messages=messages, recent_messages=recent_messages)
+        return render_template('home.html',
+                               messages=messages,
+                               recent_messages=recent_messages,
+                               trending_messages=trending_messages,
+                               next_cursor=cursor,
+                               live_updates=timeline_hub.available)
 
     else:
         return render_template('home-anon.html')
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
-
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+# App factory
+
+
+def create_app(config=None):
+    """Create the Chirper app.
+
+    `config` is a profile name from config.py ("development", "production",
+    "testing"), or a dict of settings applied over the `CHIRPER_ENV` profile.
+    """
+
+    if isinstance(config, str):
+        profile, overrides = config, {}
+    else:
+        profile = os.environ.get('CHIRPER_ENV', 'development')
+        overrides = config or {}
+
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile])
+    app.config.update(overrides)
+
+    for name in ('SQLALCHEMY_DATABASE_URI', 'SECRET_KEY'):
+        if not app.config[name]:
+            raise RuntimeError(f"{name} is not set (see config.py)")
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          pool_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    logging.basicConfig(
+        level=app.config['LOG_LEVEL'],
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if app.config['DEBUG_TOOLBAR']:
+        toolbar.init_app(app)
+
+    search_index.refresh_interval = app.config['SEARCH_INDEX_REFRESH']
+    user_cache.maxsize = app.config['USER_CACHE_SIZE']
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    password_limiter.limits = {'user': app.config['LOGIN_CONCURRENCY_PER_USER'],
+                               'ip': app.config['LOGIN_CONCURRENCY_PER_IP']}
+
+    connect_db(app)
+    init_instrumentation(app)
+    hasher.init_app(app)
+    init_http_cache(app)
+    fragment_cache.init_app(app)
+    recent_activity.init_app(app)
+    queue.init_app(app)
+    notification_buffer.init_app(app)
+    timeline_hub.init_app(app)
+
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+
+    return app
+
+
+app = create_app()
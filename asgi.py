@@ -0,0 +1,339 @@
+"""ASGI entry point, serving the read-heavy pages on an event loop.
+
+Under gunicorn's sync workers, a request holds its worker (or thread) for as
+long as its queries take, so a few slow queries can stall a whole process.
+Run the app through this module instead:
+
+    uvicorn asgi:application --workers 4
+
+and the home page, profiles, the user list and following/followers pages
+(`ASYNC_ENDPOINTS`) are served on the event loop with an async database
+driver (asyncpg), so one process can have many of them waiting on the
+database at once.
+
+The routes themselves are not rewritten. Each async request runs the normal
+Flask view inside `AsyncSession.run_sync`, with `db.session` bound to that
+session for the request: the views, templates and models are shared with the
+WSGI app, and every query they make goes out through asyncpg, handing the
+event loop to other requests while it waits.
+
+The live timeline stream (`/stream/timeline`) is served on the event loop
+too: it is opened like an async request, then waits for new messages on an
+`AsyncSubscription`, so an open stream holds no thread, just a queue.
+
+Every other route (forms, writes, the JSON API) runs as plain WSGI on a pool
+of `ASGI_THREADS` threads with the normal sync engine. This needs the
+`asyncpg` and `uvicorn` packages.
+"""
+
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import app, open_timeline_stream
+from instrumentation import pool_options
+from live import KEEPALIVE_FRAME, RETRY_FRAME, format_event, timeline_hub
+from models import db
+
+ASYNC_ENDPOINTS = frozenset({
+    'chirper.display_homepage',
+    'chirper.show_user',
+    'chirper.list_users',
+    'chirper.show_following',
+    'chirper.show_followers',
+})
+
+ASYNC_METHODS = frozenset({'GET', 'HEAD'})
+
+STREAM_ENDPOINT = 'chirper.stream_timeline'
+
+STREAM_HEADERS = [(b'content-type', b'text/event-stream; charset=utf-8'),
+                  (b'cache-control', b'no-cache'),
+                  (b'x-accel-buffering', b'no')]
+
+
+def async_url(url):
+    """`url` with its driver swapped for asyncpg."""
+
+    return make_url(url).set(drivername='postgresql+asyncpg')
+
+
+def build_environ(scope, body):
+    """The WSGI environ for ASGI HTTP `scope` with request `body`."""
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+def start_wsgi(app, environ):
+    """Call WSGI `app`; return its status code, headers and body iterable."""
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(name.lower().encode('latin-1'),
+                               value.encode('latin-1'))
+                              for name, value in headers]
+
+    body = app(environ, start_response)
+    return started['status'], started['headers'], body
+
+
+class AsyncApp:
+    """ASGI app that serves `ASYNC_ENDPOINTS` of Flask `app` asynchronously.
+
+    `ASYNC_DATABASE_URL` sets the database for async requests; it defaults
+    to `SQLALCHEMY_DATABASE_URI` with the asyncpg driver. They always read
+    from it, never from the read replicas.
+    """
+
+    def __init__(self, app, endpoints=ASYNC_ENDPOINTS):
+        self.app = app
+        self.endpoints = endpoints
+
+        url = (app.config['ASYNC_DATABASE_URL']
+               or async_url(app.config['SQLALCHEMY_DATABASE_URI']))
+        options = pool_options(str(url))
+        options.pop('poolclass', None)
+
+        self.engine = create_async_engine(url, **options)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.executor = ThreadPoolExecutor(app.config['ASGI_THREADS'],
+                                           thread_name_prefix='wsgi')
+
+        # Pages open the live stream, now that it is served.
+        timeline_hub.available = True
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            raise NotImplementedError(f"Unsupported ASGI scope {scope['type']!r}")
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        environ = build_environ(scope, body)
+
+        if self.serves_stream(environ):
+            await self.stream(environ, receive, send)
+        elif self.serves_async(environ):
+            status, headers, body = await self.run_async(environ)
+            await send({'type': 'http.response.start',
+                        'status': status,
+                        'headers': headers})
+            await send({'type': 'http.response.body', 'body': body})
+        else:
+            await self.run_threaded(environ, receive, send)
+
+    def _endpoint(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None
+
+        return endpoint
+
+    def serves_async(self, environ):
+        """Is this request for one of the async endpoints?"""
+
+        return (environ['REQUEST_METHOD'] in ASYNC_METHODS
+                and self._endpoint(environ) in self.endpoints)
+
+    def serves_stream(self, environ):
+        """Is this request for the live timeline stream?"""
+
+        return (environ['REQUEST_METHOD'] == 'GET'
+                and self._endpoint(environ) == STREAM_ENDPOINT)
+
+    async def run_async(self, environ):
+        """Run the request in a greenlet with an asyncpg-backed session."""
+
+        async with self.sessions() as session:
+            return await session.run_sync(self._call_with_session, environ)
+
+    def _call_with_session(self, session, environ):
+        # The app context outlives the request, so the request uses it (and
+        # the session set for it) rather than pushing its own.
+        with self.app.app_context():
+            db.session.registry.set(session)
+
+            status, headers, body = start_wsgi(self.app, environ)
+            try:
+                return status, headers, b''.join(body)
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+
+    async def stream(self, environ, receive, send):
+        """Serve the live timeline stream on the event loop.
+
+        The stream is opened (the user loaded, and missed messages read)
+        like an async request. Then it waits on its subscription until
+        `STREAM_MAX_AGE` is up or the client goes away.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        async with self.sessions() as session:
+            subscription, missed, error = await session.run_sync(
+                self._open_stream, environ, loop)
+
+        if error is not None:
+            status, headers, body = start_wsgi(error, environ)
+            await send({'type': 'http.response.start',
+                        'status': status,
+                        'headers': headers})
+            await send({'type': 'http.response.body', 'body': b''.join(body)})
+            return
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            subscription.close()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        deadline = time.monotonic() + timeline_hub.max_age
+
+        async def send_frame(frame):
+            await send({'type': 'http.response.body',
+                        'body': frame.encode(),
+                        'more_body': True})
+
+        try:
+            await send({'type': 'http.response.start',
+                        'status': 200,
+                        'headers': STREAM_HEADERS})
+
+            await send_frame(RETRY_FRAME)
+            for event in missed:
+                await send_frame(format_event(event))
+
+            while not subscription.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                event = await subscription.next(
+                    min(timeline_hub.heartbeat, remaining))
+                if not subscription.closed:
+                    await send_frame(format_event(event) if event
+                                     else KEEPALIVE_FRAME)
+
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            timeline_hub.unsubscribe(subscription)
+
+    def _open_stream(self, session, environ, loop):
+        # As in `_call_with_session`, but only the `before_request` hooks
+        # (which load the user) run before the stream is opened.
+        with self.app.app_context():
+            db.session.registry.set(session)
+
+            with self.app.request_context(environ):
+                try:
+                    self.app.preprocess_request()
+                    return (*open_timeline_stream(loop), None)
+                except HTTPException as error:
+                    return None, None, error.get_response(environ)
+
+    async def run_threaded(self, environ, receive, send):
+        """Run the request as plain WSGI on the thread pool, streaming its
+        response until it ends or the client goes away."""
+
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(
+            self.executor, start_wsgi, self.app, environ)
+        chunks = iter(body)
+
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+
+        try:
+            await send({'type': 'http.response.start',
+                        'status': status,
+                        'headers': headers})
+
+            while not disconnected.is_set():
+                chunk = await loop.run_in_executor(
+                    self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body',
+                            'body': chunk,
+                            'more_body': True})
+
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            if hasattr(body, 'close'):
+                await loop.run_in_executor(self.executor, body.close)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = AsyncApp(app)
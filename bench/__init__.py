@@ -0,0 +1 @@
+"""Benchmarks for Chirper. See the README's "Benchmarks" section."""
@@ -0,0 +1,88 @@
+"""Run the benchmarks and check them against the baseline.
+
+    python -m bench [--baseline bench/baseline.json] [--save-baseline]
+                    [--seconds 2] [--clients 50] [--duration 20]
+                    [--workers 2] [--mode sync] [--no-load]
+                    [--tolerance 0.2] [--output report.json]
+
+Runs the micro-benchmarks (bench/micro.py) and then the load scenarios
+(bench/scenarios.py) against the dataset in DATABASE_URL, e.g. one loaded
+with `python -m bench.datasets 1k --load`. Writes the report to `--output`,
+compares it with `--baseline` and exits with status 1 if anything regressed
+(see bench/baseline.py). `--save-baseline` stores the report as the new
+baseline instead.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+from bench import baseline, micro, scenarios
+from bench.server import SERVERS
+
+DEFAULT_BASELINE = Path(__file__).parent / 'baseline.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--seconds', type=float, default=2,
+                        help="time per micro-benchmark")
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--mode', default='sync', choices=list(SERVERS))
+    parser.add_argument('--no-load', dest='load', action='store_false',
+                        help="skip the load scenarios")
+    parser.add_argument('--tolerance', type=float,
+                        default=baseline.DEFAULT_TOLERANCE,
+                        help="allowed slowdown, as a fraction")
+    parser.add_argument('--output', default='report.json')
+    args = parser.parse_args()
+
+    from app import app
+
+    with app.app_context():
+        report = {'dataset': baseline.dataset_counts(),
+                  'machine': baseline.machine(),
+                  'micro': micro.run(seconds=args.seconds)}
+
+    micro.print_results(report['micro'])
+
+    if args.load:
+        report['scenarios'] = scenarios.run(args.clients, args.duration,
+                                            args.warmup, args.mode,
+                                            args.workers)
+        report['settings'] = {'clients': args.clients,
+                              'duration': args.duration,
+                              'mode': args.mode,
+                              'workers': args.workers}
+        print()
+        scenarios.print_summary(report['scenarios'])
+
+    baseline.write(args.output, report)
+
+    if args.save_baseline:
+        baseline.write(args.baseline, report)
+        print(f"\nSaved the baseline to {args.baseline}")
+        return
+
+    old = baseline.read(args.baseline)
+
+    if not baseline.same_machine(old, report):
+        print("\nThe baseline was recorded on another machine "
+              f"({old.get('machine')}); timings may not compare.")
+
+    regressions = baseline.compare(old, report, args.tolerance)
+
+    if regressions:
+        print("\nRegressions against the baseline:")
+        print("\n".join(f"  {regression}" for regression in regressions))
+        sys.exit(1)
+
+    print("\nNo regressions against the baseline.")
+
+
+main()
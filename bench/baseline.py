@@ -0,0 +1,140 @@
+"""Comparing benchmark results against a stored baseline.
+
+A report (see bench/__main__.py) holds the dataset it ran on, the machine,
+the micro-benchmark results and the load scenario summary. Comparing one
+with the baseline gives a list of regressions:
+
+- queries per operation or request are deterministic, so any increase
+  (beyond `QUERY_SLACK`, for averages over cache hits and misses) counts
+- throughput and p95 latency depend on the machine, so they count when
+  they are worse by more than `tolerance` (a fraction)
+- so does an error rate in the load run above the baseline's
+
+Load run throughput is only compared between runs with the same settings.
+
+Reports for different datasets can't be compared.
+"""
+
+import json
+import os
+import platform
+import sys
+
+from sqlalchemy import func, select
+
+DEFAULT_TOLERANCE = 0.2
+
+QUERY_SLACK = 0.5
+
+
+def dataset_counts():
+    """Users and follows in DATABASE_URL. (Load runs add messages, but
+    undo their likes and follows.)"""
+
+    from models import db, Follows, User
+
+    return {model.__tablename__: db.session.scalar(
+                select(func.count()).select_from(model))
+            for model in (User, Follows)}
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def read(path):
+    with open(path) as baseline:
+        return json.load(baseline)
+
+
+def write(path, report):
+    with open(path, 'w') as baseline:
+        json.dump(report, baseline, indent=2, sort_keys=True)
+        baseline.write('\n')
+
+
+def _worse(name, metric, baseline, current, tolerance, higher_is_better):
+    if not baseline or current is None:
+        return None
+
+    change = (current - baseline) / baseline
+    if higher_is_better:
+        change = -change
+
+    if change > tolerance:
+        return (f"{name}: {metric} {baseline} -> {current} "
+                f"({change:+.0%} worse)")
+
+
+def _more_queries(name, baseline, current, query_slack):
+    if baseline is not None and current is not None \
+            and current > baseline + query_slack:
+        return f"{name}: queries {baseline} -> {current}"
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE,
+            query_slack=QUERY_SLACK):
+    """Return the regressions in report `current` against `baseline`."""
+
+    if baseline.get('dataset') != current.get('dataset'):
+        raise ValueError(f"The baseline ran on dataset {baseline.get('dataset')}"
+                         f", not {current.get('dataset')}")
+
+    regressions = []
+
+    for name, old in baseline.get('micro', {}).items():
+        new = current.get('micro', {}).get(name)
+        if new is None:
+            continue
+
+        regressions += [
+            _more_queries(name, old['queries'], new['queries'], query_slack),
+            _worse(name, 'ops/s', old['ops'], new['ops'], tolerance, True),
+            _worse(name, 'p95 ms', old['p95_ms'], new['p95_ms'], tolerance,
+                   False),
+        ]
+
+    old_load = baseline.get('scenarios')
+    new_load = current.get('scenarios')
+
+    if old_load and new_load:
+        for label, old in old_load['requests'].items():
+            new = new_load['requests'].get(label)
+            if new is not None:
+                regressions.append(_more_queries(label, old['queries'],
+                                                 new['queries'], query_slack))
+
+    # Throughput at other settings (e.g. clients) isn't comparable.
+    if old_load and new_load \
+            and baseline.get('settings') == current.get('settings'):
+        old, new = old_load['total'], new_load['total']
+        regressions += [
+            _worse('load', 'req/s', old['rps'], new['rps'], tolerance, True),
+            _worse('load', 'p95 ms', old['p95_ms'], new['p95_ms'], tolerance,
+                   False),
+        ]
+
+        old_errors = old['errors'] / max(1, old['requests'] + old['errors'])
+        new_errors = new['errors'] / max(1, new['requests'] + new['errors'])
+        if new_errors > old_errors + 0.01:
+            regressions.append(f"load: error rate {old_errors:.1%} -> "
+                               f"{new_errors:.1%}")
+
+    return [regression for regression in regressions if regression]
+
+
+def same_machine(baseline, current):
+    return baseline.get('machine') == current.get('machine')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m bench.baseline BASELINE REPORT")
+
+    found = compare(read(sys.argv[1]), read(sys.argv[2]))
+    print("\n".join(found) or "No regressions")
+    sys.exit(1 if found else 0)
@@ -0,0 +1,89 @@
+"""Reproducible benchmark datasets, from 1k to 1M users.
+
+    python -m bench.datasets 10k [--load] [--processes 4]
+
+Writes the CSVs for a scale in `SCALES` to bench/data/<scale> with
+generator/create_csvs.py. The seed, shard count and timestamp range are
+fixed per scale, so every machine gets the same rows, and a directory that
+already holds the scale (per its manifest.json) is reused rather than
+generated again.
+
+With `--load`, the dataset is then loaded into DATABASE_URL with seed.py,
+which drops every table there first: point DATABASE_URL at a database kept
+for benchmarks.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent / 'data'
+GENERATOR_DIR = Path(__file__).parent.parent / 'generator'
+
+# Sizes, and shards (which change the data) for each scale.
+SCALES = {
+    '1k': dict(users=1_000, messages=10_000, follows=20_000, shards=1),
+    '10k': dict(users=10_000, messages=100_000, follows=200_000, shards=4),
+    '100k': dict(users=100_000, messages=1_000_000, follows=2_000_000,
+                 shards=16),
+    '1m': dict(users=1_000_000, messages=10_000_000, follows=20_000_000,
+               shards=64),
+}
+
+SEED = 0
+
+# End of the range message timestamps are drawn from.
+NOW = datetime(2024, 1, 1)
+
+
+def generate(scale, processes=None):
+    """Write (or reuse) the CSVs for `scale`; return their directory."""
+
+    options = dict(SCALES[scale], seed=SEED, now=NOW)
+    recorded = dict(options, now=NOW.isoformat())
+    out_dir = DATA_DIR / scale
+    manifest = out_dir / 'manifest.json'
+
+    if manifest.exists() and json.loads(manifest.read_text()) == recorded:
+        print(f"Using the {scale} dataset in {out_dir}")
+        return out_dir
+
+    # create_csvs.py imports its helpers as a top-level module.
+    sys.path.insert(0, str(GENERATOR_DIR))
+    from create_csvs import generate as create_csvs
+
+    manifest.unlink(missing_ok=True)
+    create_csvs(out_dir=out_dir, processes=processes, **options)
+    manifest.write_text(json.dumps(recorded, indent=2))
+
+    return out_dir
+
+
+def load(scale, processes=None):
+    """Generate `scale` if needed and load it into DATABASE_URL."""
+
+    data_dir = generate(scale, processes)
+
+    from seed import seed
+    seed(data_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scale', choices=list(SCALES))
+    parser.add_argument('--load', action='store_true',
+                        help="load it into DATABASE_URL, replacing its tables")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="generator processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    if args.load:
+        load(args.scale, args.processes)
+    else:
+        generate(args.scale, args.processes)
+
+
+if __name__ == '__main__':
+    main()
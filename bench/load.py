@@ -0,0 +1,218 @@
+"""A small HTTP load generator, built on asyncio streams.
+
+Each virtual user has a `Client`: one connection (reopened when the server
+closes it, as gunicorn's sync workers do after every response) and a cookie
+jar. It runs a scenario, an async function making one pass through some
+requests, over and over until the time is up.
+
+Every request is recorded under a label (e.g. "GET /users/<id>") with its
+status and latency, measured from just before connecting or sending to the
+end of the body, so it includes time spent queued for a busy server. If the
+server sends a `Server-Timing` header (`REQUEST_STATS=header`), the number
+of SQL queries the request made is recorded too.
+"""
+
+import asyncio
+import re
+import time
+from urllib.parse import urlencode
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', 'replace')
+
+    @property
+    def queries(self):
+        """SQL queries the server reported for this request, if it did."""
+
+        match = QUERIES_RE.search(self.headers.get('server-timing', ''))
+        return int(match.group(1)) if match else None
+
+
+class Stats:
+    """Latencies, failures and query counts per request label."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.queries = {}
+        self.elapsed = 0.0
+
+    def record(self, label, status, latency, queries=None):
+        if status is None or status >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+            self.latencies.setdefault(label, [])
+            return
+
+        self.latencies.setdefault(label, []).append(latency)
+
+        if queries is not None:
+            self.queries.setdefault(label, []).append(queries)
+
+    def summary(self):
+        """Per-label and total numbers, with latencies in milliseconds."""
+
+        labels = {label: self._summarize(latencies,
+                                         self.errors.get(label, 0),
+                                         self.queries.get(label, []))
+                  for label, latencies in sorted(self.latencies.items())}
+
+        total = self._summarize(
+            [latency for latencies in self.latencies.values()
+             for latency in latencies],
+            sum(self.errors.values()),
+            [count for counts in self.queries.values() for count in counts])
+
+        return {'total': total, 'requests': labels}
+
+    def _summarize(self, latencies, errors, queries):
+        ordered = sorted(latencies)
+
+        return {
+            'requests': len(ordered),
+            'errors': errors,
+            'rps': round(len(ordered) / self.elapsed, 1) if self.elapsed else 0,
+            'p50_ms': percentile(ordered, 50),
+            'p95_ms': percentile(ordered, 95),
+            'p99_ms': percentile(ordered, 99),
+            'queries': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+
+
+def percentile(ordered, p, digits=2):
+    """The `p`th percentile of sorted seconds `ordered`, in milliseconds."""
+
+    if not ordered:
+        return None
+
+    index = min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))
+    return round(ordered[index] * 1000, digits)
+
+
+async def read_response(reader):
+    """Read one response; return (status, headers, body)."""
+
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = (f"{headers[name]}\n{value}" if name in headers
+                             else value)
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            chunks.append((await reader.readexactly(size + 2))[:-2])
+            if size == 0:
+                break
+        body = b''.join(chunks)
+    else:
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+    return status, headers, body
+
+
+class Client:
+    """One virtual user's connection and cookies."""
+
+    def __init__(self, host, port, stats, cookies=None):
+        self.host = host
+        self.port = port
+        self.stats = stats
+        self.cookies = dict(cookies or {})
+
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, form=None, label=None):
+        """Send a request and return its `Response`, or None if the
+        connection failed. `form` is sent url-encoded."""
+
+        label = f"{method} {label or path}"
+        body = urlencode(form).encode() if form is not None else b''
+
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}"]
+        if self.cookies:
+            head.append("Cookie: " + "; ".join(
+                f"{name}={value}" for name, value in self.cookies.items()))
+        if form is not None:
+            head += ["Content-Type: application/x-www-form-urlencoded",
+                     f"Content-Length: {len(body)}"]
+        request = ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+        started = time.perf_counter()
+
+        try:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(
+                    self.host, self.port)
+
+            self._writer.write(request)
+            status, headers, body = await read_response(self._reader)
+
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            self.stats.record(label, None, None)
+            self.close()
+            await asyncio.sleep(0.01)
+            return None
+
+        response = Response(status, headers, body)
+        self.stats.record(label, status, time.perf_counter() - started,
+                          response.queries)
+
+        for cookie in headers.get('set-cookie', '').split('\n'):
+            name, _, value = cookie.split(';', 1)[0].partition('=')
+            if name:
+                self.cookies[name.strip()] = value.strip()
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        return response
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+async def run(host, port, users, duration):
+    """Run virtual `users`, a list of `(scenario, cookies)` pairs, for
+    `duration` seconds against `host:port`; return the `Stats`.
+
+    `scenario(client)` is called repeatedly with the user's `Client`.
+    """
+
+    stats = Stats()
+    started = time.monotonic()
+    deadline = started + duration
+
+    async def user(scenario, cookies):
+        client = Client(host, port, stats, cookies)
+        try:
+            while time.monotonic() < deadline:
+                await scenario(client)
+        finally:
+            client.close()
+
+    await asyncio.gather(*(user(scenario, cookies)
+                           for scenario, cookies in users))
+
+    stats.elapsed = time.monotonic() - started
+    return stats
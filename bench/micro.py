@@ -0,0 +1,239 @@
+"""Micro-benchmarks of hot model and query code, without a server.
+
+    python -m bench.micro [--seconds 2] [--output micro.json] [name ...]
+
+Runs each benchmark in `BENCHMARKS` (or just those named) against the
+dataset in DATABASE_URL for about `--seconds` seconds, and prints and
+writes operations per second, p50/p95/p99 latency and SQL queries per
+operation. Subjects are picked from the data: the user who follows the
+most people, one user they follow and one they don't.
+
+Each operation runs in a request context, so its queries are counted the
+same way as a request's (see instrumentation.py). Anything an operation
+changes (e.g. a rehashed password) is rolled back before the next one,
+outside the timing.
+"""
+
+import argparse
+import json
+import time
+
+from flask import g
+from sqlalchemy import select
+
+from bench.load import percentile
+
+BENCHMARKS = {}
+
+# Every benchmark runs at least this many times, however slow it is.
+MIN_RUNS = 5
+
+
+def benchmark(fn):
+    """Register `fn`, which takes the subjects dict and returns the
+    operation to time, under its name."""
+
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+@benchmark
+def authenticate(subjects):
+    from models import User
+
+    def op():
+        assert User.authenticate(subjects['username'], 'password')
+
+    return op
+
+
+@benchmark
+def authenticate_unknown_user(subjects):
+    from models import User
+
+    def op():
+        assert not User.authenticate('no-such-user', 'password')
+
+    return op
+
+
+@benchmark
+def is_following(subjects):
+    from models import db, User
+
+    user = db.session.get(User, subjects['user_id'])
+    followed = db.session.get(User, subjects['followed_id'])
+
+    def op():
+        assert user.is_following(followed)
+
+    return op
+
+
+@benchmark
+def is_not_following(subjects):
+    from models import db, User
+
+    user = db.session.get(User, subjects['user_id'])
+    other = db.session.get(User, subjects['other_id'])
+
+    def op():
+        assert not user.is_following(other)
+
+    return op
+
+
+@benchmark
+def timeline_query(subjects):
+    """Build and compile the stored timeline query, without running it.
+    (SQLAlchemy caches compiled statements, so this is the cost of a
+    cache miss.)"""
+
+    from models import db
+    from timeline import stored_timeline
+
+    dialect = db.engine.dialect
+
+    def op():
+        stored_timeline(subjects['user_id']).statement.compile(dialect=dialect)
+
+    return op
+
+
+@benchmark
+def home_timeline(subjects):
+    from models import db, User
+    import timeline
+
+    user = db.session.get(User, subjects['user_id'])
+
+    def op():
+        timeline.home_timeline(user)
+
+    return op
+
+
+def pick_subjects():
+    """The users the benchmarks run as and against."""
+
+    from models import db, Follows, User
+
+    user_id, username = db.session.execute(
+        select(User.id, User.username)
+        .order_by(User.following_count.desc(), User.id)
+        .limit(1)).one()
+
+    followed_id = db.session.scalar(
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == user_id)
+        .limit(1))
+
+    other_id = db.session.scalar(
+        select(User.id)
+        .where(User.id != user_id)
+        .where(User.id.not_in(
+            select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == user_id)))
+        .limit(1))
+
+    return {'user_id': user_id,
+            'username': username,
+            'followed_id': followed_id,
+            'other_id': other_id}
+
+
+def discard_changes():
+    from models import db
+
+    # Rolling back expires the subjects, so only do it after a write.
+    if db.session.dirty or db.session.new or db.session.deleted:
+        db.session.rollback()
+
+
+def measure(op, seconds, max_runs=100000):
+    """Time `op` for about `seconds`; return its latencies and queries."""
+
+    latencies = []
+    queries = 0
+    deadline = time.perf_counter() + seconds
+
+    while len(latencies) < MIN_RUNS or (time.perf_counter() < deadline
+                                        and len(latencies) < max_runs):
+        g.query_count = 0
+
+        started = time.perf_counter()
+        op()
+        latencies.append(time.perf_counter() - started)
+
+        queries += g.query_count
+        discard_changes()
+
+    return latencies, queries
+
+
+def run(names=None, seconds=2):
+    """Run the named benchmarks (all by default); return their numbers."""
+
+    from app import app
+    from models import db
+
+    results = {}
+
+    with app.app_context():
+        subjects = pick_subjects()
+
+        for name in names or BENCHMARKS:
+            with app.test_request_context():
+                op = BENCHMARKS[name](subjects)
+
+                # Warm up connections and statement caches.
+                op()
+                discard_changes()
+
+                latencies, queries = measure(op, seconds)
+                db.session.rollback()
+
+            ordered = sorted(latencies)
+            results[name] = {
+                'runs': len(ordered),
+                'ops': round(len(ordered) / sum(ordered), 1),
+                'p50_ms': percentile(ordered, 50, digits=3),
+                'p95_ms': percentile(ordered, 95, digits=3),
+                'p99_ms': percentile(ordered, 99, digits=3),
+                'queries': round(queries / len(ordered), 2),
+            }
+
+    return results
+
+
+def print_results(results):
+    print(f"{'benchmark':<28} {'runs':>7} {'ops/s':>10} "
+          f"{'p50':>9} {'p95':>9} {'p99':>9} {'queries':>7}")
+
+    for name, row in results.items():
+        print(f"{name:<28} {row['runs']:>7} {row['ops']:>10} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} "
+              f"{row['queries']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--seconds', type=float, default=2)
+    parser.add_argument('--output', default='micro.json')
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+
+    results = run(args.names, args.seconds)
+    print_results(results)
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Load scenarios: what virtual users do against a running server.
+
+    python -m bench.scenarios [--clients 100] [--duration 30] [--workers 4]
+                              [--mode sync] [--scenarios browse like ...]
+                              [--output scenarios.json]
+
+Starts the app (see bench/server.py) against the dataset in DATABASE_URL
+and runs `--clients` virtual users for `--duration` seconds, split between
+the scenarios in proportion to `WEIGHTS`:
+
+- login: log in through the form (a bcrypt check), then log out
+- browse: home page, its next page, and the profile of an author on it
+- post: open the new message form and post a message
+- like: like a message, then unlike it
+- follow: follow a user from their profile, then unfollow them
+
+Every user but the login ones starts logged in with a signed session
+cookie, as a different user where the dataset has enough of them, so likes
+and follows don't collide. Prints and writes throughput, latency
+percentiles and the server's query count for each kind of request.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import re
+
+from sqlalchemy import select
+
+from bench import load
+from bench.server import SERVERS, serve
+
+WEIGHTS = {
+    'browse': 60,
+    'like': 15,
+    'post': 10,
+    'follow': 10,
+    'login': 5,
+}
+
+CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+NEXT_PAGE_RE = re.compile(r'href="/\?after=([^"]+)"')
+AUTHOR_RE = re.compile(r'href="/users/(\d+)"')
+
+
+def csrf_token(response):
+    match = response and CSRF_RE.search(response.text)
+    return match.group(1) if match else None
+
+
+##############################################################################
+# Scenarios. Each factory returns an async function making one pass.
+
+
+def read_pages(user_id):
+    """The pages served asynchronously by asgi.py, in turn."""
+
+    async def scenario(client):
+        await client.request('GET', '/')
+        await client.request('GET', f'/users/{user_id}', label='/users/<id>')
+        await client.request('GET', '/users')
+        await client.request('GET', f'/users/{user_id}/following',
+                             label='/users/<id>/following')
+        await client.request('GET', f'/users/{user_id}/followers',
+                             label='/users/<id>/followers')
+
+    return scenario
+
+
+def browse(user_id):
+    async def scenario(client):
+        home = await client.request('GET', '/')
+        if home is None:
+            return
+
+        next_page = NEXT_PAGE_RE.search(home.text)
+        if next_page:
+            await client.request('GET', f'/?after={next_page.group(1)}',
+                                 label='/?after=<cursor>')
+
+        authors = [int(author) for author in AUTHOR_RE.findall(home.text)
+                   if int(author) != user_id]
+        if authors:
+            await client.request('GET', f'/users/{authors[0]}',
+                                 label='/users/<id>')
+
+    return scenario
+
+
+def login(username):
+    async def scenario(client):
+        client.cookies.clear()
+
+        token = csrf_token(await client.request('GET', '/login'))
+        response = await client.request('POST', '/login', form={
+            'csrf_token': token,
+            'username': username,
+            'password': 'password',
+        })
+
+        if response and response.status == 302:
+            await client.request('POST', '/logout', form={'csrf_token': token})
+
+    return scenario
+
+
+def post(user_id):
+    count = itertools.count()
+
+    async def scenario(client):
+        token = csrf_token(await client.request('GET', '/messages/new'))
+        await client.request('POST', '/messages/new', form={
+            'csrf_token': token,
+            'text': f"Benchmark message {next(count)} from user {user_id}",
+        })
+
+    return scenario
+
+
+def like(message_id):
+    form = {'origin': '/'}
+
+    async def scenario(client):
+        await client.request('POST', f'/messages/{message_id}/like', form=form,
+                             label='/messages/<id>/like')
+        await client.request('POST', f'/messages/{message_id}/unlike', form=form,
+                             label='/messages/<id>/unlike')
+
+    return scenario
+
+
+def follow(target_id):
+    async def scenario(client):
+        token = csrf_token(await client.request('GET', f'/users/{target_id}',
+                                                label='/users/<id>'))
+        form = {'csrf_token': token}
+
+        await client.request('POST', f'/users/follow/{target_id}', form=form,
+                             label='/users/follow/<id>')
+        await client.request('POST', f'/users/stop-following/{target_id}',
+                             form=form, label='/users/stop-following/<id>')
+
+    return scenario
+
+
+##############################################################################
+# Planning
+
+
+def session_cookie(app, user_id):
+    from app import CURR_USER_KEY
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return {'session': serializer.dumps({CURR_USER_KEY: user_id})}
+
+
+def logged_in_users(count, clients):
+    """`(user id, cookies)` for each of `clients` clients, spread over the
+    `count` users who follow the most people."""
+
+    from app import app
+    from models import db, User
+
+    with app.app_context():
+        user_ids = db.session.scalars(
+            select(User.id)
+            .order_by(User.following_count.desc(), User.id)
+            .limit(count)).all()
+
+    if not user_ids:
+        raise SystemExit("The database has no users; load a dataset first "
+                         "(python -m bench.datasets 1k --load).")
+
+    return [(user_id, session_cookie(app, user_id))
+            for user_id in itertools.islice(itertools.cycle(user_ids), clients)]
+
+
+def plan(clients, weights=WEIGHTS):
+    """`(scenario, cookies)` for `clients` virtual users, split between the
+    scenarios in `weights`."""
+
+    from app import app
+    from models import db, Follows, LikedWarble, Message, User
+
+    total = sum(weights.values())
+    names = [name for name, weight in weights.items()
+             for _ in range(round(clients * weight / total))]
+    names = (names + list(weights))[:clients]
+
+    with app.app_context():
+        users = db.session.execute(
+            select(User.id, User.username)
+            .order_by(User.following_count.desc(), User.id)
+            .limit(clients)).all()
+
+        if not users:
+            raise SystemExit("The database has no users; load a dataset first "
+                             "(python -m bench.datasets 1k --load).")
+
+        user_ids = [user_id for user_id, _ in users]
+        popular = db.session.scalars(
+            select(User.id).order_by(User.followers_count.desc()).limit(100)).all()
+        recent = db.session.execute(
+            select(Message.id, Message.user_id)
+            .order_by(Message.id.desc()).limit(200)).all()
+
+        followed = set(db.session.execute(
+            select(Follows.user_following_id, Follows.user_being_followed_id)
+            .where(Follows.user_following_id.in_(user_ids))
+            .where(Follows.user_being_followed_id.in_(popular))).all())
+        liked = set(db.session.execute(
+            select(LikedWarble.user_id, LikedWarble.message_id)
+            .where(LikedWarble.user_id.in_(user_ids))
+            .where(LikedWarble.message_id.in_([msg_id for msg_id, _ in recent]))
+        ).all())
+
+        cookies = {user_id: session_cookie(app, user_id) for user_id in user_ids}
+
+    planned = []
+
+    for name, (user_id, username) in zip(names, itertools.cycle(users)):
+        if name == 'login':
+            planned.append((login(username), {}))
+            continue
+
+        if name == 'like':
+            choices = [msg_id for msg_id, author_id in recent
+                       if author_id != user_id and (user_id, msg_id) not in liked]
+            scenario = like(choices[0]) if choices else browse(user_id)
+        elif name == 'follow':
+            choices = [target for target in popular
+                       if target != user_id and (user_id, target) not in followed]
+            scenario = follow(choices[0]) if choices else browse(user_id)
+        else:
+            scenario = {'browse': browse, 'post': post}[name](user_id)
+
+        planned.append((scenario, cookies[user_id]))
+
+    return planned
+
+
+def run(clients=100, duration=30, warmup=5, mode='sync', workers=4,
+        weights=WEIGHTS):
+    """Run the scenarios against a fresh server; return the stats summary."""
+
+    users = plan(clients, weights)
+
+    with serve(mode, workers) as (host, port):
+        if warmup:
+            asyncio.run(load.run(host, port, users[:20], warmup))
+        stats = asyncio.run(load.run(host, port, users, duration))
+
+    return stats.summary()
+
+
+def print_summary(summary):
+    print(f"{'request':<40} {'count':>7} {'err':>5} {'req/s':>8} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8} {'queries':>7}")
+
+    rows = [*summary['requests'].items(), ('total', summary['total'])]
+    for label, row in rows:
+        print(f"{label:<40} {row['requests']:>7} {row['errors']:>5} "
+              f"{row['rps']:>8} {row['p50_ms'] or '-':>8} "
+              f"{row['p95_ms'] or '-':>8} {row['p99_ms'] or '-':>8} "
+              f"{row['queries'] if row['queries'] is not None else '-':>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--mode', default='sync', choices=list(SERVERS))
+    parser.add_argument('--scenarios', nargs='+', default=list(WEIGHTS),
+                        choices=list(WEIGHTS))
+    parser.add_argument('--output', default='scenarios.json')
+    args = parser.parse_args()
+
+    summary = run(args.clients, args.duration, args.warmup, args.mode,
+                  args.workers,
+                  {name: WEIGHTS[name] for name in args.scenarios})
+    print_summary(summary)
+
+    with open(args.output, 'w') as output:
+        json.dump(summary, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
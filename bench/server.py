@@ -0,0 +1,70 @@
+"""Start the app on a local port for load runs."""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+HOST = '127.0.0.1'
+
+SERVERS = {
+    'sync': ['gunicorn', '--workers', '{workers}', '--bind', '{host}:{port}',
+             '--backlog', '2048', 'app:app'],
+    'async': ['uvicorn', '--workers', '{workers}', '--host', '{host}',
+              '--port', '{port}', '--backlog', '2048', '--no-access-log',
+              'asgi:application'],
+}
+
+# Production settings, with per-request query counts in a Server-Timing
+# header, and no per-IP login limit (every client is on localhost).
+SERVER_ENV = {
+    'CHIRPER_ENV': 'production',
+    'REQUEST_STATS': 'header',
+    'LOGIN_CONCURRENCY_PER_IP': '100000',
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+
+    raise RuntimeError(f"Server on port {port} didn't start")
+
+
+@contextmanager
+def serve(mode='sync', workers=4):
+    """Run the app under server `mode` (see `SERVERS`) against DATABASE_URL,
+    and yield `(host, port)` once it accepts connections."""
+
+    port = free_port()
+    command = [sys.executable, '-m',
+               *(part.format(workers=workers, host=HOST, port=port)
+                 for part in SERVERS[mode])]
+
+    server = subprocess.Popen(command,
+                              env={**os.environ, **SERVER_ENV},
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, server)
+        yield HOST, port
+    finally:
+        server.terminate()
+        server.wait()
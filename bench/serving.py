@@ -0,0 +1,66 @@
+"""Compare the sync and async serving modes on the read-heavy pages.
+
+    python -m bench.serving [--clients 1000] [--duration 30] [--workers 4]
+                            [--users 100] [--output serving.json]
+
+Starts the app under gunicorn's sync workers (`app:app`) and then under
+uvicorn (`asgi:application`, see asgi.py), each with `--workers` processes
+on a local port, against the database in DATABASE_URL, which should already
+hold a dataset (see seed.py). After a short warm-up, `--clients` concurrent
+clients, each logged in as one of the `--users` users who follow the most
+people, cycle through the home page, their profile, /users and their
+following and followers pages for `--duration` seconds.
+
+Prints requests per second and p50/p95/p99 latency for each mode, and writes
+them to `--output` as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+
+from bench import load
+from bench.scenarios import logged_in_users, read_pages
+from bench.server import SERVERS, serve
+
+
+def bench_mode(mode, users, args):
+    with serve(mode, args.workers) as (host, port):
+        asyncio.run(load.run(host, port, users[:20], args.warmup))
+        stats = asyncio.run(load.run(host, port, users, args.duration))
+
+    return stats.summary()['total']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--modes', nargs='+', default=list(SERVERS),
+                        choices=list(SERVERS))
+    parser.add_argument('--output', default='serving.json')
+    args = parser.parse_args()
+
+    users = [(read_pages(user_id), cookies) for user_id, cookies
+             in logged_in_users(args.users, args.clients)]
+    report = {'clients': args.clients,
+              'duration': args.duration,
+              'workers': args.workers,
+              'modes': {}}
+
+    for mode in args.modes:
+        summary = bench_mode(mode, users, args)
+        report['modes'][mode] = summary
+        print(f"{mode:>6}: {summary['rps']:>8} req/s  "
+              f"p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  "
+              f"p99 {summary['p99_ms']} ms  errors {summary['errors']}")
+
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
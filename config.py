@@ -0,0 +1,166 @@
+"""Configuration profiles for Chirper.
+
+`create_app` in app.py picks a profile by name (or from the `CHIRPER_ENV`
+environment variable, default "development"):
+
+- development: debug toolbar available, debug logging
+- production: no toolbar, info logging, a JSON stats line per request,
+  background jobs queued for `flask worker`, bcrypt in a process pool
+- testing: the test database, CSRF and the toolbar off, quiet logging
+
+Most settings can be overridden with environment variables of the same name.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+import fragments
+from instrumentation import env_flag
+from passwords import DEFAULT_ROUNDS
+import timeline
+
+load_dotenv()
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    SQLALCHEMY_ECHO = env_flag('SQLALCHEMY_ECHO')
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+    # Static files are served with content-hashed URLs, cached for a year;
+    # requests for unhashed URLs (e.g. from CSS) are cached this long.
+    STATIC_MAX_AGE = env_int('STATIC_MAX_AGE', 3600)
+
+    # Longest a page validated from row versions can be revalidated as
+    # unchanged (see http_cache.validated_by).
+    ETAG_MAX_AGE = env_int('ETAG_MAX_AGE', 300)
+
+    TIMELINE_CELEBRITY_THRESHOLD = env_int(
+        'TIMELINE_CELEBRITY_THRESHOLD', timeline.DEFAULT_CELEBRITY_THRESHOLD)
+    TIMELINE_LENGTH = env_int('TIMELINE_LENGTH',
+                              timeline.DEFAULT_TIMELINE_LENGTH)
+    # Fan-out trims timelines back to TIMELINE_LENGTH on about one message
+    # in this many (see timeline.fan_out_message).
+    TIMELINE_TRIM_EVERY = env_int('TIMELINE_TRIM_EVERY',
+                                  timeline.DEFAULT_TRIM_EVERY)
+
+    # Read replicas for GET pages, and how far behind one may be before reads
+    # fall back to the primary (see replicas.py).
+    REPLICA_URLS = [
+        url for url in os.environ.get('REPLICA_URLS', '').split(',') if url]
+    REPLICA_MAX_LAG = env_float('REPLICA_MAX_LAG', 5)
+    REPLICA_STICKY_SECONDS = env_float('REPLICA_STICKY_SECONDS', 5)
+
+    # Fail any request that issues more SQL statements than this (set in tests).
+    MAX_QUERIES_PER_REQUEST = None
+
+    # Where per-request database stats go: 'header' (Server-Timing), 'log' or
+    # 'off'. Unset means a header in debug mode and a log line otherwise.
+    REQUEST_STATS = os.environ.get('REQUEST_STATS')
+
+    # Anonymous visitors browse as this user, if set (e.g. a demo account).
+    GUEST_USER_ID = (int(os.environ['GUEST_USER_ID'])
+                     if os.environ.get('GUEST_USER_ID') else None)
+
+    # Password hashing: bcrypt cost, worker processes (0 = hash on the request
+    # thread; production defaults to a pool), and how many hashes may be in
+    # flight before logins get a 503.
+    BCRYPT_LOG_ROUNDS = env_int('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+    PASSWORD_HASH_WORKERS = env_int('PASSWORD_HASH_WORKERS', 0)
+    PASSWORD_HASH_MAX_PENDING = env_int('PASSWORD_HASH_MAX_PENDING', 8)
+    PASSWORD_HASH_TIMEOUT = env_float('PASSWORD_HASH_TIMEOUT', 5)
+    LOGIN_CONCURRENCY_PER_USER = env_int('LOGIN_CONCURRENCY_PER_USER', 2)
+    LOGIN_CONCURRENCY_PER_IP = env_int('LOGIN_CONCURRENCY_PER_IP', 8)
+
+    SEARCH_INDEX_REFRESH = env_float('SEARCH_INDEX_REFRESH', 30)
+    USER_CACHE_SIZE = env_int('USER_CACHE_SIZE', 1024)
+    USER_CACHE_TTL = env_float('USER_CACHE_TTL', 30)
+
+    # Rendered message cards and profile headers (see fragments.py): kept in
+    # process up to this many bytes, or in Redis if a URL is given.
+    FRAGMENT_CACHE_BYTES = env_int('FRAGMENT_CACHE_BYTES',
+                                   fragments.DEFAULT_MAX_BYTES)
+    FRAGMENT_CACHE_URL = os.environ.get('FRAGMENT_CACHE_URL')
+    FRAGMENT_CACHE_TTL = env_int('FRAGMENT_CACHE_TTL', 24 * 60 * 60)
+
+    # Home page sidebar (see activity.py): how many recent and trending
+    # messages to show, how often each process reloads them, and how far
+    # back likes count towards trending.
+    RECENT_MESSAGES = env_int('RECENT_MESSAGES', 10)
+    TRENDING_SIZE = env_int('TRENDING_SIZE', 5)
+    ACTIVITY_REFRESH = env_float('ACTIVITY_REFRESH', 30)
+    TRENDING_WINDOW = env_int('TRENDING_WINDOW', 60 * 60)
+
+    # Background jobs (see jobs.py). Eager runs them inline, without a worker.
+    JOBS_EAGER = env_flag('JOBS_EAGER', True)
+    JOB_MAX_ATTEMPTS = env_int('JOB_MAX_ATTEMPTS', 5)
+    JOB_BACKOFF = env_float('JOB_BACKOFF', 2)
+    JOB_TIMEOUT = env_int('JOB_TIMEOUT', 300)
+    WORKER_CONCURRENCY = env_int('WORKER_CONCURRENCY', 4)
+    WORKER_POLL_INTERVAL = env_float('WORKER_POLL_INTERVAL', 1)
+
+    # Notifications (see notifications.py) are buffered and written out every
+    # this many milliseconds, or sooner once this many events are waiting.
+    NOTIFY_FLUSH_MS = env_int('NOTIFY_FLUSH_MS', 500)
+    NOTIFY_FLUSH_EVENTS = env_int('NOTIFY_FLUSH_EVENTS', 500)
+
+    # Live timeline streams (see live.py). A postgresql:// URL shares new
+    # messages between workers with LISTEN/NOTIFY; unset keeps them in
+    # process. Streams send a comment every STREAM_HEARTBEAT seconds, end
+    # after STREAM_MAX_AGE, and are dropped once STREAM_QUEUE_SIZE behind.
+    # Each process keeps at most STREAM_MAX_PER_WORKER open. The WSGI app
+    # only serves them with STREAM_WSGI, under gevent with psycogreen.
+    LIVE_UPDATES_URL = os.environ.get('LIVE_UPDATES_URL')
+    STREAM_HEARTBEAT = env_float('STREAM_HEARTBEAT', 15)
+    STREAM_MAX_AGE = env_float('STREAM_MAX_AGE', 300)
+    STREAM_QUEUE_SIZE = env_int('STREAM_QUEUE_SIZE', 100)
+    STREAM_MAX_PER_WORKER = env_int('STREAM_MAX_PER_WORKER', 1000)
+    STREAM_WSGI = env_flag('STREAM_WSGI')
+
+    # ASGI serving (see asgi.py): the database for async requests (default:
+    # SQLALCHEMY_DATABASE_URI with asyncpg) and threads for the other routes.
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    ASGI_THREADS = env_int('ASGI_THREADS', 32)
+
+
+class DevelopmentConfig(Config):
+    DEBUG_TOOLBAR = True
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+
+
+class ProductionConfig(Config):
+    REQUEST_STATS = os.environ.get('REQUEST_STATS', 'log')
+    JOBS_EAGER = env_flag('JOBS_EAGER', False)
+    PASSWORD_HASH_WORKERS = env_int('PASSWORD_HASH_WORKERS', 2)
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'TEST_DATABASE_URL', "postgresql:///warbler_test")
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'test')
+    WTF_CSRF_ENABLED = False
+    LOG_LEVEL = 'WARNING'
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
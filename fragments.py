@@ -0,0 +1,169 @@
+"""Cache of rendered template fragments.
+
+Message cards and profile headers are the same for every viewer apart from
+the like and follow buttons, and a timeline page renders a hundred cards.
+Templates wrap the viewer-independent part in a call block:
+
+    {% call cached_fragment('message', msg.id, msg.user.version) %}
+      ...
+    {% endcall %}
+
+and the rendered HTML is stored under the fragment name and key. Keys include
+the version of the rows the fragment shows (`User.version` is bumped by
+every profile edit and counter change), so a changed row gets a new key
+rather than being invalidated; stale entries just age out of the cache.
+Buttons that depend on the viewer are rendered outside the block.
+
+The backend is picked by `FRAGMENT_CACHE_URL`: unset keeps fragments in an
+in-process LRU of at most `FRAGMENT_CACHE_BYTES`; a `redis://` URL shares
+them between workers through Redis (which needs the `redis` package and
+should run with an LRU `maxmemory-policy`).
+"""
+
+import logging
+import sys
+from collections import OrderedDict
+from threading import Lock
+
+from markupsafe import Markup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class MemoryBackend:
+    """LRU of rendered fragments, bounded by their total size in memory."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+
+            if html is not None:
+                self._entries.move_to_end(key)
+
+            return html
+
+    def set(self, key, html):
+        cost = sys.getsizeof(key) + sys.getsizeof(html)
+
+        if cost > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= sys.getsizeof(key) + sys.getsizeof(old)
+
+            self._entries[key] = html
+            self.size += cost
+
+            while self.size > self.max_bytes:
+                old_key, old = self._entries.popitem(last=False)
+                self.size -= sys.getsizeof(old_key) + sys.getsizeof(old)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Fragments shared between processes through Redis.
+
+    Errors talking to Redis are logged and treated as misses, so an
+    unavailable cache slows pages down rather than breaking them.
+    """
+
+    def __init__(self, url, ttl=24 * 60 * 60, prefix='fragment:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.errors = redis.RedisError
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            html = self.client.get(self.prefix + key)
+        except self.errors:
+            logger.warning("Fragment cache read failed", exc_info=True)
+            return None
+
+        return html.decode() if html is not None else None
+
+    def set(self, key, html):
+        try:
+            self.client.set(self.prefix + key, html.encode(), ex=self.ttl)
+        except self.errors:
+            logger.warning("Fragment cache write failed", exc_info=True)
+
+    def clear(self):
+        keys = self.client.scan_iter(match=self.prefix + '*', count=1000)
+
+        for key in keys:
+            self.client.delete(key)
+
+
+class FragmentCache:
+    """Renders template fragments once per key and reuses the HTML."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """Pick the backend from `app.config` and add `cached_fragment` to
+        its templates."""
+
+        url = app.config['FRAGMENT_CACHE_URL']
+
+        if url:
+            self.backend = RedisBackend(url, ttl=app.config['FRAGMENT_CACHE_TTL'])
+        else:
+            self.backend = MemoryBackend(app.config['FRAGMENT_CACHE_BYTES'])
+
+        app.jinja_env.globals['cached_fragment'] = self.fragment
+
+    def fragment(self, name, *key, caller):
+        """Return the HTML cached for `name` and `key`, rendering it with
+        `caller` (the body of a `{% call %}` block) on a miss."""
+
+        cache_key = ':'.join(map(str, (name, *key)))
+        html = self.backend.get(cache_key)
+
+        if html is None:
+            self.misses += 1
+            html = str(caller())
+            self.backend.set(cache_key, html)
+        else:
+            self.hits += 1
+
+        return Markup(html)
+
+    def stats(self):
+        """Hit and miss counts, and the in-process cache's size."""
+
+        stats = {'hits': self.hits, 'misses': self.misses}
+
+        if isinstance(self.backend, MemoryBackend):
+            stats.update(entries=len(self.backend), bytes=self.backend.size)
+
+        return stats
+
+    def clear(self):
+        self.backend.clear()
+
+
+# Shared by every app in the process, configured by `create_app`.
+fragment_cache = FragmentCache()
@@ -2,88 +2,246 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, for example a load-test
+dataset:
+
+    python generator/create_csvs.py --users 10000000 --follows 1000000000 \\
+        --messages 100000000 --shards 64 --out-dir /data/chirper
+
+Follows have a power-law follower distribution: each user follows an
+exponentially distributed number of others (averaging follows / users),
+picked so a few users have most of the followers. Edges are written as they
+are sampled, so memory use doesn't grow with the dataset.
+
+Users are split into id ranges ("shards") generated by separate processes.
+Each shard writes its own `users-NNNN.csv`, `messages-NNNN.csv` and
+`follows-NNNN.csv`; with a single shard the files are `users.csv`, etc.
+`seed.py --data-dir` loads either layout. The output is the same for the same
+`--seed`, `--shards` and `--now` (the end of the range message timestamps are
+drawn from, a fixed date by default).
 """
 
+import argparse
+import csv
 import os
-from dotenv import load_dotenv
+import random
+from datetime import datetime
+from glob import glob
+from multiprocessing import Pool
+from pathlib import Path
 
-import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
 from faker import Faker
-from helpers import get_random_datetime
-
-load_dotenv()
 
-UNSPLASH_CID = os.environ['UNSPLASH_CID']
+from helpers import (
+    HEADER_IMAGE_URLS, IMAGE_URLS, PowerLaw, get_random_datetime)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
+# bcrypt hash of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Message timestamps fall in the two years before this, unless --now is given.
+NOW = datetime(2024, 1, 1)
+
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
-
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-# NOTE: You will need to create a dev account at unsplash.com, 
-# generate an access key and set that to an environment
-# variable to successfully ping the API. 
-
-header_image_urls = [
-    requests.get(
-        "https://api.unsplash.com/topics/wallpapers/photos" \
-        f"?per_page=30&orientation=landscape&client_id={UNSPLASH_CID}"
-    ).json()[i]['urls']['regular'] for i in range(0,29)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+NUM_FOLLOWS = 5000
+
+# Message texts are picked from a pool, since Faker is slow per row.
+TEXT_POOL_SIZE = 5000
+
+
+def fetch_header_image_urls():
+    """Get landscape wallpaper URLs from the Unsplash API.
+
+    NOTE: You will need to create a dev account at unsplash.com, generate an
+    access key and set that to the UNSPLASH_CID environment variable.
+    """
+
+    import requests
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    resp = requests.get(
+        "https://api.unsplash.com/topics/wallpapers/photos"
+        "?per_page=30&orientation=landscape"
+        f"&client_id={os.environ['UNSPLASH_CID']}")
+    resp.raise_for_status()
+
+    return [photo['urls']['regular'] for photo in resp.json()]
+
+
+def shard_ranges(num_users, shards):
+    """Split user ids 1..num_users into `shards` (start, stop) ranges."""
+
+    bounds = [1 + num_users * i // shards for i in range(shards + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def csv_path(out_dir, name, shard, shards):
+    if shards == 1:
+        return Path(out_dir) / f"{name}.csv"
+    return Path(out_dir) / f"{name}-{shard:04d}.csv"
+
+
+def sample_followees(follower_id, count, followees, rng):
+    """Return up to `count` distinct ids for `follower_id` to follow."""
+
+    chosen = set()
+    attempts = 0
+
+    # Popular users get drawn over and over; give up rather than spin when
+    # someone follows nearly everybody.
+    while len(chosen) < count and attempts < count * 10:
+        attempts += 1
+        user_id = followees.sample(rng)
+        if user_id != follower_id:
+            chosen.add(user_id)
+
+    return chosen
+
+
+def write_shard(job):
+    """Write the users, messages and follows CSVs for one id range.
+
+    Returns (users, messages, follows) row counts.
+    """
+
+    shard, start, stop, options = job
+
+    rng = random.Random(f"{options['seed']}-{shard}")
+    fake = Faker()
+    fake.seed_instance(f"{options['seed']}-{shard}")
+
+    num_users = options['users']
+    header_image_urls = options['header_image_urls']
+    shard_users = stop - start
+
+    # Messages and follows are split between shards in proportion to users.
+    num_messages = options['messages'] * shard_users // num_users
+    avg_follows = options['follows'] / num_users
+    followees = PowerLaw(num_users, options['alpha'])
+
+    paths = {name: csv_path(options['out_dir'], name, shard, options['shards'])
+             for name in ('users', 'messages', 'follows')}
+
+    with open(paths['users'], 'w', newline='') as users_csv:
+        users_writer = csv.writer(users_csv)
+        users_writer.writerow(USERS_CSV_HEADERS)
+
+        for user_id in range(start, stop):
+            # The id suffix keeps usernames and emails unique at any size.
+            username = f"{fake.user_name()}{user_id}"
+            users_writer.writerow([
+                user_id,
+                f"{username}@{fake.free_email_domain()}",
+                username,
+                rng.choice(IMAGE_URLS),
+                PASSWORD,
+                fake.sentence(),
+                rng.choice(header_image_urls),
+                fake.city(),
+            ])
+
+    texts = [fake.paragraph()[:MAX_WARBLER_LENGTH]
+             for _ in range(min(num_messages, TEXT_POOL_SIZE))]
+
+    with open(paths['messages'], 'w', newline='') as messages_csv:
+        messages_writer = csv.writer(messages_csv)
+        messages_writer.writerow(MESSAGES_CSV_HEADERS)
+
+        for _ in range(num_messages):
+            messages_writer.writerow([
+                rng.choice(texts),
+                get_random_datetime(rng=rng, now=options['now']),
+                rng.randrange(start, stop),
+            ])
+
+    num_follows = 0
+
+    with open(paths['follows'], 'w', newline='') as follows_csv:
+        follows_writer = csv.writer(follows_csv)
+        follows_writer.writerow(FOLLOWS_CSV_HEADERS)
+
+        for follower_id in range(start, stop):
+            count = min(num_users - 1, round(rng.expovariate(1 / avg_follows))
+                        if avg_follows else 0)
+
+            for followed_id in sample_followees(follower_id, count, followees, rng):
+                follows_writer.writerow([followed_id, follower_id])
+                num_follows += 1
+
+    return shard_users, num_messages, num_follows
+
+
+def generate(users=NUM_USERS, messages=NUM_MESSAGES, follows=NUM_FOLLOWS,
+             seed=0, shards=1, processes=None, out_dir='generator', alpha=1.2,
+             header_image_urls=HEADER_IMAGE_URLS, now=NOW):
+    """Write CSVs for `users` users into `out_dir`, one set per shard."""
+
+    shards = max(1, min(shards, users))
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    # Don't leave files from an earlier run for seed.py to pick up.
+    for name in ('users', 'messages', 'follows'):
+        for path in glob(str(Path(out_dir) / f"{name}*.csv")):
+            os.remove(path)
+
+    options = dict(users=users, messages=messages, follows=follows, seed=seed,
+                   shards=shards, out_dir=out_dir, alpha=alpha,
+                   header_image_urls=header_image_urls, now=now)
+    jobs = [(shard, start, stop, options)
+            for shard, (start, stop) in enumerate(shard_ranges(users, shards))]
+
+    totals = [0, 0, 0]
+
+    with Pool(min(processes or os.cpu_count(), shards)) as pool:
+        for done, counts in enumerate(pool.imap_unordered(write_shard, jobs), 1):
+            totals = [total + count for total, count in zip(totals, counts)]
+            print(f"{done}/{shards} shards: {totals[0]:,} users, "
+                  f"{totals[1]:,} messages, {totals[2]:,} follows", flush=True)
+
+    return tuple(totals)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS,
+                        help="approximate total number of follows")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="random seed; same seed and shards, same data")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="number of id ranges, each written to its own files")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--out-dir', default='generator')
+    parser.add_argument('--now', type=datetime.fromisoformat, default=NOW,
+                        help="latest message timestamp, as an ISO date "
+                             f"(default {NOW.date()})")
+    parser.add_argument('--alpha', type=float, default=1.2,
+                        help="power-law exponent of followers per user")
+    parser.add_argument('--unsplash', action='store_true',
+                        help="fetch header images from the Unsplash API "
+                             "(needs UNSPLASH_CID) instead of the built-in list")
+    args = parser.parse_args()
+
+    generate(
+        users=args.users,
+        messages=args.messages,
+        follows=args.follows,
+        seed=args.seed,
+        shards=args.shards,
+        processes=args.processes,
+        out_dir=args.out_dir,
+        alpha=args.alpha,
+        now=args.now,
+        header_image_urls=(fetch_header_image_urls() if args.unsplash
+                           else HEADER_IMAGE_URLS),
+    )
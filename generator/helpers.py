@@ -1,14 +1,94 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+import random
+from datetime import datetime, timedelta
+from math import gcd
 
+# Profile images, so generating users doesn't need the network.
+IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+# Landscape wallpapers from Unsplash (the ones in the committed users.csv).
+HEADER_IMAGE_URLS = [
+    f"https://images.unsplash.com/{photo}"
+    "?crop=entropy&cs=tinysrgb&fit=max&fm=jpg&q=80&w=1080"
+    for photo in [
+        "photo-1573996987033-47fd3a4ca35e",
+        "photo-1574001412492-7555e61a9b53",
+        "photo-1575015642299-5b92fcbd0ba4",
+        "photo-1647598939382-5637f4eeb7b9",
+        "photo-1653061853347-4fbf052530e9",
+        "photo-1668353064375-d3dcd3346d53",
+        "photo-1669375957059-0cd563ba4a02",
+        "photo-1673844968943-694c71e94e93",
+        "photo-1673950455470-d872dcec6eb1",
+        "photo-1674240568812-d7481f3699a7",
+        "photo-1674318012388-141651b08a51",
+        "photo-1674394006641-b680753c502b",
+        "photo-1674407728563-f30774195b0f",
+        "photo-1674420628423-bf7a338af32d",
+        "photo-1674493310933-e681279e5664",
+        "photo-1674500021669-27da4b40772a",
+        "photo-1674505681324-3ef7edf8415b",
+        "photo-1674530493752-719b5514a7f2",
+        "photo-1674575496466-5119fd691bf4",
+        "photo-1674580351112-42fdbbae9c86",
+        "photo-1674653743689-c8e507e3dee8",
+        "photo-1674653844677-b98dfbbc0ac5",
+        "photo-1674673858080-fb524d0280a4",
+        "photo-1674690017732-63c3c5f8088c",
+        "photo-1674754666443-696bc5b522f3",
+        "photo-1674754666581-4e6657392655",
+        "photo-1674756142722-14266beb51d6",
+        "photo-1674824959440-09442ed75a8e",
+        "photo-1674856320411-8c63716007d6",
+    ]
+]
 
-    now = datetime.now()
+
+def get_random_datetime(year_gap=2, rng=random, now=None):
+    """Get a random datetime within the few years before `now` (default:
+    the current time). Pass a fixed `now` for reproducible output."""
+
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    offset = rng.uniform(0, (now - then).total_seconds())
+
+    # Plain datetime arithmetic, not timestamps, so the local timezone
+    # doesn't change the result.
+    return then + timedelta(seconds=offset)
+
+
+class PowerLaw:
+    """Sample user ids 1..n with P(rank r) proportional to r ** -alpha.
+
+    Ranks are drawn from a bounded Pareto distribution by inverting its CDF,
+    so sampling takes O(1) time and memory. Ranks are spread over ids with a
+    fixed permutation (r * step mod n), so popular users aren't all low ids.
+    """
+
+    def __init__(self, n, alpha=1.2):
+        self.n = n
+        self.alpha = alpha
+
+        self.step = int(n * 0.6180339887) | 1
+        while gcd(self.step, n) != 1:
+            self.step += 1
+
+    def rank(self, rng):
+        if self.alpha == 1:
+            return min(self.n, int(self.n ** rng.random()))
+
+        exponent = 1 - self.alpha
+        u = rng.random()
+        x = ((self.n ** exponent - 1) * u + 1) ** (1 / exponent)
+
+        return min(self.n, int(x))
+
+    def sample(self, rng):
+        """Return a user id."""
 
-    return datetime.fromtimestamp(random_timestamp)
+        return (self.rank(rng) - 1) * self.step % self.n + 1
@@ -0,0 +1,171 @@
+"""HTTP caching policy for Chirper.
+
+Static files:
+
+- `url_for('static', filename='stylesheets/style.css')` gives a
+  content-hashed URL (`/static/stylesheets/style.1a2b3c4d5e6f.css`). Those
+  are served `public, max-age=<1 year>, immutable`, since a changed file
+  gets a new URL.
+- Plain URLs (e.g. images referenced from CSS) are cached for
+  `STATIC_MAX_AGE` seconds and revalidated with their ETag after that.
+
+Pages are `private, no-cache` with an ETag of the body, so browsers
+revalidate each view but get a bodyless 304 when nothing changed.
+
+Views decorated with `@validated_by(fn)` go further: `fn(**view_args)`
+returns the versions of the rows the page is built from (one indexed
+lookup), and the ETag is derived from those. A matching `If-None-Match` is
+answered with 304 before the view runs, so nothing is loaded or rendered.
+The ETag also covers the viewer's session, their unread notification count
+(the navbar badge) and a time bucket of `ETAG_MAX_AGE` seconds, which
+bounds how long changes to rows the versions don't cover (e.g. a listed
+user's avatar) and embedded CSRF tokens can be served stale.
+"""
+
+import hashlib
+import os
+import re
+import time
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from werkzeug.security import safe_join
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+# "name.<12 hex digits>.ext"
+HASHED_FILENAME = re.compile(
+    r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{12})(?P<ext>\.[^./]+)$')
+
+
+class StaticHashes:
+    """Content hashes of files in a static folder, recomputed on change."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._hashes = {}   # filename -> (mtime, digest)
+
+    def get(self, filename):
+        """Return the short content hash of `filename`, or None if missing."""
+
+        path = safe_join(self.folder, filename)
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except (TypeError, OSError):
+            return None
+
+        cached = self._hashes.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'rb') as static_file:
+            digest = hashlib.md5(static_file.read(),
+                                 usedforsecurity=False).hexdigest()[:12]
+
+        self._hashes[filename] = (mtime, digest)
+        return digest
+
+
+def init_http_cache(app):
+    """Install hashed static URLs and the cache policy on `app`."""
+
+    hashes = StaticHashes(app.static_folder)
+
+    @app.url_defaults
+    def add_static_hash(endpoint, values):
+        if endpoint != 'static' or 'filename' not in values:
+            return
+
+        digest = hashes.get(values['filename'])
+        if digest:
+            stem, ext = os.path.splitext(values['filename'])
+            values['filename'] = f"{stem}.{digest}{ext}"
+
+    def cache_publicly(response, max_age):
+        # send_file marks files `no-cache` when no max age is configured.
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response
+
+    def send_static(filename):
+        match = HASHED_FILENAME.match(filename)
+
+        if match:
+            original = match['stem'] + match['ext']
+
+            if hashes.get(original) == match['digest']:
+                response = cache_publicly(app.send_static_file(original),
+                                          ONE_YEAR)
+                response.cache_control.immutable = True
+                return response
+
+        return cache_publicly(app.send_static_file(filename),
+                              app.config['STATIC_MAX_AGE'])
+
+    app.view_functions['static'] = send_static
+
+    @app.after_request
+    def set_cache_policy(response):
+        if request.endpoint == 'static' or 'Cache-Control' in response.headers:
+            return response
+
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+        if (request.method == 'GET'
+                and response.status_code == 200
+                and not response.is_streamed):
+            response.add_etag()
+            response.make_conditional(request)
+
+        return response
+
+
+def validated_by(versions):
+    """Answer conditional GETs of the decorated view from `versions`.
+
+    `versions(**view_args)` returns something hashable describing the
+    current state of the page's rows (e.g. user versions), or None to
+    render normally (e.g. to let the view 404).
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pages with pending flash messages must be rendered to show them.
+            if (request.method != 'GET'
+                    or not g.get('user')
+                    or '_flashes' in session):
+                return view(*args, **kwargs)
+
+            state = versions(**kwargs)
+            if state is None:
+                return view(*args, **kwargs)
+
+            bucket = int(time.time() // current_app.config['ETAG_MAX_AGE'])
+            etag = hashlib.sha1(repr((
+                request.full_path,
+                state,
+                g.user.id,
+                # The navbar's unread badge is on every page, and isn't
+                # covered by the user's version.
+                g.user.unread_notifications,
+                session.get('csrf_token'),
+                bucket,
+            )).encode(), usedforsecurity=False).hexdigest()
+
+            if etag in request.if_none_match:
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            return response
+
+        return wrapper
+
+    return decorator
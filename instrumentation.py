@@ -0,0 +1,205 @@
+"""Per-request database instrumentation for Chirper.
+
+Every statement sent to the database during a request is counted and timed
+on `g`, along with the slowest statement and the time spent waiting for a
+connection from the pool. At the end of the request the numbers are:
+
+- sent as a `Server-Timing` header (shown in browser dev tools), in debug
+- logged as one JSON line per request (logger `chirper.requests`) otherwise
+
+`REQUEST_STATS` ('header', 'log' or 'off') overrides the choice.
+
+Requests that hash or check a password (see passwords.py) also report the
+time that took, and the log line has the hashing queue's `stats()`.
+
+If `MAX_QUERIES_PER_REQUEST` is set (the tests set it), a request that goes
+over the limit fails with `TooManyQueries`, which catches N+1 query patterns
+such as loading each message's author separately.
+
+`pool_options` builds engine options from `DB_POOL_*` environment
+variables; the pool it sets up reports checkout waits and its size in the
+log line, which is what pools should be sized against.
+"""
+
+import json
+import logging
+import os
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger('chirper.requests')
+
+# Longest SQL text kept for the slowest statement.
+MAX_STATEMENT_LENGTH = 300
+
+
+class TooManyQueries(AssertionError):
+    """A request issued more SQL statements than MAX_QUERIES_PER_REQUEST."""
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited on `g`."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        finally:
+            if has_request_context():
+                g.pool_wait = (g.get('pool_wait', 0)
+                               + time.perf_counter() - start)
+                g.pool_status = self.status()
+
+
+# SQLAlchemy names pool loggers after the pool class. Keep this one as quiet
+# as SQLAlchemy's own, rather than inheriting the root logger's level.
+logging.getLogger(f"{__name__}.{TimedQueuePool.__name__}").setLevel(logging.WARNING)
+
+
+def env_flag(name, default=False):
+    """Read a true/false environment variable."""
+
+    value = os.environ.get(name)
+
+    if value is None:
+        return default
+
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def pool_options(url):
+    """Return SQLAlchemy engine options for database `url` from the environment.
+
+    - DB_POOL_SIZE (5): connections kept open per worker process
+    - DB_MAX_OVERFLOW (10): extra connections allowed under load
+    - DB_POOL_TIMEOUT (30): seconds to wait for a connection before failing
+    - DB_POOL_RECYCLE (-1, never): reconnect connections older than this
+    - DB_POOL_PRE_PING (true): check connections before using them
+
+    Each gunicorn worker has its own pool, so the database sees up to
+    workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+    """
+
+    options = {'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True)}
+
+    # SQLite uses its own pools, which don't take these settings.
+    if url.startswith('sqlite'):
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        pool_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', -1)),
+    )
+
+    return options
+
+
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+
+    if not (has_request_context() and starts):
+        return
+
+    elapsed = time.perf_counter() - starts.pop()
+    g.db_time = g.get('db_time', 0) + elapsed
+
+    if elapsed > g.get('slowest_time', 0):
+        g.slowest_time = elapsed
+        g.slowest_statement = statement[:MAX_STATEMENT_LENGTH]
+
+
+def _statement_failed(context):
+    # after_cursor_execute doesn't run for a failed statement.
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+def request_stats():
+    """Return the database numbers for the current request so far."""
+
+    return dict(
+        queries=g.get('query_count', 0),
+        db_ms=round(g.get('db_time', 0) * 1000, 2),
+        slowest_ms=round(g.get('slowest_time', 0) * 1000, 2),
+        slowest_sql=g.get('slowest_statement'),
+        pool_wait_ms=round(g.get('pool_wait', 0) * 1000, 2),
+        pool=g.get('pool_status'),
+        hash_ms=round(g.get('hash_time', 0) * 1000, 2),
+        hashing=g.get('hash_status'),
+    )
+
+
+def init_instrumentation(app):
+    """Count and time SQL statements per request for `app`.
+
+    Call this before registering other `before_request` hooks, so queries
+    they run are counted too.
+    """
+
+    if not event.contains(Engine, 'before_cursor_execute', _start_statement):
+        event.listen(Engine, 'before_cursor_execute', _start_statement)
+        event.listen(Engine, 'after_cursor_execute', _end_statement)
+        event.listen(Engine, 'handle_error', _statement_failed)
+
+    @app.before_request
+    def reset_request_stats():
+        for name in ('query_count', 'db_time', 'slowest_time',
+                     'slowest_statement', 'pool_wait', 'pool_status',
+                     'hash_time', 'hash_status'):
+            g.pop(name, None)
+
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def report_request_stats(response):
+        stats = request_stats()
+        limit = app.config.get('MAX_QUERIES_PER_REQUEST')
+
+        if limit is not None and stats['queries'] > limit:
+            raise TooManyQueries(
+                f"{request.method} {request.path} issued {stats['queries']} "
+                f"SQL statements; the limit is {limit}.")
+
+        mode = app.config.get('REQUEST_STATS') or (
+            'header' if app.debug else 'log')
+
+        if mode == 'header':
+            timings = [
+                f'db;dur={stats["db_ms"]};desc="{stats["queries"]} queries"',
+                f'db-slowest;dur={stats["slowest_ms"]}',
+                f'db-pool-wait;dur={stats["pool_wait_ms"]}',
+            ]
+
+            if stats['hashing'] is not None:
+                timings.append(f'password-hash;dur={stats["hash_ms"]}')
+
+            response.headers['Server-Timing'] = ", ".join(timings)
+
+        elif mode == 'log' and request.endpoint != 'static':
+            logger.info(json.dumps(dict(
+                method=request.method,
+                path=request.path,
+                status=response.status_code,
+                ms=round((time.perf_counter()
+                          - g.get('request_start', time.perf_counter()))
+                         * 1000, 2),
+                **stats,
+            )))
+
+        return response
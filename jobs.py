@@ -0,0 +1,262 @@
+"""Background jobs for the slow side effects of writes.
+
+Routes make their primary change and enqueue the rest (timeline fan-out and
+backfill, notifications) as jobs:
+
+    @task
+    def fan_out_message(message_id):
+        ...
+
+    enqueue(fan_out_message, message_id=msg.id, key=f"fan-out:{msg.id}")
+    db.session.commit()
+
+A job is a row in the `jobs` table, inserted in the caller's transaction, so
+it exists exactly when the write it follows was committed. A `key` makes
+enqueueing idempotent: a second job with the same key is dropped.
+
+`flask worker` runs jobs in a pool of threads. Each job runs in its own
+transaction, which also marks the job done, so a job's changes are kept
+only if it completes. A failed job is retried after an exponential backoff
+(`JOB_BACKOFF` seconds, doubling), up to `JOB_MAX_ATTEMPTS` attempts. A job
+that has been running for more than `JOB_TIMEOUT` seconds is assumed to have
+lost its worker and is run again, so tasks should be idempotent.
+
+With `JOBS_EAGER` set (the default outside production), `enqueue` runs the
+task straight away in the caller's transaction instead, so no worker is
+needed.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+metrics_logger = logging.getLogger('chirper.jobs')
+
+TASKS = {}
+
+
+def task(fn):
+    """Register `fn` as a task that can be enqueued, under its name."""
+
+    TASKS[fn.__name__] = fn
+    return fn
+
+
+class JobQueue:
+    """Enqueues jobs and settings shared with workers."""
+
+    def __init__(self, eager=True, max_attempts=5, backoff=2, timeout=300):
+        self.eager = eager
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def init_app(self, app):
+        self.eager = app.config['JOBS_EAGER']
+        self.max_attempts = app.config['JOB_MAX_ATTEMPTS']
+        self.backoff = app.config['JOB_BACKOFF']
+        self.timeout = app.config['JOB_TIMEOUT']
+
+    def enqueue(self, fn, key=None, delay=0, **kwargs):
+        """Run task `fn(**kwargs)` in the background.
+
+        `kwargs` must be JSON-serializable. The job is added to the current
+        transaction, so the caller commits it along with its own changes.
+        """
+
+        if fn.__name__ not in TASKS:
+            raise ValueError(f"{fn.__name__} is not a registered task")
+
+        if self.eager:
+            fn(**kwargs)
+            return
+
+        if db.session.get_bind().dialect.name == 'sqlite':
+            insert = sqlite.insert
+        else:
+            insert = postgresql.insert
+
+        db.session.execute(
+            insert(Job)
+            .values(name=fn.__name__,
+                    args=kwargs,
+                    key=key,
+                    run_at=datetime.utcnow() + timedelta(seconds=delay))
+            .on_conflict_do_nothing(index_elements=[Job.key]))
+
+    def retry_delay(self, attempts):
+        """Seconds to wait before attempt `attempts + 1`, with jitter."""
+
+        delay = self.backoff * 2 ** (attempts - 1)
+        return delay * random.uniform(0.5, 1.5)
+
+
+class Worker:
+    """Runs queued jobs in `concurrency` threads."""
+
+    def __init__(self, app, queue, concurrency=4, poll_interval=1):
+        self.app = app
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'done': 0, 'failed': 0,
+                                           'retried': 0, 'run_s': 0.0})
+
+    def claim(self, limit):
+        """Mark up to `limit` due jobs as running and return them.
+
+        `SKIP LOCKED` lets concurrent workers claim different jobs without
+        waiting on each other.
+        """
+
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.queue.timeout)
+
+        due = (select(Job.id)
+               .where(or_(and_(Job.status == 'queued', Job.run_at <= now),
+                          and_(Job.status == 'running', Job.started_at < stale)))
+               .order_by(Job.run_at)
+               .limit(limit)
+               .with_for_update(skip_locked=True))
+
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id.in_(due.scalar_subquery()))
+            .values(status='running',
+                    started_at=now,
+                    attempts=Job.attempts + 1)
+            .returning(Job.id, Job.name, Job.args, Job.attempts, Job.run_at),
+            execution_options={'synchronize_session': False}).all()
+
+        db.session.commit()
+        return claimed
+
+    def run_job(self, job):
+        """Run one claimed job and record how it went."""
+
+        fn = TASKS.get(job.name)
+        started = time.perf_counter()
+        wait = (datetime.utcnow() - job.run_at).total_seconds()
+
+        try:
+            if fn is None:
+                raise LookupError(f"No task named {job.name!r}")
+
+            fn(**job.args)
+            db.session.execute(
+                update(Job)
+                .where(Job.id == job.id)
+                .values(status='done', finished_at=datetime.utcnow(), error=None),
+                execution_options={'synchronize_session': False})
+            db.session.commit()
+            outcome = 'done'
+
+        except Exception as error:
+            db.session.rollback()
+            logger.exception("Job %s (%s) failed", job.id, job.name)
+
+            if job.attempts >= self.queue.max_attempts:
+                outcome, values = 'failed', {'finished_at': datetime.utcnow()}
+            else:
+                delay = self.queue.retry_delay(job.attempts)
+                outcome, values = 'retried', {
+                    'run_at': datetime.utcnow() + timedelta(seconds=delay)}
+
+            db.session.execute(
+                update(Job)
+                .where(Job.id == job.id)
+                .values(status='failed' if outcome == 'failed' else 'queued',
+                        error=f"{type(error).__name__}: {error}",
+                        **values),
+                execution_options={'synchronize_session': False})
+            db.session.commit()
+
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            stats = self._stats[job.name]
+            stats[outcome] += 1
+            stats['run_s'] += elapsed
+
+        metrics_logger.info(json.dumps({
+            'job': job.name,
+            'id': job.id,
+            'outcome': outcome,
+            'attempt': job.attempts,
+            'wait_ms': round(max(wait, 0) * 1000, 2),
+            'run_ms': round(elapsed * 1000, 2),
+        }))
+
+        return outcome
+
+    def work_once(self, limit=1):
+        """Claim and run up to `limit` jobs in this thread.
+
+        Returns how many jobs were run.
+        """
+
+        with self.app.app_context():
+            jobs = self.claim(limit)
+
+            for job in jobs:
+                self.run_job(job)
+
+        return len(jobs)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                ran = self.work_once()
+            except Exception:
+                logger.exception("Worker thread failed to claim jobs")
+                ran = 0
+
+            if not ran:
+                self._stopping.wait(self.poll_interval)
+
+    def run(self):
+        """Run jobs until `stop()` is called (or Ctrl-C)."""
+
+        threads = [threading.Thread(target=self._loop,
+                                    name=f"worker-{n}",
+                                    daemon=True)
+                   for n in range(self.concurrency)]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        """Per-task counts of done, retried and failed jobs, and run time."""
+
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+# Shared by every app in the process, configured by `create_app`.
+queue = JobQueue()
+enqueue = queue.enqueue
@@ -0,0 +1,365 @@
+"""Live home timeline updates, sent as Server-Sent Events.
+
+A home page keeps a `/stream/timeline` connection open. When a message is
+posted, `timeline_hub.publish` hands it to every open stream whose user
+follows the author (or is the author), so new messages show up without
+reloading the page and re-running the timeline query.
+
+Streams are matched to authors in memory: each subscription registers the
+ids of the users it follows, and publishing a message is a dict lookup on
+its author. The broker that carries published messages is picked by
+`LIVE_UPDATES_URL`:
+
+- unset: messages only reach streams in the process that posted them, which
+  is enough for a single worker
+- a `postgresql://` URL: messages are sent with `NOTIFY`, and every process
+  with open streams `LISTEN`s on one dedicated connection, so streams see
+  posts from all workers
+
+An open stream holds no database connection, just a small queue, but it
+does hold whatever serves its connection for up to `STREAM_MAX_AGE`. So
+streams are not served by sync WSGI workers, where each would tie up a
+worker thread: they are served by the ASGI app (asgi.py), or by WSGI workers
+only with `STREAM_WSGI` set under gevent with psycopg2 patched by
+psycogreen. Either way, each process keeps at most `STREAM_MAX_PER_WORKER`
+open.
+"""
+
+import asyncio
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+
+from werkzeug.exceptions import ServiceUnavailable
+
+logger = logging.getLogger(__name__)
+
+# The first frame of a stream (how long browsers wait to reconnect), and the
+# comment sent every `heartbeat` seconds without events.
+RETRY_FRAME = "retry: 3000\n\n"
+KEEPALIVE_FRAME = ": keepalive\n\n"
+
+
+class TooManyStreams(ServiceUnavailable):
+    """This process already has `STREAM_MAX_PER_WORKER` streams open."""
+
+    description = "Too many live timelines are open. Please reload later."
+
+
+def green_threads():
+    """Do sockets and psycopg2 queries yield to other greenlets (gevent,
+    with psycopg2 patched by psycogreen)?"""
+
+    try:
+        import psycopg2.extensions
+        from gevent import monkey
+    except ImportError:
+        return False
+
+    return (monkey.is_module_patched('socket')
+            and psycopg2.extensions.get_wait_callback() is not None)
+
+
+def message_event(msg, author):
+    """The event published for message `msg` by user `author`."""
+
+    return {
+        'id': msg.id,
+        'text': msg.text,
+        'timestamp': msg.timestamp.isoformat(),
+        'user': {
+            'id': author.id,
+            'username': author.username,
+            'image_url': author.image_url,
+        },
+    }
+
+
+def format_event(event):
+    """`event` as an SSE frame, with the message id as its event id."""
+
+    data = json.dumps(event, separators=(',', ':'))
+    return f"id: {event['id']}\nevent: message\ndata: {data}\n\n"
+
+
+class Subscription:
+    """One open stream: the authors it wants, and its pending events.
+
+    A stream that falls `queue_size` events behind is closed; the browser
+    reconnects and catches up with `Last-Event-ID`.
+    """
+
+    def __init__(self, user_id, author_ids, queue_size=100):
+        self.user_id = user_id
+        self.author_ids = frozenset(author_ids) | {user_id}
+        self.closed = False
+        self._events = queue.Queue(maxsize=queue_size)
+
+    def put(self, event):
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            self.close()
+
+    def get(self, timeout):
+        """The next event, or None if there was none within `timeout`."""
+
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+
+        # Wake up the stream if it is waiting.
+        try:
+            self._events.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class AsyncSubscription(Subscription):
+    """A `Subscription` read on event `loop` without blocking it."""
+
+    def __init__(self, user_id, author_ids, queue_size=100, *, loop):
+        super().__init__(user_id, author_ids, queue_size)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def _wake(self):
+        # Events are delivered from other threads (e.g. the listener).
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass    # the loop has closed
+
+    def put(self, event):
+        super().put(event)
+        self._wake()
+
+    def close(self):
+        super().close()
+        self._wake()
+
+    async def next(self, timeout):
+        """The next event, or None if there was none within `timeout`."""
+
+        self._ready.clear()
+
+        try:
+            return self._events.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        try:
+            return self._events.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class MemoryBroker:
+    """Delivers published events within this process."""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def start(self):
+        pass
+
+
+class PostgresBroker:
+    """Delivers published events to every process through LISTEN/NOTIFY.
+
+    Publishing uses a short autocommit connection of its own; each process
+    with open streams listens on one more. Errors are logged: a lost event
+    only means a stream misses a message until its page is reloaded.
+    """
+
+    def __init__(self, url, deliver, channel='chirper_timeline'):
+        self.url = url
+        self.deliver = deliver
+        self.channel = channel
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._listener = None
+
+    def _connect(self):
+        import psycopg2
+
+        connection = psycopg2.connect(self.url)
+        connection.autocommit = True
+        return connection
+
+    def publish(self, event):
+        payload = json.dumps(event, separators=(',', ':'))
+
+        with self._lock:
+            try:
+                if self._connection is None or self._connection.closed:
+                    self._connection = self._connect()
+
+                with self._connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)",
+                                   (self.channel, payload))
+            except Exception:
+                logger.warning("Failed to publish timeline event", exc_info=True)
+                self._connection = None
+
+    def start(self):
+        """Start listening, on first use (after any fork)."""
+
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen,
+                                                  name="timeline-listener",
+                                                  daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                connection = self._connect()
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self.deliver(json.loads(notify.payload))
+
+            except Exception:
+                logger.warning("Timeline listener failed; reconnecting",
+                               exc_info=True)
+                time.sleep(1)
+
+
+class TimelineHub:
+    """Routes published messages to the open streams that want them."""
+
+    def __init__(self, heartbeat=15, max_age=300, queue_size=100,
+                 max_streams=1000):
+        self.heartbeat = heartbeat
+        self.max_age = max_age
+        self.queue_size = queue_size
+        self.max_streams = max_streams
+
+        # Whether the WSGI app serves streams, and whether pages should
+        # open one (set by the ASGI app, which serves them itself).
+        self.serve_wsgi = False
+        self.available = False
+
+        self.broker = MemoryBroker(self._deliver)
+        self.delivered = 0
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._by_author = defaultdict(set)
+        self._open = set()
+
+    def init_app(self, app):
+        self.heartbeat = app.config['STREAM_HEARTBEAT']
+        self.max_age = app.config['STREAM_MAX_AGE']
+        self.queue_size = app.config['STREAM_QUEUE_SIZE']
+        self.max_streams = app.config['STREAM_MAX_PER_WORKER']
+
+        self.serve_wsgi = app.config['STREAM_WSGI']
+        if self.serve_wsgi and not green_threads():
+            logger.warning("STREAM_WSGI needs gevent workers with psycopg2 "
+                           "patched by psycogreen; not serving streams")
+            self.serve_wsgi = False
+        self.available = self.serve_wsgi
+
+        url = app.config['LIVE_UPDATES_URL']
+
+        if url:
+            self.broker = PostgresBroker(url, self._deliver)
+        else:
+            self.broker = MemoryBroker(self._deliver)
+
+    def subscribe(self, user_id, author_ids, loop=None):
+        """Open a `Subscription` to messages by `author_ids` (and by
+        `user_id` itself), or an `AsyncSubscription` read on `loop`.
+
+        Raises `TooManyStreams` if `max_streams` are already open.
+        """
+
+        if loop is None:
+            subscription = Subscription(user_id, author_ids, self.queue_size)
+        else:
+            subscription = AsyncSubscription(user_id, author_ids,
+                                             self.queue_size, loop=loop)
+
+        with self._lock:
+            if len(self._open) >= self.max_streams:
+                raise TooManyStreams(retry_after=int(self.max_age))
+
+            self._open.add(subscription)
+            for author_id in subscription.author_ids:
+                self._by_author[author_id].add(subscription)
+
+        self.broker.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._open.discard(subscription)
+            for author_id in subscription.author_ids:
+                subscribers = self._by_author.get(author_id)
+
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+
+                    if not subscribers:
+                        del self._by_author[author_id]
+
+    def publish(self, event):
+        """Send a `message_event` to the streams following its author."""
+
+        self.broker.publish(event)
+
+    def _deliver(self, event):
+        with self._lock:
+            subscribers = list(self._by_author.get(event['user']['id'], ()))
+
+        for subscription in subscribers:
+            if subscription.closed:
+                continue
+
+            subscription.put(event)
+
+            if subscription.closed:
+                self.dropped += 1
+            else:
+                self.delivered += 1
+
+    def stats(self):
+        """Open streams, and events delivered to and dropped by them."""
+
+        with self._lock:
+            streams = len(self._open)
+
+        return {'streams': streams,
+                'delivered': self.delivered,
+                'dropped': self.dropped}
+
+
+# Shared by every app in the process, configured by `create_app`.
+timeline_hub = TimelineHub()
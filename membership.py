@@ -0,0 +1,67 @@
+"""Per-request follow and like lookups for the logged-in user.
+
+Templates ask "does the current user follow this user?" and "has the current
+user liked this message?" for every card on a page. Rather than scanning the
+user's whole `following` / `liked_messages` collections for each card, a route
+batch-loads the answers for everything on the page with one query each, and
+the templates check them against sets.
+"""
+
+from sqlalchemy import select
+
+from models import db, Follows, LikedWarble
+
+
+def _ids(items):
+    """Return set of ids for `items`, which may be model instances or ids."""
+
+    return {getattr(item, 'id', item) for item in items if item is not None}
+
+
+class Membership:
+    """Follow/like state of one user against the users and messages on a page."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+        self._checked_user_ids = set()
+        self._following_ids = set()
+
+        self._checked_message_ids = set()
+        self._liked_message_ids = set()
+
+    def load(self, users=(), messages=()):
+        """Batch-load follow state for `users` and like state for `messages`.
+
+        Anything already loaded for this request is not queried again.
+        """
+
+        user_ids = _ids(users) - self._checked_user_ids
+
+        if user_ids:
+            self._following_ids.update(db.session.scalars(
+                select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == self.user_id)
+                .where(Follows.user_being_followed_id.in_(user_ids))))
+            self._checked_user_ids |= user_ids
+
+        message_ids = _ids(messages) - self._checked_message_ids
+
+        if message_ids:
+            self._liked_message_ids.update(db.session.scalars(
+                select(LikedWarble.message_id)
+                .where(LikedWarble.user_id == self.user_id)
+                .where(LikedWarble.message_id.in_(message_ids))))
+            self._checked_message_ids |= message_ids
+
+    def is_following(self, user):
+        """Does this user follow `user`?"""
+
+        self.load(users=[user])
+        return getattr(user, 'id', user) in self._following_ids
+
+    def has_liked(self, message):
+        """Has this user liked `message`?"""
+
+        self.load(messages=[message])
+        return getattr(message, 'id', message) in self._liked_message_ids
@@ -0,0 +1,287 @@
+"""Schema migrations for existing Chirper databases.
+
+`db.create_all()` creates missing tables but never changes existing ones, so
+a database created before a schema change is upgraded with:
+
+    flask db-upgrade
+
+Each migration runs once and is recorded in the `schema_migrations` table.
+Migrations are safe to run against a live database: columns are added with
+constant defaults (no table rewrite on PostgreSQL 11+), existing rows are
+backfilled in small batches, and indexes on existing tables are built with
+`CREATE INDEX CONCURRENTLY` so writes are not blocked. Every step checks
+whether it has already been done, so an interrupted upgrade can be re-run.
+"""
+
+import re
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, inspect, insert, select, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from models import (
+    db, User, Message, Follows, LikedWarble, TimelineEntry, Job, Notification,
+    NotificationActor,
+)
+import timeline
+
+BATCH_SIZE = 5000
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Text, primary_key=True),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version):
+    """Register the decorated function as migration `version`.
+
+    Migrations run in the order they are registered. Each is called with a
+    connection in autocommit mode.
+    """
+
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        return fn
+
+    return register
+
+
+##############################################################################
+# Helpers
+
+
+def add_column(conn, column):
+    """Add model `column` to its table if it isn't there already."""
+
+    table = column.table.name
+    existing = {col['name'] for col in inspect(conn).get_columns(table)}
+
+    if column.name not in existing:
+        ddl = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {ddl}"))
+
+
+def create_index(conn, index):
+    """Create model `index` if it doesn't exist, concurrently on PostgreSQL."""
+
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+
+    if conn.dialect.name == 'postgresql':
+        ddl = re.sub(r"\bINDEX\b", "INDEX CONCURRENTLY", ddl, count=1)
+
+    conn.execute(text(ddl))
+
+
+def index(table, name):
+    """Return index `name` declared on model table `table`."""
+
+    return next(idx for idx in table.indexes if idx.name == name)
+
+
+def in_batches(model):
+    """Yield selects of `model` ids, `BATCH_SIZE` at a time."""
+
+    max_id = db.session.scalar(select(func.max(model.id))) or 0
+
+    for start in range(1, max_id + 1, BATCH_SIZE):
+        yield (select(model.id)
+               .where(model.id >= start)
+               .where(model.id < start + BATCH_SIZE))
+
+
+##############################################################################
+# Migrations
+
+
+@migration('0001_user_counters')
+def add_user_counters(conn):
+    """Add denormalized counters to users and fill them in."""
+
+    for name in ('messages_count',
+                 'following_count',
+                 'followers_count',
+                 'liked_messages_count'):
+        add_column(conn, User.__table__.c[name])
+
+    for batch in in_batches(User):
+        User.reconcile_counts(batch)
+        db.session.commit()
+
+
+@migration('0002_home_timelines')
+def add_home_timelines(conn):
+    """Create stored home timelines and fill them from follows/messages."""
+
+    TimelineEntry.__table__.create(bind=conn, checkfirst=True)
+
+    for batch in in_batches(User):
+        timeline.rebuild_all(batch)
+        db.session.commit()
+
+
+@migration('0003_hot_path_indexes')
+def add_hot_path_indexes(conn):
+    """Index the timeline, follow, like and username lookups."""
+
+    for table, name in ((Message.__table__, 'ix_messages_user_id_timestamp'),
+                        (Message.__table__, 'ix_messages_timestamp'),
+                        (Follows.__table__, 'ix_follows_user_following_id'),
+                        (LikedWarble.__table__, 'ix_liked_warbles_message_id'),
+                        (User.__table__, 'ix_users_username_pattern')):
+        create_index(conn, index(table, name))
+
+
+@migration('0004_username_trigram_index')
+def add_username_trigram_index(conn):
+    """Index usernames for `LIKE '%q%'` searches, if pg_trgm is available."""
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    available = conn.scalar(text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"))
+
+    if not available:
+        current_app.logger.warning(
+            "pg_trgm is not installed; skipping trigram index on usernames.")
+        return
+
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm "
+        "ON users USING gin (username gin_trgm_ops)"))
+
+
+@migration('0005_liked_warbles_cascade')
+def cascade_liked_warbles(conn):
+    """Delete likes along with their user or message.
+
+    The foreign keys are re-added `NOT VALID` and then validated, which
+    doesn't block writes to liked_warbles while existing rows are checked.
+    SQLite can't alter constraints; new SQLite databases get them from
+    `create_all`.
+    """
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    table = LikedWarble.__table__
+
+    for fk in inspect(conn).get_foreign_keys(table.name):
+        if (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+            continue
+
+        column = fk['constrained_columns'][0]
+        target = next(iter(table.c[column].foreign_keys)).column
+        name = fk['name']
+
+        conn.execute(text(
+            f'ALTER TABLE {table.name} DROP CONSTRAINT "{name}", '
+            f'ADD CONSTRAINT "{name}" FOREIGN KEY ({column}) '
+            f'REFERENCES {target.table.name} ({target.name}) '
+            f'ON DELETE CASCADE NOT VALID'))
+        conn.execute(text(
+            f'ALTER TABLE {table.name} VALIDATE CONSTRAINT "{name}"'))
+
+
+@migration('0006_user_version')
+def add_user_version(conn):
+    """Add the version counter used to validate cached user pages."""
+
+    add_column(conn, User.__table__.c.version)
+
+
+@migration('0007_liked_warbles_created_at')
+def add_like_timestamps(conn):
+    """Record when likes are made, for trending messages.
+
+    Existing likes are left NULL: their time is unknown, and they're too
+    old to be trending anyway.
+    """
+
+    add_column(conn, LikedWarble.__table__.c.created_at)
+    create_index(conn, index(LikedWarble.__table__,
+                             'ix_liked_warbles_created_at'))
+
+
+@migration('0008_jobs')
+def add_jobs(conn):
+    """Create the background job queue."""
+
+    Job.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration('0009_notifications')
+def add_notifications(conn):
+    """Create notifications and the unread notification counter."""
+
+    Notification.__table__.create(bind=conn, checkfirst=True)
+    add_column(conn, User.__table__.c.unread_notifications)
+
+
+@migration('0010_user_renamed_at')
+def add_user_renamed_at(conn):
+    """Record when users are renamed, for other processes' search indexes."""
+
+    add_column(conn, User.__table__.c.renamed_at)
+    create_index(conn, index(User.__table__, 'ix_users_renamed_at'))
+
+
+@migration('0011_notification_actors')
+def add_notification_actors(conn):
+    """Record who is counted in unread notifications, to count them once.
+
+    Unread notifications from before this keep their event counts.
+    """
+
+    NotificationActor.__table__.create(bind=conn, checkfirst=True)
+
+
+##############################################################################
+# Runner
+
+
+def upgrade():
+    """Create missing tables, then apply pending migrations in order.
+
+    Returns the versions that were applied.
+    """
+
+    db.create_all()
+    applied = []
+
+    with db.engine.connect().execution_options(
+            isolation_level='AUTOCOMMIT') as conn:
+        done = set(conn.scalars(select(schema_migrations.c.version)))
+
+        for version, fn in MIGRATIONS:
+            if version in done:
+                continue
+
+            fn(conn)
+            conn.execute(insert(schema_migrations).values(
+                version=version,
+                applied_at=datetime.utcnow(),
+            ))
+            applied.append(version)
+
+    return applied
+
+
+def stamp():
+    """Record every migration as applied, for a freshly created schema."""
+
+    with db.engine.begin() as conn:
+        done = set(conn.scalars(select(schema_migrations.c.version)))
+
+        for version, _ in MIGRATIONS:
+            if version not in done:
+                conn.execute(insert(schema_migrations).values(
+                    version=version,
+                    applied_at=datetime.utcnow(),
+                ))
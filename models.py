@@ -2,12 +2,15 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, selectinload
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import hasher
+from replicas import RoutingSession, router
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 DEFAULT_IMAGE_URL = "/static/images/default-pic.png"
 DEFAULT_HEADER_IMAGE_URL = "/static/images/warbler-hero.jpg"
@@ -30,6 +33,25 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key leads with the followed user; this serves lookups by
+    # follower ("who does X follow?").
+    __table_args__ = (db.Index('ix_follows_user_following_id',
+                               'user_following_id',
+                               'user_being_followed_id'),)
+
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does user `follower_id` follow user `followed_id`?
+
+        A single primary-key lookup, rather than loading either user's
+        whole collection.
+        """
+
+        return db.session.scalar(
+            select(cls.user_following_id)
+            .where(cls.user_being_followed_id == followed_id)
+            .where(cls.user_following_id == follower_id)) is not None
+
 
 class User(db.Model):
     """User in the system."""
@@ -76,6 +98,60 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts, kept up to date by the routes that change them
+    # (see `adjust_counts`) and rebuilt by `reconcile_counts`.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    liked_messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Bumped whenever the user's row changes (profile edits, counters), so
+    # pages about the user can be validated without rendering them.
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # When the username last changed, so search indexes in other processes
+    # can pick up the rename (see search.py).
+    renamed_at = db.Column(db.DateTime, nullable=True)
+
+    # Notifications (counted per distinct actor in each group) the user
+    # hasn't seen yet. Kept apart
+    # from `version`, since it doesn't change pages about the user.
+    unread_notifications = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
     messages = db.relationship('Message', backref="user")
 
     followers = db.relationship(
@@ -88,6 +164,14 @@ class User(db.Model):
 
     liked_messages = db.relationship('Message', secondary = "liked_warbles", backref="users_liked_messages")
 
+    # Prefix searches (`LIKE 'abc%'`) on username. On PostgreSQL, migration
+    # 0004 also adds a trigram index for substring searches when pg_trgm is
+    # available.
+    __table_args__ = (db.Index('ix_users_username_pattern',
+                               'username',
+                               postgresql_ops={'username': 'text_pattern_ops'}),
+                      db.Index('ix_users_renamed_at', 'renamed_at'))
+
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
@@ -99,7 +183,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -125,26 +209,145 @@ class User(db.Model):
 
         user = cls.query.filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.check_password(password):
+            return user
 
         return False
 
+    def check_password(self, password):
+        """Does `password` match this user's password?
+
+        If the stored hash was made with a different bcrypt cost than the
+        configured one, it is replaced (the caller commits the change).
+        """
+
+        if not hasher.verify(self.password, password):
+            return False
+
+        if hasher.needs_rehash(self.password):
+            self.password = hasher.hash(password)
+
+        return True
+
+    @classmethod
+    def adjust_counts(cls, user_ids, **deltas):
+        """Atomically add `deltas` to counter columns of `user_ids`.
+
+        `user_ids` is a single id or a list/select of ids; `deltas` maps
+        counter names to amounts, e.g. `followers_count=1`. The change is
+        made in the database, so concurrent requests can't lose updates.
+        Also bumps `version`.
+        """
+
+        if isinstance(user_ids, int):
+            where = cls.id == user_ids
+        else:
+            where = cls.id.in_(user_ids)
+
+        db.session.execute(
+            update(cls)
+            .where(where)
+            .values({
+                cls.version: cls.version + 1,
+                **{getattr(cls, name): getattr(cls, name) + delta
+                   for name, delta in deltas.items()},
+            }))
+
+    @classmethod
+    def reconcile_counts(cls, user_ids=None):
+        """Rebuild counter columns from the base tables.
+
+        Rebuilds every user, or only `user_ids` (a list or select of ids).
+        """
+
+        def count(column, value):
+            return (select(func.count())
+                    .where(column == value)
+                    .scalar_subquery())
+
+        stmt = update(cls).values(
+            messages_count=count(Message.user_id, cls.id),
+            following_count=count(Follows.user_following_id, cls.id),
+            followers_count=count(Follows.user_being_followed_id, cls.id),
+            liked_messages_count=count(LikedWarble.user_id, cls.id),
+        )
+
+        if user_ids is not None:
+            stmt = stmt.where(cls.id.in_(user_ids))
+
+        db.session.execute(stmt, execution_options={'synchronize_session': False})
+
+    @classmethod
+    def purge(cls, user_id):
+        """Delete user `user_id` with their messages, likes and follows.
+
+        Each table is cleared with one DELETE, in dependency order, so no
+        rows are loaded into the session however big the account is. The
+        counters of users who followed, were followed by, or liked messages
+        of this user are adjusted first.
+        """
+
+        user_messages = select(Message.id).where(Message.user_id == user_id)
+        no_sync = {'synchronize_session': False}
+
+        cls.adjust_counts(
+            select(Follows.user_following_id)
+            .where(Follows.user_being_followed_id == user_id),
+            following_count=-1)
+
+        cls.adjust_counts(
+            select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == user_id),
+            followers_count=-1)
+
+        likes = (select(LikedWarble.user_id, func.count().label('likes'))
+                 .where(LikedWarble.message_id.in_(user_messages))
+                 .group_by(LikedWarble.user_id)
+                 .subquery())
+
+        db.session.execute(
+            update(cls)
+            .where(cls.id == likes.c.user_id)
+            .values(liked_messages_count=cls.liked_messages_count - likes.c.likes,
+                    version=cls.version + 1),
+            execution_options=no_sync)
+
+        db.session.execute(
+            delete(LikedWarble)
+            .where((LikedWarble.user_id == user_id)
+                   | LikedWarble.message_id.in_(user_messages)),
+            execution_options=no_sync)
+
+        db.session.execute(
+            delete(Message).where(Message.user_id == user_id),
+            execution_options=no_sync)
+
+        db.session.execute(
+            delete(Follows)
+            .where((Follows.user_being_followed_id == user_id)
+                   | (Follows.user_following_id == user_id)),
+            execution_options=no_sync)
+
+        db.session.execute(
+            delete(cls).where(cls.id == user_id),
+            execution_options=no_sync)
+
+    @classmethod
+    def versions(cls, *user_ids):
+        """Return {user id: version} for those of `user_ids` that exist."""
+
+        return dict(db.session.execute(
+            select(cls.id, cls.version).where(cls.id.in_(user_ids))).all())
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(follower_id=other_user.id, followed_id=self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(follower_id=self.id, followed_id=other_user.id)
 
 
 class Message(db.Model):
@@ -174,16 +377,58 @@ class Message(db.Model):
         nullable=False,
     )
 
+    __table_args__ = (
+        # A user's messages, newest first (profiles, timeline fan-out).
+        db.Index('ix_messages_user_id_timestamp',
+                 user_id,
+                 timestamp.desc(),
+                 id.desc()),
+        # All messages, newest first ("recent posts").
+        db.Index('ix_messages_timestamp', timestamp.desc(), id.desc()),
+    )
+
+    @classmethod
+    def with_authors(cls, loading='joined'):
+        """Query messages with their authors (`message.user`) loaded up front.
+
+        Every message listing shows the author's name and picture, so
+        loading authors lazily costs one query per message. `loading` picks
+        the strategy: 'joined' fetches authors in the same query with a JOIN
+        (best for a page of mostly-different authors); 'selectin' fetches
+        them with one extra `IN` query (best when rows are wide or authors
+        repeat a lot).
+        """
+
+        if loading == 'joined':
+            option = joinedload(cls.user)
+        elif loading == 'selectin':
+            option = selectinload(cls.user)
+        else:
+            raise ValueError(f"Unknown loading strategy: {loading}")
+
+        return cls.query.options(option)
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. Read replicas listed in
+    `REPLICA_URLS` are connected too (see replicas.py).
     """
 
     app.app_context().push()
     db.app = app
     db.init_app(app)
+    router.init_app(app)
+
+
+def insert_new(model):
+    """`INSERT ... ON CONFLICT DO NOTHING` into `model`'s table."""
+
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+
+    return postgresql.insert(model).on_conflict_do_nothing()
 
 
 class LikedWarble(db.Model):
@@ -198,25 +443,223 @@ class LikedWarble(db.Model):
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id'),
-        # db.ForeignKey('users.id', ondelete='CASCADE'),
+        db.ForeignKey('users.id', ondelete='CASCADE'),
         nullable=False,
         # primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
-        db.ForeignKey('messages.id'),
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
         nullable=False,
         # primary_key=True,
     )
 
+    # When the like was made; NULL for likes from before this was recorded.
+    created_at = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
     __table_args__ = (UniqueConstraint('user_id',
                                        'message_id',
-                                       name='unique'),)
+                                       name='unique'),
+                      db.Index('ix_liked_warbles_message_id', 'message_id'),
+                      db.Index('ix_liked_warbles_created_at', 'created_at'))
+
+
+class TimelineEntry(db.Model):
+    """A message delivered into a user's precomputed home timeline."""
+
+    __tablename__ = 'home_timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # Copied from the message so the timeline can be read in order
+    # without touching the messages table.
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (db.Index('ix_home_timelines_user_id_timestamp',
+                               'user_id',
+                               'timestamp',
+                               'message_id'),)
+
+
+class Job(db.Model):
+    """Deferred work, run by `flask worker` (see jobs.py)."""
+
+    __tablename__ = 'jobs'
 
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # Name of the registered task, and its keyword arguments.
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    args = db.Column(
+        db.JSON,
+        nullable=False,
+    )
+
+    # A job is enqueued at most once per key.
+    key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    # 'queued', 'running', 'done' or 'failed'.
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # Not before this time (pushed back after a failed attempt).
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
+
+
+class Notification(db.Model):
+    """Follows of, or likes on, a user's messages, coalesced per group.
+
+    All unread events of one group ("likes of message 12", "new followers")
+    for a recipient share one row: `count` is the number of distinct users
+    behind them (see `NotificationActor`) and `actor_id` the latest one
+    ("alice and 41 others liked your warble"). Once read, the next event
+    starts a new row.
+    """
+
+    __tablename__ = 'notifications'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
 
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    # 'follow' or 'like'.
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+    )
 
+    # e.g. "follow" or "like:12"; unread rows are unique per user and group.
+    group_key = db.Column(
+        db.Text,
+        nullable=False,
+    )
 
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='SET NULL'),
+    )
 
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+    )
 
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    read_at = db.Column(
+        db.DateTime,
+    )
+
+    actor = db.relationship('User', foreign_keys=[actor_id])
+    message = db.relationship('Message')
+
+    __table_args__ = (
+        db.Index('ix_notifications_unread_group', 'user_id', 'group_key',
+                 unique=True,
+                 postgresql_where=read_at.is_(None),
+                 sqlite_where=read_at.is_(None)),
+        db.Index('ix_notifications_user_id_updated_at',
+                 'user_id', 'updated_at', 'id'),
+    )
+
+
+class NotificationActor(db.Model):
+    """A user already counted in one of a recipient's unread notification
+    groups, so liking and unliking (or following and unfollowing) again
+    doesn't count twice. Cleared when the recipient reads them."""
+
+    __tablename__ = 'notification_actors'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    group_key = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
@@ -0,0 +1,245 @@
+"""Notifications of new followers and likes.
+
+A popular message can be liked thousands of times a minute, so events are
+not written one by one. Routes hand them to a per-process buffer, which is
+written out every `flush_interval` seconds, or sooner once `max_events` are
+waiting:
+
+- events are coalesced in memory per recipient and group (new followers;
+  likes of one message), so a burst of likes becomes one row change
+- their actors are recorded with one `INSERT ... ON CONFLICT DO NOTHING`
+  into `notification_actors`; only actors not yet counted in the unread
+  group count, so liking and unliking repeatedly notifies once
+- each group with new actors is upserted into its unread `Notification`
+  row with one multi-row `INSERT ... ON CONFLICT DO UPDATE`, adding to its
+  count
+- recipients' `unread_notifications` counters are bumped with one UPDATE
+
+Events still in the buffer when a process dies are lost; notifications are
+a convenience, not a record.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import Integer, column, delete, select, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload
+
+from models import (
+    db, insert_new, Message, Notification, NotificationActor, User,
+)
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationBuffer:
+    """Collects notification events and writes them out in batches."""
+
+    def __init__(self, flush_interval=0.5, max_events=500):
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+
+        self.app = None
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config['NOTIFY_FLUSH_MS'] / 1000
+        self.max_events = app.config['NOTIFY_FLUSH_EVENTS']
+
+    def add(self, recipient_id, kind, actor_id, message_id=None):
+        """Queue one event: `actor_id` followed `recipient_id` (kind
+        'follow') or liked their message `message_id` (kind 'like')."""
+
+        if recipient_id == actor_id:
+            return
+
+        with self._lock:
+            self._events.append(
+                (recipient_id, kind, actor_id, message_id, datetime.utcnow()))
+            full = len(self._events) >= self.max_events
+
+        self._start()
+
+        if full:
+            self._wake.set()
+
+    def _start(self):
+        """Start the flushing thread on first use (after any fork)."""
+
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name="notification-flusher",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception("Failed to write notifications")
+
+    def flush(self):
+        """Write out buffered events now. Returns how many were written."""
+
+        with self._lock:
+            events, self._events = self._events, []
+
+        if not events:
+            return 0
+
+        started = time.perf_counter()
+
+        # Users and messages deleted since their events were queued.
+        user_ids = {event[0] for event in events} | {event[2] for event in events}
+        message_ids = {event[3] for event in events if event[3]}
+        live_users = set(db.session.scalars(
+            select(User.id).where(User.id.in_(user_ids))))
+        live_messages = set(db.session.scalars(
+            select(Message.id).where(Message.id.in_(message_ids))))
+
+        events = [event for event in events
+                  if event[0] in live_users and event[2] in live_users
+                  and (event[3] is None or event[3] in live_messages)]
+
+        if not events:
+            return 0
+
+        # (recipient, group) -> [kind, message id, count, latest actor, at]
+        groups = {}
+        actors = set()
+        for recipient_id, kind, actor_id, message_id, at in events:
+            key = (recipient_id,
+                   f"{kind}:{message_id}" if message_id else kind)
+            group = groups.setdefault(key, [kind, message_id, 0, actor_id, at])
+            group[3:] = [actor_id, at]
+            actors.add((*key, actor_id))
+
+        # Count each actor once per unread group, across flushes too: only
+        # the ones not already recorded come back.
+        new_actors = db.session.execute(
+            insert_new(NotificationActor)
+            .values([dict(user_id=recipient_id, group_key=group_key,
+                          actor_id=actor_id)
+                     for recipient_id, group_key, actor_id in actors])
+            .returning(NotificationActor.user_id,
+                       NotificationActor.group_key)).all()
+
+        for key in new_actors:
+            groups[tuple(key)][2] += 1
+
+        groups = {key: group for key, group in groups.items() if group[2]}
+
+        if not groups:
+            db.session.commit()
+            return 0
+
+        rows = [dict(user_id=recipient_id,
+                     group_key=group_key,
+                     kind=kind,
+                     message_id=message_id,
+                     count=count,
+                     actor_id=actor_id,
+                     updated_at=at)
+                for (recipient_id, group_key), (kind, message_id, count,
+                                                actor_id, at)
+                in groups.items()]
+
+        if db.session.get_bind().dialect.name == 'sqlite':
+            insert = sqlite.insert(Notification)
+        else:
+            insert = postgresql.insert(Notification)
+
+        db.session.execute(
+            insert.values(rows).on_conflict_do_update(
+                index_elements=[Notification.user_id, Notification.group_key],
+                index_where=Notification.read_at.is_(None),
+                set_={
+                    'count': Notification.count + insert.excluded.count,
+                    'actor_id': insert.excluded.actor_id,
+                    'updated_at': insert.excluded.updated_at,
+                }))
+
+        unread = defaultdict(int)
+        for (recipient_id, _), (_, _, count, _, _) in groups.items():
+            unread[recipient_id] += count
+
+        deltas = values(column('id', Integer),
+                        column('delta', Integer),
+                        name='deltas').data(list(unread.items()))
+
+        db.session.execute(
+            update(User)
+            .where(User.id == deltas.c.id)
+            .values(unread_notifications=(User.unread_notifications
+                                          + deltas.c.delta)),
+            execution_options={'synchronize_session': False})
+
+        db.session.commit()
+        user_cache.invalidate(*unread)
+
+        counted = sum(unread.values())
+
+        logger.debug("Wrote %s notification events (%s new actors) as %s rows "
+                     "in %.1f ms", len(events), counted, len(rows),
+                     (time.perf_counter() - started) * 1000)
+
+        return counted
+
+
+def inbox(user_id, limit=50):
+    """Return `user_id`'s newest notifications, with actors and messages."""
+
+    return (Notification.query
+            .options(joinedload(Notification.actor),
+                     joinedload(Notification.message))
+            .filter(Notification.user_id == user_id)
+            .order_by(Notification.updated_at.desc(), Notification.id.desc())
+            .limit(limit)
+            .all())
+
+
+def mark_read(user_id):
+    """Mark all of `user_id`'s notifications read and zero their counter."""
+
+    now = datetime.utcnow()
+
+    # Later events start new groups, which count their actors afresh.
+    db.session.execute(
+        delete(NotificationActor)
+        .where(NotificationActor.user_id == user_id),
+        execution_options={'synchronize_session': False})
+
+    db.session.execute(
+        update(Notification)
+        .where(Notification.user_id == user_id)
+        .where(Notification.read_at.is_(None))
+        .values(read_at=now),
+        execution_options={'synchronize_session': False})
+
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(unread_notifications=0),
+        execution_options={'synchronize_session': False})
+
+
+# Shared by every app in the process, configured by `create_app`.
+notification_buffer = NotificationBuffer()
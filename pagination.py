@@ -0,0 +1,91 @@
+"""Keyset pagination.
+
+Pages are ordered newest-first on a unique key (`(timestamp, id)` for
+messages, `id` for users). The "next page" cursor is the key of the last row
+shown, so each page is an index range scan no matter how deep it is.
+
+`paginate` works on ORM queries and on column queries
+(`db.session.query(Message.id, ...)`); for the latter, the key columns must
+be selected under their own names so the cursor can be read off the last row.
+"""
+
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import DateTime, tuple_
+
+from models import Message, User
+
+PAGE_SIZE = 30
+
+MESSAGE_KEYS = (Message.timestamp, Message.id)
+USER_KEYS = (User.id,)
+
+
+def encode_cursor(values):
+    """Turn key values of the last row on a page into a cursor string."""
+
+    return "_".join(
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in values)
+
+
+def decode_cursor(cursor, keys):
+    """Turn a cursor string back into key values for columns `keys`.
+
+    Aborts with a 400 if the cursor is malformed.
+    """
+
+    parts = cursor.split("_")
+
+    if len(parts) != len(keys):
+        abort(400)
+
+    try:
+        return tuple(
+            datetime.fromisoformat(part) if isinstance(key.type, DateTime)
+            else int(part)
+            for part, key in zip(parts, keys))
+    except ValueError:
+        abort(400)
+
+
+def current_cursor(keys):
+    """Return decoded `after` cursor from the querystring, or None."""
+
+    cursor = request.args.get('after')
+    return decode_cursor(cursor, keys) if cursor else None
+
+
+def next_cursor(items, keys, per_page):
+    """Return cursor for the page after `items`, or None on the last page.
+
+    `items` should hold up to `per_page + 1` rows; the extra row only
+    signals that another page exists and is dropped by the caller.
+    """
+
+    if len(items) <= per_page:
+        return None
+
+    last = items[per_page - 1]
+    return encode_cursor(getattr(last, key.key) for key in keys)
+
+
+def paginate(query, keys, per_page=PAGE_SIZE):
+    """Return `(items, next_cursor)` for one page of `query`.
+
+    Rows are ordered newest-first on `keys` and start after the `after`
+    cursor in the querystring.
+    """
+
+    after = current_cursor(keys)
+
+    if after:
+        query = query.filter(tuple_(*keys) < after)
+
+    items = (query
+             .order_by(*(key.desc() for key in keys))
+             .limit(per_page + 1)
+             .all())
+
+    return items[:per_page], next_cursor(items, keys, per_page)
@@ -0,0 +1,224 @@
+"""Password hashing for Chirper.
+
+bcrypt is slow on purpose (hundreds of milliseconds per hash at the default
+cost). Run on request threads, a burst of logins takes every worker and
+timeline requests wait behind them. This module bounds that work:
+
+- `PasswordHasher` runs hash/verify calls in a small process pool
+  (`PASSWORD_HASH_WORKERS`; 0 runs them inline). At most
+  `PASSWORD_HASH_MAX_PENDING` calls may be in flight per process. Callers
+  wait up to `PASSWORD_HASH_TIMEOUT` seconds for a slot and then get a 503.
+- The cost (`BCRYPT_LOG_ROUNDS`) can be changed at any time. Hashes made
+  with another cost are upgraded the next time their user logs in.
+- `ConcurrencyLimiter` caps password checks in flight per username and per
+  client IP. Extra attempts get a 429, so one client can't fill the queue.
+
+`PasswordHasher.stats()` reports queue depth. A request that hashes or checks
+a password records the time it took and the queue depth it found on `g`,
+and both go out with the request's stats (see instrumentation.py).
+"""
+
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import bcrypt
+from flask import g, has_request_context
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingBusy(ServiceUnavailable):
+    """Too many password hashes are already queued in this process."""
+
+    description = "Too many sign-ins right now. Please try again shortly."
+
+
+class TooManyAttempts(TooManyRequests):
+    """This user or client already has password checks in flight."""
+
+    description = "Too many sign-in attempts at once. Please try again."
+
+
+def _encode(password):
+    if not password:
+        raise ValueError("Password must be non-empty.")
+
+    return password.encode('utf-8') if isinstance(password, str) else password
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verify(password, hashed):
+    return bcrypt.checkpw(password, hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Hash and verify passwords off the request thread, with bounded work."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=0, max_pending=8,
+                 timeout=5):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+
+        self._pending = 0
+        self._peak = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def init_app(self, app):
+        """Configure from `app.config`."""
+
+        self.shutdown()
+
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 0)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', 8)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', 5)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def shutdown(self):
+        """Stop the worker processes, if any were started."""
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _get_pool(self):
+        # Started on first use, so each forked web worker gets its own.
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        start = time.perf_counter()
+
+        if not slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._rejected += 1
+            self._record(start)
+            raise HashingBusy()
+
+        with self._lock:
+            self._pending += 1
+            self._peak = max(self._peak, self._pending)
+
+        try:
+            if self.workers:
+                return self._get_pool().submit(fn, *args).result()
+            return fn(*args)
+
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+            slots.release()
+            self._record(start)
+
+    def _record(self, start):
+        # Reported with the request's database numbers, along with the
+        # queue depth as this call finished (see instrumentation.py).
+        if has_request_context():
+            g.hash_time = g.get('hash_time', 0) + time.perf_counter() - start
+            g.hash_status = self.stats()
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+
+        return self._run(_hash, _encode(password), self.rounds)
+
+    def verify(self, hashed, password):
+        """Does `password` match bcrypt hash `hashed`?"""
+
+        if not password:
+            return False
+
+        return self._run(_verify, _encode(password), hashed)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different cost than the configured one?"""
+
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        """Return queue depth and counts of hash/verify calls."""
+
+        with self._lock:
+            running = (min(self._pending, self.workers) if self.workers
+                       else self._pending)
+
+            return dict(
+                pending=self._pending,
+                running=running,
+                queued=self._pending - running,
+                peak=self._peak,
+                max_pending=self.max_pending,
+                completed=self._completed,
+                rejected=self._rejected,
+            )
+
+
+class ConcurrencyLimiter:
+    """Cap password checks in flight per username and per client IP.
+
+    Counts are kept per process, which is enough to stop one client from
+    filling a process's hashing queue.
+    """
+
+    def __init__(self, per_user=2, per_ip=8):
+        self.limits = {'user': per_user, 'ip': per_ip}
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @contextmanager
+    def hold(self, username=None, ip=None):
+        """Count a password check for `username` and `ip` while in the block.
+
+        Raises `TooManyAttempts` if either is already at its limit.
+        """
+
+        keys = [(kind, value)
+                for kind, value in (('user', username), ('ip', ip))
+                if value is not None and self.limits[kind]]
+
+        with self._lock:
+            if any(self._in_flight.get(key, 0) >= self.limits[key[0]]
+                   for key in keys):
+                raise TooManyAttempts()
+
+            for key in keys:
+                self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+        try:
+            yield
+
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._in_flight[key] -= 1
+                    if not self._in_flight[key]:
+                        del self._in_flight[key]
+
+
+hasher = PasswordHasher()
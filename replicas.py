@@ -0,0 +1,185 @@
+"""Read-replica routing for Chirper.
+
+With `REPLICA_URLS` set (comma-separated database URLs), SELECTs issued by
+views marked `@reads_from_replica` go to a replica instead of the primary.
+Everything else stays on the primary:
+
+- writes, flushes, and any statement that isn't a SELECT
+- non-GET requests
+- requests from a client that wrote something in the last
+  `REPLICA_STICKY_SECONDS`, so users see their own changes
+- replicas that are down or more than `REPLICA_MAX_LAG` seconds behind
+
+Replica lag is measured at most every `REPLICA_CHECK_INTERVAL` seconds per
+replica, by one request at a time; other requests use the last measurement
+meanwhile. Replicas are picked round-robin.
+"""
+
+import itertools
+import time
+from functools import wraps
+from threading import Lock
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+
+STICKY_KEY = 'replica_sticky_until'
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Seconds since the last replayed transaction, or 0 if the replica has
+# replayed everything it has received (or isn't a replica at all).
+PG_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+
+class Replica:
+    """A replica engine and its last measured lag."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lag = None
+        self.checked_at = None
+
+        self._probing = Lock()
+
+    def refresh(self, check_interval):
+        """Measure the lag again if the last measurement is older than
+        `check_interval` seconds.
+
+        Only one thread measures at a time; the others carry on with the
+        last result rather than wait for a slow or unreachable replica.
+        """
+
+        if (self.checked_at is not None
+                and time.monotonic() - self.checked_at <= check_interval):
+            return
+
+        if not self._probing.acquire(blocking=False):
+            return
+
+        try:
+            try:
+                self.lag = self.measure_lag()
+            except DBAPIError:
+                self.lag = None
+            self.checked_at = time.monotonic()
+        finally:
+            self._probing.release()
+
+    def measure_lag(self):
+        """Return this replica's replication lag in seconds."""
+
+        if self.engine.dialect.name != 'postgresql':
+            return 0
+
+        with self.engine.connect() as conn:
+            return float(conn.scalar(PG_LAG_SQL) or 0)
+
+
+class ReplicaRouter:
+    """Pick a replica for the current request, or None for the primary."""
+
+    def __init__(self):
+        self.replicas = []
+        self.max_lag = 5
+        self.sticky_seconds = 5
+        self.check_interval = 5
+
+        self._lock = Lock()
+        self._cycle = iter(())
+
+    def init_app(self, app):
+        """Configure from `app.config` and keep writers on the primary."""
+
+        self.configure(
+            app.config.get('REPLICA_URLS') or (),
+            max_lag=app.config.get('REPLICA_MAX_LAG', 5),
+            sticky_seconds=app.config.get('REPLICA_STICKY_SECONDS', 5),
+            check_interval=app.config.get('REPLICA_CHECK_INTERVAL', 5),
+            engine_options=app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+        )
+
+        @app.after_request
+        def stick_to_primary_after_write(response):
+            if self.replicas and request.method not in READ_METHODS:
+                session[STICKY_KEY] = time.time() + self.sticky_seconds
+            return response
+
+    def configure(self, urls, max_lag=5, sticky_seconds=5, check_interval=5,
+                  engine_options=None):
+        """Replace the replica engines with ones for `urls`."""
+
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+        self.replicas = [Replica(create_engine(url, **(engine_options or {})))
+                         for url in urls]
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.check_interval = check_interval
+        self._cycle = itertools.cycle(self.replicas)
+
+    def _is_fresh(self, replica):
+        replica.refresh(self.check_interval)
+
+        return replica.lag is not None and replica.lag <= self.max_lag
+
+    def choose(self):
+        """Return the engine to read from in this request, if not the primary."""
+
+        if not self.replicas or request.method not in READ_METHODS:
+            return None
+
+        if session.get(STICKY_KEY, 0) > time.time():
+            return None
+
+        # Only the round-robin position is shared; lag is measured outside
+        # the lock, so a slow replica doesn't hold up every request.
+        with self._lock:
+            candidates = [next(self._cycle) for _ in self.replicas]
+
+        for replica in candidates:
+            if self._is_fresh(replica):
+                return replica.engine
+
+        return None
+
+
+router = ReplicaRouter()
+
+
+def reads_from_replica(view):
+    """Send the SELECTs of view function `view` to a replica if possible."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.replica = router.choose()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.replica = None
+
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Session that sends SELECTs to the request's replica, if it has one."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None
+                and not self._flushing
+                and getattr(clause, 'is_select', False)
+                and has_request_context()
+                and g.get('replica') is not None):
+            return g.replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
@@ -0,0 +1,260 @@
+"""In-memory username search for Chirper.
+
+`/users?q=` used to run `username LIKE '%q%'`, a scan of the whole users
+table on every search. Instead, each process keeps an index of usernames:
+
+- a sorted list of usernames, for prefix matches by binary search
+- a trigram -> user ids map, for substring matches
+
+Results are ranked exact match first, then prefix matches, then other
+substring matches (shorter usernames first), and cut off at a limit.
+Queries shorter than a trigram are matched by scanning the usernames, and
+their other substring matches come in username order.
+
+The index is built from the database on first use and updated by the
+signup, profile edit and delete routes. Users who sign up or are renamed
+(per `User.renamed_at`) through another worker process are picked up every
+`refresh_interval` seconds. Until then, and for deletes in other processes,
+callers load the matching rows from the database and drop any that no
+longer match.
+"""
+
+import bisect
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from threading import RLock
+
+from sqlalchemy import or_, select
+
+from models import db, User
+
+
+# Renames are re-read from this long before the previous refresh, to allow
+# for clock differences between servers and transactions still committing.
+RENAME_SLACK = timedelta(seconds=60)
+
+
+def trigrams(text):
+    """Return set of 3-character substrings of `text`."""
+
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class UsernameIndex:
+    """Prefix and trigram index of usernames, kept in memory."""
+
+    def __init__(self, refresh_interval=30):
+        self.refresh_interval = refresh_interval
+
+        self._lock = RLock()
+        self._refresh_lock = RLock()
+        self._loading = False
+        self._loaded = False
+        self._refreshed_at = 0
+        self._max_id = 0
+        self._renamed_since = None
+
+        self._usernames = {}                # user id -> lowercased username
+        self._sorted = []                   # sorted (username, user id)
+        self._trigrams = defaultdict(set)   # trigram -> user ids
+
+    def build(self):
+        """(Re)build the index from the users table."""
+
+        started = datetime.utcnow()
+        rows = self._fetch(0)
+
+        with self._lock:
+            self._usernames.clear()
+            self._sorted.clear()
+            self._trigrams.clear()
+            self._max_id = 0
+            self._merge(rows, started)
+            self._loaded = True
+
+    def _fetch(self, after_id, renamed_since=None):
+        """(id, username) rows of users with an id above `after_id`, or
+        renamed since `renamed_since`."""
+
+        changed = User.id > after_id
+
+        if renamed_since is not None:
+            changed = or_(changed, User.renamed_at >= renamed_since)
+
+        return db.session.execute(
+            select(User.id, User.username)
+            .where(changed)
+            .order_by(User.id)).all()
+
+    def _merge(self, rows, started):
+        """Index the users in `rows`, fetched at `started`, under the lock."""
+
+        # Sorted once at the end rather than inserted one by one, which is
+        # quadratic in the number of users. On a refresh only the new tail
+        # (and any renamed users) are out of order, which sort() merges in
+        # about linear time.
+        entries = []
+
+        for row_id, username in rows:
+            known = self._usernames.get(row_id)
+
+            # Users added or renamed through this process are up to date.
+            if known != username.lower():
+                if known is not None:
+                    self._remove(row_id)
+                entries.append(self._index(row_id, username))
+
+            self._max_id = max(self._max_id, row_id)
+
+        if entries:
+            self._sorted.extend(entries)
+            self._sorted.sort()
+
+        self._renamed_since = started - RENAME_SLACK
+        self._refreshed_at = time.monotonic()
+
+    def _refresh(self):
+        started = datetime.utcnow()
+        rows = self._fetch(self._max_id, self._renamed_since)
+
+        with self._lock:
+            self._merge(rows, started)
+
+    def _is_stale(self):
+        return (not self._loaded
+                or time.monotonic() - self._refreshed_at > self.refresh_interval)
+
+    def _ensure_current(self):
+        if not self._is_stale():
+            return
+
+        # Rows are fetched without holding `_lock`, so searches go on while
+        # one request loads them; only the first build is waited for. Async
+        # requests (see asgi.py) share a thread, so they can re-enter while
+        # another one is waiting on its query; they search what is loaded.
+        if not self._refresh_lock.acquire(blocking=not self._loaded):
+            return
+
+        try:
+            if self._loading or not self._is_stale():
+                return
+
+            self._loading = True
+            try:
+                if not self._loaded:
+                    self.build()
+                else:
+                    self._refresh()
+            finally:
+                self._loading = False
+        finally:
+            self._refresh_lock.release()
+
+    def _index(self, user_id, username):
+        """Index `username` by id and trigrams; return its entry for the
+        sorted list, which the caller adds."""
+
+        name = username.lower()
+
+        self._usernames[user_id] = name
+
+        for gram in trigrams(name):
+            self._trigrams[gram].add(user_id)
+
+        return (name, user_id)
+
+    def _add(self, user_id, username):
+        bisect.insort(self._sorted, self._index(user_id, username))
+
+    def _remove(self, user_id):
+        name = self._usernames.pop(user_id, None)
+
+        if name is None:
+            return
+
+        pos = bisect.bisect_left(self._sorted, (name, user_id))
+        if pos < len(self._sorted) and self._sorted[pos] == (name, user_id):
+            del self._sorted[pos]
+
+        for gram in trigrams(name):
+            ids = self._trigrams.get(gram)
+            if ids is not None:
+                ids.discard(user_id)
+                if not ids:
+                    del self._trigrams[gram]
+
+    def add(self, user_id, username):
+        """Index a new user, or re-index a renamed one."""
+
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(user_id)
+            self._add(user_id, username)
+
+    def remove(self, user_id):
+        """Drop a deleted user from the index."""
+
+        with self._lock:
+            if self._loaded:
+                self._remove(user_id)
+
+    def search(self, query, limit=20):
+        """Return ids of up to `limit` users whose username contains `query`.
+
+        Ranked exact match, then prefix matches, then other matches with
+        shorter usernames first (in username order, for queries shorter than
+        three characters).
+        """
+
+        query = query.strip().lower()
+
+        if not query or limit <= 0:
+            return []
+
+        self._ensure_current()
+
+        with self._lock:
+            # Prefix matches, in username order (an exact match sorts first).
+            results = []
+            pos = bisect.bisect_left(self._sorted, (query,))
+
+            while (len(results) < limit
+                   and pos < len(self._sorted)
+                   and self._sorted[pos][0].startswith(query)):
+                results.append(self._sorted[pos][1])
+                pos += 1
+
+            if len(results) == limit:
+                return results
+
+            # Too short for trigrams: scan for other substring matches, in
+            # username order, until there are enough. (Short queries match
+            # most names, so the scan rarely goes far.)
+            if len(query) < 3:
+                results.extend(itertools.islice(
+                    (user_id for name, user_id in self._sorted
+                     if query in name and not name.startswith(query)),
+                    limit - len(results)))
+                return results
+
+            # Other substring matches: users sharing every trigram of the
+            # query, checked against the full username.
+            postings = sorted((self._trigrams.get(gram, set())
+                               for gram in trigrams(query)), key=len)
+            candidates = set.intersection(*postings) if postings else set()
+
+            found = set(results)
+            matches = [
+                (len(self._usernames[user_id]), self._usernames[user_id], user_id)
+                for user_id in candidates
+                if user_id not in found and query in self._usernames[user_id]
+            ]
+
+        best = heapq.nsmallest(limit - len(results), matches)
+        results.extend(user_id for _, _, user_id in best)
+
+        return results
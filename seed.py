@@ -1,19 +1,200 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+Run it like:
+
+    python seed.py [--data-dir generator] [--chunk-size 50000] [--no-copy]
+
+Loads `users*.csv`, `messages*.csv`, `follows*.csv` and `liked_warbles*.csv`
+from the data directory (a single file per table, or the partitioned files
+written by `generator/create_csvs.py`). Rows are streamed in chunks, so memory
+use doesn't grow with the dataset:
+
+- on PostgreSQL, each chunk is sent with `COPY ... FROM STDIN`
+- elsewhere (e.g. SQLite), each chunk is inserted with one executemany
+
+Secondary indexes and foreign keys are created after the load, id sequences
+are moved past the loaded ids, and counters and home timelines are rebuilt.
+"""
+
+import argparse
+import csv
+import io
+import time
+from datetime import datetime
+from glob import glob
+from itertools import islice
+from pathlib import Path
+
+from sqlalchemy import DateTime, Integer, inspect, text
+from sqlalchemy.schema import AddConstraint
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+import migrations
+import timeline
+from models import User, Message, Follows, LikedWarble
+
+# Loaded in this order, so foreign keys are satisfied.
+TABLES = (
+    ('users', User),
+    ('messages', Message),
+    ('follows', Follows),
+    ('liked_warbles', LikedWarble),
+)
+
+DEFAULT_CHUNK_SIZE = 50000
+
+
+def read_chunks(path, chunk_size):
+    """Yield (header, rows) from CSV file `path`, `chunk_size` rows at a time."""
+
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield header, rows
+
+
+def copy_chunk(conn, table, header, rows):
+    """Load `rows` into `table` with PostgreSQL COPY FROM STDIN."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    columns = ", ".join(header)
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)",
+            buffer)
+
+
+def insert_chunk(conn, table, header, rows):
+    """Load `rows` into `table` with a single executemany."""
+
+    def convert(column, value):
+        if value == '':
+            return None
+        if isinstance(column.type, DateTime):
+            return datetime.fromisoformat(value)
+        if isinstance(column.type, Integer):
+            return int(value)
+        return value
+
+    columns = [table.c[name] for name in header]
+    conn.execute(table.insert(), [
+        {column.name: convert(column, value)
+         for column, value in zip(columns, row)}
+        for row in rows
+    ])
+
+
+def load_table(conn, name, model, data_dir, chunk_size, use_copy):
+    """Stream every CSV file for table `name` into the database."""
+
+    table = model.__table__
+    paths = sorted(glob(str(Path(data_dir) / f"{name}*.csv")))
+    load_chunk = copy_chunk if use_copy else insert_chunk
+
+    loaded = 0
+    start = time.perf_counter()
+
+    for path in paths:
+        for header, rows in read_chunks(path, chunk_size):
+            load_chunk(conn, table, header, rows)
+            loaded += len(rows)
+
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {loaded:,} rows "
+                  f"({loaded / elapsed:,.0f} rows/s)", flush=True)
+
+    return loaded
+
+
+def drop_deferred(conn, tables):
+    """Drop secondary indexes and foreign keys of `tables` before loading."""
+
+    for table in tables:
+        for index in table.indexes:
+            index.drop(bind=conn)
+
+        # SQLite can't drop constraints (and doesn't enforce them by default).
+        if conn.dialect.name == 'postgresql':
+            for fk in inspect(conn).get_foreign_keys(table.name):
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} DROP CONSTRAINT "{fk["name"]}"'))
+
+
+def restore_deferred(conn, tables):
+    """Recreate the indexes and foreign keys dropped by `drop_deferred`."""
+
+    for table in tables:
+        if conn.dialect.name == 'postgresql':
+            for constraint in table.foreign_key_constraints:
+                conn.execute(AddConstraint(constraint))
+
+        for index in table.indexes:
+            index.create(bind=conn)
+
+
+def reset_sequences(conn, tables):
+    """Move PostgreSQL id sequences past ids that were loaded explicitly."""
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    for table in tables:
+        if 'id' in table.c:
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"))
+
+
+def seed(data_dir='generator', chunk_size=DEFAULT_CHUNK_SIZE, use_copy=True):
+    """Recreate the schema and load the CSV files in `data_dir`."""
+
+    db.drop_all()
+    db.create_all()
+
+    tables = [model.__table__ for _, model in TABLES]
+    started = time.perf_counter()
+
+    with db.engine.begin() as conn:
+        use_copy = use_copy and conn.dialect.name == 'postgresql'
+
+        drop_deferred(conn, tables)
+
+        for name, model in TABLES:
+            load_table(conn, name, model, data_dir, chunk_size, use_copy)
+
+        print("Creating indexes and foreign keys...", flush=True)
+        restore_deferred(conn, tables)
+        reset_sequences(conn, tables)
+
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text("ANALYZE"))
+
+    print("Rebuilding counters and home timelines...", flush=True)
+    User.reconcile_counts()
+    timeline.rebuild_all()
+    db.session.commit()
 
-db.drop_all()
-db.create_all()
+    migrations.stamp()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    print(f"Done in {time.perf_counter() - started:,.1f}s")
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data-dir', default='generator',
+                        help="directory holding the CSV files")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="rows sent to the database at a time")
+    parser.add_argument('--no-copy', dest='use_copy', action='store_false',
+                        help="use executemany even on PostgreSQL")
+    args = parser.parse_args()
 
-db.session.commit()
+    seed(args.data_dir, args.chunk_size, args.use_copy)
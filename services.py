@@ -0,0 +1,203 @@
+"""Writes shared by the HTML routes and the JSON API.
+
+Each function makes one change along with everything that has to follow it
+(counters, stored timelines, the user cache, recent messages), and commits.
+Checking who may make the change is left to the caller. Slow follow-up
+work is queued as jobs (see jobs.py); the tasks are at the end.
+
+The batch functions take a list of target ids, apply the whole list with
+one set-based statement, and return a status for each id.
+"""
+
+from sqlalchemy import delete, literal, select
+
+from activity import RecentMessage, recent_activity
+from jobs import enqueue, task
+from live import message_event, timeline_hub
+from models import db, insert_new, Follows, LikedWarble, Message, User
+from notifications import notification_buffer
+import timeline
+from user_cache import user_cache
+
+
+def post_message(author, text):
+    """Post a new message by user `author` and return it."""
+
+    msg = Message(text=text, user_id=author.id)
+    db.session.add(msg)
+    db.session.flush()
+    User.adjust_counts(author.id, messages_count=1)
+    enqueue(fan_out_message, message_id=msg.id, key=f"fan-out:{msg.id}")
+    recent = RecentMessage(msg, author)
+    event = message_event(msg, author)
+    db.session.commit()
+    user_cache.invalidate(author.id)
+    recent_activity.add(recent)
+    timeline_hub.publish(event)
+
+    return msg
+
+
+def delete_message(msg):
+    """Delete message `msg`."""
+
+    msg_id, author_id = msg.id, msg.user_id
+
+    timeline.remove_message(msg_id)
+    db.session.delete(msg)
+    User.adjust_counts(author_id, messages_count=-1)
+    db.session.commit()
+    user_cache.invalidate(author_id)
+    recent_activity.remove(msg_id)
+
+
+def follow_users(user_id, target_ids):
+    """Have `user_id` follow every user in `target_ids`.
+
+    Returns `{id: status}`, where status is "followed", "already_following",
+    "not_found" or "self".
+    """
+
+    found = set(db.session.scalars(
+        select(User.id).where(User.id.in_(target_ids))))
+    valid = found - {user_id}
+
+    followed = set(db.session.scalars(
+        insert_new(Follows)
+        .from_select(['user_following_id', 'user_being_followed_id'],
+                     select(literal(user_id), User.id)
+                     .where(User.id.in_(valid)))
+        .returning(Follows.user_being_followed_id)))
+
+    if followed:
+        User.adjust_counts(user_id, following_count=len(followed))
+        User.adjust_counts(list(followed), followers_count=1)
+        enqueue(backfill_timeline,
+                follower_id=user_id, followed_ids=sorted(followed))
+
+    db.session.commit()
+    user_cache.invalidate(user_id, *followed)
+
+    for target_id in followed:
+        notification_buffer.add(target_id, 'follow', user_id)
+
+    return {target_id: ('followed' if target_id in followed
+                        else 'self' if target_id == user_id
+                        else 'already_following' if target_id in found
+                        else 'not_found')
+            for target_id in target_ids}
+
+
+def unfollow_users(user_id, target_ids):
+    """Have `user_id` stop following every user in `target_ids`.
+
+    Returns `{id: status}`, where status is "unfollowed" or "not_following".
+    """
+
+    unfollowed = set(db.session.scalars(
+        delete(Follows)
+        .where(Follows.user_following_id == user_id)
+        .where(Follows.user_being_followed_id.in_(target_ids))
+        .returning(Follows.user_being_followed_id)))
+
+    if unfollowed:
+        User.adjust_counts(user_id, following_count=-len(unfollowed))
+        User.adjust_counts(list(unfollowed), followers_count=-1)
+        timeline.remove_follow(user_id, list(unfollowed))
+
+    db.session.commit()
+    user_cache.invalidate(user_id, *unfollowed)
+
+    return {target_id: ('unfollowed' if target_id in unfollowed
+                        else 'not_following')
+            for target_id in target_ids}
+
+
+def like_messages(user_id, message_ids):
+    """Have `user_id` like every message in `message_ids`.
+
+    Returns `{id: status}`, where status is "liked", "already_liked",
+    "not_found" or "own_message".
+    """
+
+    authors = {msg_id: author for msg_id, author in db.session.execute(
+        select(Message.id, Message.user_id).where(Message.id.in_(message_ids)))}
+    valid = [msg_id for msg_id, author in authors.items() if author != user_id]
+
+    liked = set(db.session.scalars(
+        insert_new(LikedWarble)
+        .from_select(['user_id', 'message_id'],
+                     select(literal(user_id), Message.id)
+                     .where(Message.id.in_(valid)))
+        .returning(LikedWarble.message_id)))
+
+    if liked:
+        User.adjust_counts(user_id, liked_messages_count=len(liked))
+
+    db.session.commit()
+    user_cache.invalidate(user_id)
+
+    for msg_id in liked:
+        notification_buffer.add(authors[msg_id], 'like', user_id, msg_id)
+
+    return {msg_id: ('liked' if msg_id in liked
+                     else 'not_found' if msg_id not in authors
+                     else 'own_message' if authors[msg_id] == user_id
+                     else 'already_liked')
+            for msg_id in message_ids}
+
+
+def unlike_messages(user_id, message_ids):
+    """Remove `user_id`'s likes of every message in `message_ids`.
+
+    Returns `{id: status}`, where status is "unliked" or "not_liked".
+    """
+
+    unliked = set(db.session.scalars(
+        delete(LikedWarble)
+        .where(LikedWarble.user_id == user_id)
+        .where(LikedWarble.message_id.in_(message_ids))
+        .returning(LikedWarble.message_id)))
+
+    if unliked:
+        User.adjust_counts(user_id, liked_messages_count=-len(unliked))
+
+    db.session.commit()
+    user_cache.invalidate(user_id)
+
+    return {msg_id: 'unliked' if msg_id in unliked else 'not_liked'
+            for msg_id in message_ids}
+
+
+##############################################################################
+# Tasks
+
+
+@task
+def fan_out_message(message_id):
+    """Deliver a new message into its followers' timelines."""
+
+    msg = db.session.get(Message, message_id)
+
+    # Deleted before the job ran.
+    if msg is not None:
+        timeline.fan_out_message(msg)
+
+
+@task
+def backfill_timeline(follower_id, followed_ids):
+    """Fill `follower_id`'s timeline with messages of newly-followed users.
+
+    Users no longer followed by the time the job runs are skipped, and
+    messages already in the timeline are replaced or skipped, so it can run
+    twice or race the fan-out of a new message.
+    """
+
+    still_followed = list(db.session.scalars(
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == follower_id)
+        .where(Follows.user_being_followed_id.in_(followed_ids))))
+
+    if still_followed:
+        timeline.remove_follow(follower_id, still_followed)
+        timeline.backfill(follower_id, still_followed)
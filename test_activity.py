@@ -0,0 +1,96 @@
+"""Recent and trending messages tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_activity.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, LikedWarble
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from activity import recent_activity
+import services
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class RecentActivityTestCase(TestCase):
+    def setUp(self):
+        LikedWarble.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        users = [User.signup(f"u{i}", f"u{i}@email.com", "password", None)
+                 for i in range(4)]
+        db.session.flush()
+
+        self.msgs = [Message(text=f"msg-{i}", user_id=users[0].id)
+                     for i in range(3)]
+        db.session.add_all(self.msgs)
+        db.session.flush()
+
+        # msg-1 gets three recent likes, msg-2 one, and msg-0 two old ones.
+        now = datetime.utcnow()
+        for msg, likers, age in ((self.msgs[1], users[1:], 60),
+                                 (self.msgs[2], users[1:2], 60),
+                                 (self.msgs[0], users[1:3], 86400)):
+            db.session.add_all(
+                LikedWarble(user_id=liker.id,
+                            message_id=msg.id,
+                            created_at=now - timedelta(seconds=age))
+                for liker in likers)
+
+        db.session.commit()
+
+        self.user_ids = [user.id for user in users]
+        recent_activity.refresh()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_trending_ranks_recent_likes(self):
+        self.assertEqual([msg.text for msg in recent_activity.trending()],
+                         ["msg-1", "msg-2"])
+
+    def test_posts_and_deletes_apply_without_a_refresh(self):
+        author = db.session.get(User, self.user_ids[1])
+        msg = services.post_message(author, "fresh")
+
+        self.assertEqual(recent_activity.recent()[0].text, "fresh")
+
+        services.delete_message(msg)
+        self.assertNotIn("fresh",
+                         [recent.text for recent in recent_activity.recent()])
+
+    def test_sidebar_costs_no_queries(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_ids[1]
+
+            client.get("/")     # warm the user cache
+            app.config['MAX_QUERIES_PER_REQUEST'] = 3
+            try:
+                resp = client.get("/")
+            finally:
+                app.config['MAX_QUERIES_PER_REQUEST'] = None
+
+        html = resp.get_data(as_text=True)
+        self.assertIn("Trending", html)
+        self.assertIn("msg-2", html)
@@ -0,0 +1,193 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, LikedWarble
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class ApiBaseTestCase(TestCase):
+    def setUp(self):
+        LikedWarble.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        start = datetime(2023, 1, 1)
+        db.session.add_all([
+            Message(text=f"msg-{i}",
+                    user_id=u2.id,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(5)
+        ])
+        db.session.add(Follows(user_following_id=u1.id,
+                               user_being_followed_id=u2.id))
+        db.session.flush()
+        timeline.rebuild_all()
+        User.reconcile_counts()
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+
+class ApiTestCase(ApiBaseTestCase):
+    def test_requires_login(self):
+        resp = app.test_client().get("/api/v1/timeline")
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn('error', resp.json)
+
+    def test_timeline_pages_with_sparse_fields(self):
+        resp = self.client.get("/api/v1/timeline?limit=3&fields=text,username")
+        data = resp.json
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(data['messages'][0], {'text': 'msg-4', 'username': 'u2'})
+        self.assertEqual(len(data['messages']), 3)
+
+        rest = self.client.get("/api/v1/timeline",
+                               query_string={'fields': 'text',
+                                             'after': data['next_cursor']}).json
+
+        self.assertEqual([m['text'] for m in rest['messages']], ['msg-1', 'msg-0'])
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_unknown_field(self):
+        resp = self.client.get(f"/api/v1/users/{self.u2_id}?fields=email")
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_user_and_followers(self):
+        user = self.client.get(f"/api/v1/users/{self.u2_id}").json['user']
+        self.assertEqual(user['username'], 'u2')
+        self.assertEqual(user['messages_count'], 5)
+        self.assertNotIn('email', user)
+
+        followers = self.client.get(
+            f"/api/v1/users/{self.u2_id}/followers?fields=id").json
+        self.assertEqual(followers['users'], [{'id': self.u1_id}])
+
+        self.assertEqual(
+            self.client.get("/api/v1/users/0/followers").status_code, 404)
+
+    def test_create_and_delete_message(self):
+        resp = self.client.post("/api/v1/messages", json={'text': 'hi'})
+        self.assertEqual(resp.status_code, 201)
+        msg_id = resp.json['message']['id']
+
+        self.assertEqual(db.session.get(User, self.u1_id).messages_count, 1)
+        self.assertEqual(
+            self.client.post("/api/v1/messages", json={'text': ''}).status_code,
+            400)
+        self.assertEqual(
+            self.client.post("/api/v1/messages", data={'text': 'hi'}).status_code,
+            415)
+
+        other = Message.query.filter_by(user_id=self.u2_id).first()
+        self.assertEqual(
+            self.client.delete(f"/api/v1/messages/{other.id}").status_code, 403)
+
+        self.assertEqual(
+            self.client.delete(f"/api/v1/messages/{msg_id}").status_code, 204)
+        self.assertIsNone(db.session.get(Message, msg_id))
+
+    def test_users_by_ids(self):
+        resp = self.client.get("/api/v1/users",
+                               query_string={'ids': f"{self.u2_id},0,{self.u1_id}",
+                                             'fields': 'username'})
+
+        self.assertEqual(resp.json['users'],
+                         [{'username': 'u2'}, {'username': 'u1'}])
+        self.assertEqual(
+            self.client.get("/api/v1/users?ids=a").status_code, 400)
+
+
+class BatchApiTestCase(ApiBaseTestCase):
+    def test_follow_and_unfollow_many(self):
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.commit()
+        u3_id = u3.id
+
+        resp = self.client.post("/api/v1/follows", json={
+            'ids': [self.u2_id, u3_id, self.u1_id, 0, u3_id]})
+
+        self.assertEqual(resp.json['results'], [
+            {'id': self.u2_id, 'status': 'already_following'},
+            {'id': u3_id, 'status': 'followed'},
+            {'id': self.u1_id, 'status': 'self'},
+            {'id': 0, 'status': 'not_found'},
+        ])
+        self.assertEqual(db.session.get(User, self.u1_id).following_count, 2)
+        self.assertEqual(db.session.get(User, u3_id).followers_count, 1)
+
+        resp = self.client.delete("/api/v1/follows",
+                                  json={'ids': [self.u2_id, u3_id]})
+
+        self.assertEqual({r['status'] for r in resp.json['results']},
+                         {'unfollowed'})
+        self.assertEqual(db.session.get(User, self.u1_id).following_count, 0)
+        self.assertEqual(
+            self.client.get("/api/v1/timeline").json['messages'], [])
+
+    def test_like_and_unlike_many(self):
+        ids = [msg.id for msg in Message.query.order_by(Message.id)][:2]
+        own = self.client.post("/api/v1/messages", json={'text': 'mine'})
+        own_id = own.json['message']['id']
+
+        self.client.post("/api/v1/likes", json={'ids': ids[:1]})
+        resp = self.client.post("/api/v1/likes", json={'ids': [*ids, own_id]})
+
+        self.assertEqual([r['status'] for r in resp.json['results']],
+                         ['already_liked', 'liked', 'own_message'])
+        self.assertEqual(
+            db.session.get(User, self.u1_id).liked_messages_count, 2)
+
+        resp = self.client.delete("/api/v1/likes", json={'ids': [ids[0], own_id]})
+
+        self.assertEqual([r['status'] for r in resp.json['results']],
+                         ['unliked', 'not_liked'])
+        self.assertEqual(
+            db.session.get(User, self.u1_id).liked_messages_count, 1)
+
+    def test_rejects_bad_batches(self):
+        self.assertEqual(
+            self.client.post("/api/v1/follows", json=[1, 2]).status_code, 400)
+        self.assertEqual(
+            self.client.post("/api/v1/likes",
+                             json={'ids': list(range(2000))}).status_code, 400)
@@ -0,0 +1,227 @@
+"""ASGI serving tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_asgi.py
+
+
+import asyncio
+import json
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from asgi import AsyncApp
+from live import timeline_hub
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+async def request(asgi_app, method, path, cookie=None, body=b'', headers=()):
+    """Send one request to `asgi_app`; return (status, headers, body)."""
+
+    path, _, query = path.partition('?')
+    headers = [(b'host', b'localhost'), *headers]
+    if cookie:
+        headers.append((b'cookie', cookie.encode()))
+    if body:
+        headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': path, 'root_path': '',
+             'query_string': query.encode(), 'headers': headers,
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 5000)}
+
+    received = []
+    messages = [{'type': 'http.request', 'body': body}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        received.append(message)
+
+    await asyncio.wait_for(asgi_app(scope, receive, send), 10)
+
+    start = received[0]
+    return (start['status'],
+            dict(start['headers']),
+            b''.join(message.get('body', b'') for message in received[1:]))
+
+
+class AsyncAppTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        users = [User.signup(f"user{i}", f"user{i}@email.com", "password", None)
+                 for i in range(3)]
+        db.session.flush()
+        db.session.add_all(Message(text=f"hello from {user.username}",
+                                   user_id=user.id)
+                           for user in users)
+        db.session.add(Follows(user_following_id=users[0].id,
+                               user_being_followed_id=users[1].id))
+        db.session.flush()
+        timeline.rebuild_all()
+        User.reconcile_counts()
+        db.session.commit()
+
+        self.user_ids = [user.id for user in users]
+
+        serializer = app.session_interface.get_signing_serializer(app)
+        self.cookies = [f"session={serializer.dumps({CURR_USER_KEY: user_id})}"
+                        for user_id in self.user_ids]
+
+    def tearDown(self):
+        db.session.rollback()
+        timeline_hub.init_app(app)
+
+    def run_requests(self, *requests):
+        """Run `(method, path, cookie)` requests concurrently on a fresh
+        AsyncApp (and event loop)."""
+
+        async def main():
+            asgi_app = AsyncApp(app)
+            try:
+                return await asyncio.gather(*(request(asgi_app, *args)
+                                              for args in requests))
+            finally:
+                await asgi_app.engine.dispose()
+                asgi_app.executor.shutdown()
+
+        return asyncio.run(main())
+
+    def test_read_routes_are_async(self):
+        asgi_app = AsyncApp(app)
+
+        def serves_async(method, path):
+            return asgi_app.serves_async({'REQUEST_METHOD': method,
+                                          'PATH_INFO': path,
+                                          'SERVER_NAME': 'localhost',
+                                          'SERVER_PORT': '80',
+                                          'wsgi.url_scheme': 'http'})
+
+        self.assertTrue(serves_async('GET', '/'))
+        self.assertTrue(serves_async('GET', '/users/1/followers'))
+        self.assertFalse(serves_async('GET', '/messages/new'))
+        self.assertFalse(serves_async('POST', '/users/follow/1'))
+        self.assertFalse(serves_async('GET', '/no/such/page'))
+
+        asgi_app.executor.shutdown()
+
+    def test_concurrent_pages_see_their_own_user(self):
+        u0, u1, u2 = self.user_ids
+        c0, c1, c2 = self.cookies
+
+        results = self.run_requests(
+            *[('GET', '/', cookie) for cookie in self.cookies * 3],
+            ('GET', f'/users/{u1}', c0),
+            ('GET', f'/users/{u0}/following', c2),
+            ('GET', '/users?q=user2', c1))
+
+        for (status, _, body), cookie in zip(results, self.cookies * 3):
+            self.assertEqual(status, 200)
+            user_id = self.user_ids[self.cookies.index(cookie)]
+            self.assertIn(f'href="/users/{user_id}"', body.decode())
+
+        home = results[0][2].decode().split('id="timeline"')[1]
+        self.assertIn("hello from user1", home)
+        self.assertNotIn("hello from user2", home)
+
+        profile, following, search = (body.decode() for _, _, body in results[-3:])
+        self.assertIn("hello from user1", profile)
+        self.assertIn("@user1", following)
+        self.assertIn("@user2", search)
+
+    def test_other_routes_run_on_threads(self):
+        [(status, headers, body)] = self.run_requests(
+            ('POST', '/login', None, b'username=user0&password=password'))
+
+        self.assertEqual(status, 302)
+        self.assertIn(b'session=', headers[b'set-cookie'])
+
+    def test_streams_run_on_the_event_loop(self):
+        u0, u1, _ = self.user_ids
+        timeline_hub.heartbeat = 0.1
+        timeline_hub.max_age = 1
+        threads = app.config['ASGI_THREADS']
+        app.config['ASGI_THREADS'] = 1
+
+        async def main():
+            asgi_app = AsyncApp(app)
+            try:
+                streams = [asyncio.create_task(
+                               request(asgi_app, 'GET', '/stream/timeline',
+                                       self.cookies[0]))
+                           for _ in range(3)]
+                await asyncio.sleep(0.2)
+
+                # The open streams leave the one thread free.
+                page = await asyncio.wait_for(
+                    request(asgi_app, 'GET', '/login'), 0.5)
+
+                await asyncio.to_thread(timeline_hub.publish, {
+                    'id': 1000, 'text': "live", 'timestamp': "2024-01-01",
+                    'user': {'id': u1, 'username': "user1", 'image_url': ""}})
+
+                return page, await asyncio.gather(*streams)
+            finally:
+                await asgi_app.engine.dispose()
+                asgi_app.executor.shutdown()
+
+        try:
+            (page_status, _, _), streams = asyncio.run(main())
+        finally:
+            app.config['ASGI_THREADS'] = threads
+
+        self.assertEqual(page_status, 200)
+        for status, headers, body in streams:
+            self.assertEqual(status, 200)
+            self.assertEqual(headers[b'content-type'],
+                             b'text/event-stream; charset=utf-8')
+            self.assertTrue(body.startswith(b"retry: 3000\n\n"))
+            self.assertIn(b": keepalive\n\n", body)
+            self.assertIn(b'id: 1000\nevent: message\ndata: {"id":1000,'
+                          b'"text":"live"', body)
+
+        self.assertEqual(timeline_hub.stats()['streams'], 0)
+
+    def test_stream_replays_missed_messages(self):
+        timeline_hub.max_age = 0.2
+
+        [(status, _, body)] = self.run_requests(
+            ('GET', '/stream/timeline', self.cookies[0], b'',
+             [(b'last-event-id', b'0')]))
+
+        events = [json.loads(line.split(b"data: ", 1)[1])
+                  for line in body.split(b"\n") if line.startswith(b"data: ")]
+
+        self.assertEqual(status, 200)
+        self.assertEqual([event['text'] for event in events],
+                         ["hello from user0", "hello from user1"])
+
+    def test_stream_requires_login(self):
+        [(status, _, _)] = self.run_requests(
+            ('GET', '/stream/timeline', None))
+
+        self.assertEqual(status, 401)
+        self.assertEqual(timeline_hub.stats()['streams'], 0)
@@ -0,0 +1,167 @@
+"""Benchmark suite tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bench.py
+
+
+import asyncio
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+from bench import baseline, load, micro, scenarios
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+
+db.drop_all()
+db.create_all()
+
+
+def report(queries=1.0, ops=1000.0, p95_ms=1.0, rps=100.0, errors=0,
+           clients=10):
+    return {
+        'dataset': {'users': 1000},
+        'settings': {'clients': clients},
+        'micro': {'is_following': {'ops': ops, 'p95_ms': p95_ms,
+                                   'queries': queries}},
+        'scenarios': {
+            'total': {'requests': 1000, 'errors': errors, 'rps': rps,
+                      'p95_ms': 100.0, 'queries': 3.0},
+            'requests': {'GET /': {'requests': 1000, 'errors': errors,
+                                   'rps': rps, 'p95_ms': 100.0,
+                                   'queries': queries + 2}},
+        },
+    }
+
+
+class BaselineTestCase(TestCase):
+    def test_no_regressions(self):
+        self.assertEqual(baseline.compare(report(), report(ops=900.0)), [])
+
+    def test_more_queries(self):
+        regressions = baseline.compare(report(), report(queries=2.0))
+
+        self.assertEqual(regressions, ["is_following: queries 1.0 -> 2.0",
+                                       "GET /: queries 3.0 -> 4.0"])
+
+    def test_slower_beyond_tolerance(self):
+        regressions = baseline.compare(report(), report(ops=700.0, rps=50.0))
+
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("is_following: ops/s 1000.0 -> 700.0", regressions[0])
+        self.assertIn("load: req/s 100.0 -> 50.0", regressions[1])
+
+    def test_errors(self):
+        regressions = baseline.compare(report(), report(errors=100))
+
+        self.assertEqual(regressions, ["load: error rate 0.0% -> 9.1%"])
+
+    def test_load_at_other_settings_only_compares_queries(self):
+        regressions = baseline.compare(report(),
+                                       report(rps=10.0, clients=100))
+
+        self.assertEqual(regressions, [])
+
+    def test_other_dataset(self):
+        other = report()
+        other['dataset'] = {'users': 10000}
+
+        with self.assertRaises(ValueError):
+            baseline.compare(report(), other)
+
+
+class LoadTestCase(TestCase):
+    def test_summary(self):
+        stats = load.Stats()
+        for ms in range(1, 101):
+            stats.record("GET /", 200, ms / 1000, 3)
+        stats.record("GET /", 500, 1.0)
+        stats.record("POST /login", None, None)
+        stats.elapsed = 10
+
+        summary = stats.summary()
+
+        self.assertEqual(summary['requests']['GET /'], {
+            'requests': 100, 'errors': 1, 'rps': 10.0,
+            'p50_ms': 51.0, 'p95_ms': 95.0, 'p99_ms': 99.0, 'queries': 3.0})
+        self.assertEqual(summary['requests']['POST /login']['errors'], 1)
+        self.assertIsNone(summary['requests']['POST /login']['p50_ms'])
+        self.assertEqual(summary['total']['errors'], 2)
+
+    def test_read_chunked_response(self):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Transfer-Encoding: chunked\r\n"
+                b"Server-Timing: db;dur=1.5;desc=\"4 queries\"\r\n"
+                b"\r\n"
+                b"5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n")
+            return await load.read_response(reader)
+
+        status, headers, body = asyncio.run(read())
+        response = load.Response(status, headers, body)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(response.text, "hello world")
+        self.assertEqual(response.queries, 4)
+
+    def test_csrf_token(self):
+        response = load.Response(200, {}, b'<input id="csrf_token" '
+                                          b'name="csrf_token" type="hidden" '
+                                          b'value="abc.def">')
+
+        self.assertEqual(scenarios.csrf_token(response), "abc.def")
+        self.assertIsNone(scenarios.csrf_token(None))
+
+
+class MicroTestCase(TestCase):
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        db.session.add(Follows(user_being_followed_id=u2.id,
+                               user_following_id=u1.id))
+        db.session.commit()
+        User.reconcile_counts()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_subjects(self):
+        subjects = micro.pick_subjects()
+
+        self.assertEqual(subjects['username'], "u1")
+        self.assertEqual(db.session.get(User, subjects['followed_id']).username,
+                         "u2")
+        self.assertNotIn(subjects['other_id'],
+                         (subjects['user_id'], subjects['followed_id']))
+
+    def test_query_counts(self):
+        results = micro.run(['is_following', 'is_not_following',
+                             'timeline_query', 'authenticate'], seconds=0)
+
+        self.assertEqual(results['is_following']['queries'], 1)
+        self.assertEqual(results['is_not_following']['queries'], 1)
+        self.assertEqual(results['timeline_query']['queries'], 0)
+        self.assertEqual(results['authenticate']['queries'], 1)
+        self.assertEqual(results['authenticate']['runs'], micro.MIN_RUNS)
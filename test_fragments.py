@@ -0,0 +1,112 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+import sys
+from unittest import TestCase
+
+from models import db, User, Message, Follows, LikedWarble
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from fragments import MemoryBackend, fragment_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class MemoryBackendTestCase(TestCase):
+    def test_evicts_least_recently_used(self):
+        entry = sys.getsizeof('a') + sys.getsizeof('x' * 100)
+        backend = MemoryBackend(max_bytes=entry * 2)
+
+        backend.set('a', 'x' * 100)
+        backend.set('b', 'x' * 100)
+        backend.get('a')
+        backend.set('c', 'x' * 100)
+
+        self.assertEqual(backend.get('a'), 'x' * 100)
+        self.assertIsNone(backend.get('b'))
+        self.assertLessEqual(backend.size, backend.max_bytes)
+
+    def test_skips_entries_larger_than_the_cache(self):
+        backend = MemoryBackend(max_bytes=100)
+        backend.set('a', 'x' * 1000)
+
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.size, 0)
+
+
+class FragmentViewTestCase(TestCase):
+    def setUp(self):
+        LikedWarble.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        msg = Message(text="hello", user_id=u2.id)
+        db.session.add(msg)
+        db.session.flush()
+        db.session.add(LikedWarble(user_id=u1.id, message_id=msg.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.msg_id = msg.id
+
+        fragment_cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def get_as(self, user_id, path):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        resp = self.client.get(path)
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True)
+
+    def test_cached_cards_keep_per_viewer_buttons(self):
+        path = f"/users/{self.u2_id}"
+
+        liked = self.get_as(self.u1_id, path)
+        hits = fragment_cache.hits
+        own = self.get_as(self.u2_id, path)
+
+        self.assertGreater(fragment_cache.hits, hits)
+        self.assertIn("hello", own)
+        self.assertIn("bi-star-fill", liked)
+        # Authors can't like their own messages, so get no button.
+        self.assertNotIn("bi-star", own)
+        self.assertIn("Edit Profile", own)
+        self.assertNotIn("Edit Profile", liked)
+
+    def test_profile_edit_changes_the_key(self):
+        path = f"/users/{self.u2_id}"
+        self.get_as(self.u1_id, path)
+
+        u2 = db.session.get(User, self.u2_id)
+        u2.bio = "new bio"
+        u2.version = User.version + 1
+        db.session.commit()
+
+        self.assertIn("new bio", self.get_as(self.u1_id, path))
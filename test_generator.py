@@ -0,0 +1,48 @@
+"""CSV generator tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_generator.py
+
+
+import filecmp
+import os
+import sys
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+# create_csvs.py imports its helpers as a top-level module.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'generator'))
+
+from create_csvs import generate
+
+
+class GeneratorTestCase(TestCase):
+    def generate(self, out_dir, **options):
+        generate(users=50, messages=200, follows=300, seed=7, shards=2,
+                 processes=1, out_dir=out_dir, **options)
+        return sorted(os.listdir(out_dir))
+
+    def test_same_seed_same_files(self):
+        """Two runs with the same seed write byte-identical CSVs."""
+
+        with tempfile.TemporaryDirectory() as first, \
+                tempfile.TemporaryDirectory() as second:
+            names = self.generate(first)
+            self.assertEqual(self.generate(second), names)
+
+            _, mismatch, errors = filecmp.cmpfiles(first, second, names,
+                                                   shallow=False)
+            self.assertEqual((mismatch, errors), ([], []))
+
+    def test_now_sets_timestamp_range(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            self.generate(out_dir, now=datetime(2020, 6, 1))
+
+            with open(os.path.join(out_dir, 'messages-0000.csv')) as csv_file:
+                timestamps = [line.split(',')[-2]
+                              for line in list(csv_file)[1:]]
+
+        self.assertTrue(all("2018-06-01" <= ts < "2020-06-01"
+                            for ts in timestamps))
@@ -0,0 +1,159 @@
+"""HTTP cache policy and app factory tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+import os
+import re
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from flask.globals import app_ctx
+
+from app import app, create_app, CURR_USER_KEY
+from jobs import queue
+from notifications import notification_buffer
+from passwords import hasher
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class StaticCacheTestCase(TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def stylesheet_url(self):
+        html = self.client.get("/login").get_data(as_text=True)
+        return re.search(r'href="(/static/stylesheets/style\.[0-9a-f]{12}\.css)"',
+                         html).group(1)
+
+    def test_hashed_static_url_is_immutable(self):
+        resp = self.client.get(self.stylesheet_url())
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'],
+                         "public, max-age=31536000, immutable")
+
+    def test_stale_or_plain_static_url(self):
+        self.assertEqual(
+            self.client.get("/static/stylesheets/style.000000000000.css")
+            .status_code, 404)
+
+        resp = self.client.get("/static/images/nav-bg.png")
+        self.assertEqual(resp.headers['Cache-Control'],
+                         f"public, max-age={app.config['STATIC_MAX_AGE']}")
+
+    def test_pages_are_private_and_revalidated(self):
+        resp = self.client.get("/")
+
+        self.assertEqual(resp.headers['Cache-Control'], "private, no-cache")
+
+        again = self.client.get("/", headers={"If-None-Match": resp.headers['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        msg = Message(text="hello", user_id=u2.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.msg_id = msg.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def revalidate(self, client, path):
+        """GET `path`, then GET it again with the ETag it returned."""
+
+        first = client.get(path)
+        self.assertEqual(first.status_code, 200)
+
+        return client.get(path, headers={"If-None-Match": first.headers['ETag']})
+
+    def test_unchanged_pages_are_not_modified(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            for path in (f"/users/{self.u2_id}",
+                         f"/users/{self.u2_id}/following",
+                         f"/users/{self.u2_id}/followers",
+                         f"/messages/{self.msg_id}"):
+                resp = self.revalidate(c, path)
+
+                self.assertEqual(resp.status_code, 304, path)
+                self.assertEqual(resp.get_data(), b"")
+
+    def test_writes_change_the_etag(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            path = f"/users/{self.u2_id}"
+            etag = c.get(path).headers['ETag']
+
+            # Following u2 changes both users' versions.
+            c.post(f"/users/follow/{self.u2_id}")
+            resp = c.get(path, headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Unfollow", resp.get_data(as_text=True))
+
+    def test_new_notifications_change_the_etag(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            path = f"/users/{self.u2_id}"
+            etag = c.get(path).headers['ETag']
+
+            notification_buffer.add(self.u1_id, 'follow', self.u2_id)
+            notification_buffer.flush()
+            resp = c.get(path, headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertRegex(resp.get_data(as_text=True),
+                             r'id="unread-notifications"[^>]*>\s*1\s*<')
+
+
+class CreateAppTestCase(TestCase):
+    def test_production_profile_has_no_toolbar(self):
+        prod = create_app('production')
+
+        # connect_db pushed an app context for `prod`; go back to `app`, and
+        # to its settings for the per-process job queue and password hasher.
+        app_ctx._get_current_object().pop()
+        queue.init_app(app)
+        hasher.init_app(app)
+
+        self.assertFalse(prod.debug)
+        self.assertNotIn('debugtoolbar', prod.extensions)
+        self.assertEqual(prod.config['REQUEST_STATS'], 'log')
+        self.assertEqual(prod.config['PASSWORD_HASH_WORKERS'], 2)
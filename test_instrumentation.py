@@ -0,0 +1,114 @@
+"""Request instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+
+import json
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from instrumentation import TimedQueuePool, pool_options
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class RequestStatsTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['REQUEST_STATS'] = None
+
+    def get_profile(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            return c.get(f"/users/{self.u1_id}")
+
+    def test_server_timing_header(self):
+        app.config['REQUEST_STATS'] = 'header'
+
+        resp = self.get_profile()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertRegex(resp.headers['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="[1-9]\d* queries", '
+                         r'db-slowest;dur=[\d.]+, db-pool-wait;dur=[\d.]+$')
+
+    def test_log_line(self):
+        app.config['REQUEST_STATS'] = 'log'
+
+        with self.assertLogs('chirper.requests') as logs:
+            resp = self.get_profile()
+
+        line = json.loads(logs.records[-1].getMessage())
+
+        self.assertNotIn('Server-Timing', resp.headers)
+        self.assertEqual(line['path'], f"/users/{self.u1_id}")
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['queries'], 0)
+        self.assertIn('SELECT', line['slowest_sql'])
+
+
+    def test_password_hashing(self):
+        app.config['REQUEST_STATS'] = 'log'
+
+        with self.assertLogs('chirper.requests') as logs:
+            resp = self.client.post("/login", data={"username": "u1",
+                                                    "password": "password"})
+
+        line = json.loads(logs.records[-1].getMessage())
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertGreater(line['hash_ms'], 0)
+        self.assertEqual(line['hashing']['rejected'], 0)
+        self.assertIn('queued', line['hashing'])
+
+        app.config['REQUEST_STATS'] = 'header'
+        resp = self.client.post("/login", data={"username": "u1",
+                                                "password": "password"})
+
+        self.assertRegex(resp.headers['Server-Timing'],
+                         r', password-hash;dur=[\d.]+$')
+
+
+class PoolOptionsTestCase(TestCase):
+    def test_from_environment(self):
+        with patch.dict(os.environ, {'DB_POOL_SIZE': '20',
+                                     'DB_POOL_PRE_PING': 'false'}):
+            options = pool_options("postgresql:///chirper")
+
+        self.assertIs(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 20)
+        self.assertFalse(options['pool_pre_ping'])
+
+    def test_sqlite_keeps_its_pool(self):
+        self.assertNotIn('poolclass', pool_options("sqlite:///chirper.db"))
@@ -0,0 +1,120 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry, Job
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+from jobs import Worker, enqueue, queue, task
+import services
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+calls = []
+
+
+@task
+def flaky(n):
+    calls.append(n)
+    raise RuntimeError("try again")
+
+
+class JobQueueTestCase(TestCase):
+    def setUp(self):
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        author = User.signup("author", "author@email.com", "password", None)
+        fan = User.signup("fan", "fan@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follows(user_following_id=fan.id,
+                               user_being_followed_id=author.id))
+        db.session.commit()
+
+        self.author_id = author.id
+        self.fan_id = fan.id
+
+        queue.eager = False
+        self.worker = Worker(app, queue)
+
+    def tearDown(self):
+        db.session.rollback()
+        queue.init_app(app)
+        calls.clear()
+
+    def fan_timeline(self):
+        return db.session.scalars(
+            db.select(TimelineEntry.message_id)
+            .where(TimelineEntry.user_id == self.fan_id)).all()
+
+    def test_fan_out_runs_in_worker(self):
+        author = db.session.get(User, self.author_id)
+        msg = services.post_message(author, "hello")
+
+        self.assertEqual(self.fan_timeline(), [])
+        self.assertEqual(self.worker.work_once(limit=10), 1)
+        self.assertEqual(self.fan_timeline(), [msg.id])
+
+        job = Job.query.one()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(self.worker.stats()['fan_out_message']['done'], 1)
+
+    def test_idempotency_key(self):
+        enqueue(flaky, key="once", n=1)
+        enqueue(flaky, key="once", n=2)
+        db.session.commit()
+
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_failed_jobs_back_off_then_fail(self):
+        queue.max_attempts = 2
+        enqueue(flaky, n=1)
+        db.session.commit()
+
+        self.worker.work_once()
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIn("try again", job.error)
+
+        # Not due yet.
+        self.assertEqual(self.worker.work_once(), 0)
+
+        Job.query.update({'run_at': datetime.utcnow()})
+        db.session.commit()
+        self.worker.work_once()
+
+        db.session.expire_all()
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(calls, [1, 1])
+
+    def test_eager_runs_inline(self):
+        queue.eager = True
+        author = db.session.get(User, self.author_id)
+        msg = services.post_message(author, "hello")
+
+        self.assertEqual(self.fan_timeline(), [msg.id])
+        self.assertEqual(Job.query.count(), 0)
@@ -0,0 +1,197 @@
+"""Live timeline stream tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_live.py
+
+
+import json
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from live import PostgresBroker, TimelineHub, TooManyStreams, timeline_hub
+import services
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+def event(msg_id, author_id):
+    return {'id': msg_id, 'text': "hi", 'timestamp': "2023-01-01T00:00:00",
+            'user': {'id': author_id, 'username': "u", 'image_url': ""}}
+
+
+class TimelineHubTestCase(TestCase):
+    def test_events_reach_followers_only(self):
+        hub = TimelineHub()
+        fan = hub.subscribe(1, [2])
+        other = hub.subscribe(3, [4])
+
+        hub.publish(event(10, 2))
+        hub.publish(event(11, 1))
+
+        self.assertEqual(fan.get(0)['id'], 10)
+        self.assertEqual(fan.get(0)['id'], 11)    # their own message
+        self.assertIsNone(other.get(0))
+
+        hub.unsubscribe(fan)
+        hub.unsubscribe(other)
+        self.assertEqual(hub.stats()['streams'], 0)
+
+    def test_slow_streams_are_closed(self):
+        hub = TimelineHub(queue_size=2)
+        fan = hub.subscribe(1, [2])
+
+        for msg_id in range(3):
+            hub.publish(event(msg_id, 2))
+
+        self.assertTrue(fan.closed)
+        self.assertEqual(hub.stats()['dropped'], 1)
+
+    def test_streams_per_worker_are_capped(self):
+        hub = TimelineHub(max_streams=1)
+        fan = hub.subscribe(1, [2])
+
+        with self.assertRaises(TooManyStreams):
+            hub.subscribe(3, [2])
+
+        hub.unsubscribe(fan)
+        hub.unsubscribe(hub.subscribe(3, [2]))
+        self.assertEqual(hub.stats()['streams'], 0)
+
+    def test_not_served_from_sync_workers(self):
+        hub = TimelineHub()
+        app.config['STREAM_WSGI'] = True
+
+        try:
+            hub.init_app(app)
+        finally:
+            app.config['STREAM_WSGI'] = False
+
+        # No gevent here, so the setting is ignored.
+        self.assertFalse(hub.serve_wsgi)
+        self.assertFalse(hub.available)
+
+    def test_postgres_broker_reaches_listeners(self):
+        hub = TimelineHub()
+        hub.broker = PostgresBroker(app.config['SQLALCHEMY_DATABASE_URI'],
+                                    hub._deliver,
+                                    channel='chirper_timeline_test')
+        fan = hub.subscribe(1, [2])
+
+        # Publish until the listener has started listening.
+        for msg_id in range(50):
+            hub.publish(event(msg_id, 2))
+            received = fan.get(0.1)
+            if received:
+                break
+
+        self.assertEqual(received['user']['id'], 2)
+
+
+class StreamViewTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        fan = User.signup("fan", "fan@email.com", "password", None)
+        author = User.signup("author", "author@email.com", "password", None)
+        stranger = User.signup("stranger", "stranger@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follows(user_following_id=fan.id,
+                               user_being_followed_id=author.id))
+        db.session.commit()
+
+        self.fan_id = fan.id
+        self.author_id = author.id
+        self.stranger_id = stranger.id
+
+        timeline_hub.heartbeat = 0.05
+        timeline_hub.max_age = 5
+        timeline_hub.serve_wsgi = True
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.fan_id
+
+    def tearDown(self):
+        db.session.rollback()
+        timeline_hub.init_app(app)
+
+    def post(self, user_id, text):
+        return services.post_message(db.session.get(User, user_id), text)
+
+    def read_events(self, resp, count):
+        """The data of the next `count` events, skipping keepalives."""
+
+        events = []
+        for chunk in resp.response:
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if chunk.startswith("id: "):
+                events.append(json.loads(chunk.split("data: ", 1)[1]))
+                if len(events) == count:
+                    return events
+
+    def test_off_by_default(self):
+        timeline_hub.init_app(app)
+
+        self.assertEqual(self.client.get("/stream/timeline").status_code, 404)
+        self.assertNotIn(b"EventSource", self.client.get("/").data)
+
+    def test_home_page_listens_when_available(self):
+        timeline_hub.available = True
+
+        self.assertIn(b"EventSource", self.client.get("/").data)
+
+    def test_full_worker(self):
+        timeline_hub.max_streams = 0
+
+        resp = self.client.get("/stream/timeline")
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(timeline_hub.stats()['streams'], 0)
+
+    def test_requires_login(self):
+        resp = app.test_client().get("/stream/timeline")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_streams_followed_messages(self):
+        resp = self.client.get("/stream/timeline")
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        self.assertIsNone(resp.headers.get('ETag'))
+
+        self.post(self.stranger_id, "not for you")
+        self.post(self.author_id, "for you")
+
+        [received] = self.read_events(resp, 1)
+        self.assertEqual(received['text'], "for you")
+        self.assertEqual(received['user']['username'], "author")
+
+        resp.close()
+        self.assertEqual(timeline_hub.stats()['streams'], 0)
+
+    def test_reconnect_replays_missed_messages(self):
+        first = self.post(self.author_id, "seen")
+        self.post(self.stranger_id, "not for you")
+        self.post(self.author_id, "missed")
+
+        resp = self.client.get("/stream/timeline",
+                               headers={'Last-Event-ID': str(first.id)})
+
+        [received] = self.read_events(resp, 1)
+        self.assertEqual(received['text'], "missed")
+        resp.close()
@@ -38,6 +38,11 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Fail any request that issues more SQL statements than this, to catch
+# N+1 query patterns
+
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+
 
 class MessageBaseViewTestCase(TestCase):
     def setUp(self):
@@ -64,6 +69,8 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.u1_id
 
+            count_before = User.query.get(self.u1_id).messages_count
+
             # Now, that session setting is saved, so we can have
             # the rest of ours test
             resp = c.post("/messages/new", data={"text": "Hello"})
@@ -71,3 +78,7 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             self.assertEqual(resp.status_code, 302)
 
             Message.query.filter_by(text="Hello").one()
+
+            db.session.expire_all()
+            user = User.query.get(self.u1_id)
+            self.assertEqual(user.messages_count, count_before + 1)
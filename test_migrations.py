@@ -0,0 +1,163 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import inspect, select, text
+
+from models import db, User, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+import migrations
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Added to existing tables by migrations (new tables are just created).
+ADDED_COLUMNS = {
+    'users': ['messages_count', 'following_count', 'followers_count',
+              'liked_messages_count', 'version', 'unread_notifications',
+              'renamed_at'],
+    'liked_warbles': ['created_at'],
+}
+
+ADDED_INDEXES = {
+    'messages': {'ix_messages_user_id_timestamp', 'ix_messages_timestamp'},
+    'follows': {'ix_follows_user_following_id'},
+    'liked_warbles': {'ix_liked_warbles_message_id',
+                      'ix_liked_warbles_created_at'},
+    'users': {'ix_users_username_pattern', 'ix_users_renamed_at'},
+}
+
+
+def create_baseline_schema():
+    """Recreate the schema as it was before any migration, with a few
+    users, follows, messages and likes."""
+
+    db.session.rollback()
+    db.drop_all()
+    db.create_all()
+
+    with db.engine.begin() as conn:
+        for table in ('notification_actors', 'notifications', 'jobs',
+                      'home_timelines', 'schema_migrations'):
+            conn.execute(text(f"DROP TABLE {table}"))
+
+        for indexes in ADDED_INDEXES.values():
+            for name in indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+        for table, columns in ADDED_COLUMNS.items():
+            for column in columns:
+                conn.execute(text(
+                    f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+        for fk in inspect(conn).get_foreign_keys('liked_warbles'):
+            column = fk['constrained_columns'][0]
+            conn.execute(text(
+                f'ALTER TABLE liked_warbles DROP CONSTRAINT "{fk["name"]}", '
+                f'ADD CONSTRAINT "{fk["name"]}" FOREIGN KEY ({column}) '
+                f'REFERENCES {fk["referred_table"]} (id)'))
+
+        conn.execute(text(
+            "INSERT INTO users (id, email, username, password) VALUES "
+            "(1, 'a@email.com', 'a', 'x'), "
+            "(2, 'b@email.com', 'b', 'x'), "
+            "(3, 'c@email.com', 'c', 'x')"))
+        conn.execute(text(
+            "INSERT INTO follows (user_being_followed_id, user_following_id) "
+            "VALUES (1, 2), (1, 3), (2, 3)"))
+        conn.execute(text(
+            "INSERT INTO messages (id, text, timestamp, user_id) VALUES "
+            "(1, 'a1', '2020-01-01', 1), "
+            "(2, 'a2', '2020-01-02', 1), "
+            "(3, 'b1', '2020-01-03', 2)"))
+        conn.execute(text(
+            "INSERT INTO liked_warbles (user_id, message_id) "
+            "VALUES (3, 1), (3, 3)"))
+
+
+class MigrationTestCase(TestCase):
+    def setUp(self):
+        create_baseline_schema()
+
+        # Small batches, so the backfills take more than one.
+        self._batch_size = migrations.BATCH_SIZE
+        migrations.BATCH_SIZE = 2
+
+    def tearDown(self):
+        migrations.BATCH_SIZE = self._batch_size
+
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def counters(self):
+        db.session.expire_all()
+
+        return {user.username: (user.messages_count,
+                                user.following_count,
+                                user.followers_count,
+                                user.liked_messages_count)
+                for user in User.query}
+
+    def timelines(self):
+        return db.session.execute(
+            select(TimelineEntry.user_id, TimelineEntry.message_id)
+            .order_by(TimelineEntry.user_id, TimelineEntry.message_id)).all()
+
+    def test_upgrade_backfills_a_baseline_database(self):
+        applied = migrations.upgrade()
+
+        self.assertEqual(applied, [version for version, _
+                                   in migrations.MIGRATIONS])
+
+        self.assertEqual(self.counters(), {
+            'a': (2, 0, 2, 0),
+            'b': (1, 1, 1, 0),
+            'c': (0, 2, 0, 2),
+        })
+        self.assertEqual(self.timelines(), [
+            (1, 1), (1, 2),
+            (2, 1), (2, 2), (2, 3),
+            (3, 1), (3, 2), (3, 3),
+        ])
+
+        inspector = inspect(db.engine)
+
+        for table, indexes in ADDED_INDEXES.items():
+            names = {idx['name'] for idx in inspector.get_indexes(table)}
+            self.assertLessEqual(indexes, names, table)
+
+        for fk in inspector.get_foreign_keys('liked_warbles'):
+            self.assertEqual(fk['options'].get('ondelete'), 'CASCADE')
+
+    def test_upgrade_runs_once(self):
+        migrations.upgrade()
+        counters, timelines = self.counters(), self.timelines()
+
+        self.assertEqual(migrations.upgrade(), [])
+        self.assertEqual(self.counters(), counters)
+        self.assertEqual(self.timelines(), timelines)
+
+        # Steps also check for themselves, for an interrupted upgrade.
+        with db.engine.connect().execution_options(
+                isolation_level='AUTOCOMMIT') as conn:
+            for _, fn in migrations.MIGRATIONS:
+                fn(conn)
+
+        self.assertEqual(self.counters(), counters)
+        self.assertEqual(self.timelines(), timelines)
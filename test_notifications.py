@@ -0,0 +1,173 @@
+"""Notification tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_notifications.py
+
+
+import os
+from unittest import TestCase
+
+from models import (
+    db, User, Message, Follows, LikedWarble, Notification, NotificationActor,
+)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from notifications import mark_read, notification_buffer
+import services
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        NotificationActor.query.delete()
+        Notification.query.delete()
+        LikedWarble.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        users = [User.signup(f"u{i}", f"u{i}@email.com", "password", None)
+                 for i in range(6)]
+        db.session.flush()
+
+        msg = Message(text="popular", user_id=users[0].id)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.author_id = users[0].id
+        self.fan_ids = [user.id for user in users[1:]]
+        self.msg_id = msg.id
+
+        # Only write when a test flushes.
+        notification_buffer.flush_interval = 3600
+        notification_buffer.max_events = 10000
+
+    def tearDown(self):
+        db.session.rollback()
+        notification_buffer.flush()
+        notification_buffer.init_app(app)
+
+    def author(self):
+        db.session.expire_all()
+        return db.session.get(User, self.author_id)
+
+    def test_likes_coalesce_into_one_row(self):
+        for fan_id in self.fan_ids:
+            services.like_messages(fan_id, [self.msg_id])
+
+        self.assertEqual(notification_buffer.flush(), 5)
+
+        note = Notification.query.one()
+        self.assertEqual((note.kind, note.count, note.message_id),
+                         ('like', 5, self.msg_id))
+        self.assertEqual(note.actor_id, self.fan_ids[-1])
+        self.assertEqual(self.author().unread_notifications, 5)
+
+        # A later flush adds to the same unread row.
+        services.follow_users(self.fan_ids[0], [self.author_id])
+        services.like_messages(self.author_id, [self.msg_id])   # own message
+        notification_buffer.flush()
+
+        self.assertEqual(Notification.query.count(), 2)
+        self.assertEqual(self.author().unread_notifications, 6)
+
+    def test_repeat_actors_count_once(self):
+        fan_id = self.fan_ids[0]
+
+        services.like_messages(fan_id, [self.msg_id])
+        services.unlike_messages(fan_id, [self.msg_id])
+        services.like_messages(fan_id, [self.msg_id])
+        self.assertEqual(notification_buffer.flush(), 1)
+
+        # Again in a later flush, then a second fan.
+        services.unlike_messages(fan_id, [self.msg_id])
+        services.like_messages(fan_id, [self.msg_id])
+        self.assertEqual(notification_buffer.flush(), 0)
+
+        services.like_messages(self.fan_ids[1], [self.msg_id])
+        notification_buffer.flush()
+
+        note = Notification.query.one()
+        self.assertEqual((note.count, note.actor_id), (2, self.fan_ids[1]))
+        self.assertEqual(self.author().unread_notifications, 2)
+
+    def test_reading_starts_new_groups(self):
+        services.like_messages(self.fan_ids[0], [self.msg_id])
+        notification_buffer.flush()
+
+        mark_read(self.author_id)
+        db.session.commit()
+        self.assertEqual(self.author().unread_notifications, 0)
+
+        # The same fan again counts in the new group.
+        services.unlike_messages(self.fan_ids[0], [self.msg_id])
+        services.like_messages(self.fan_ids[0], [self.msg_id])
+        services.like_messages(self.fan_ids[1], [self.msg_id])
+        notification_buffer.flush()
+
+        counts = [note.count for note in
+                  Notification.query.order_by(Notification.id)]
+        self.assertEqual(counts, [1, 2])
+        self.assertEqual(self.author().unread_notifications, 2)
+
+    def test_mark_read_needs_a_json_body(self):
+        services.like_messages(self.fan_ids[0], [self.msg_id])
+        notification_buffer.flush()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            # As a cross-site form would post it.
+            resp = client.post("/api/v1/notifications/read",
+                               data={'read': 'all'})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(self.author().unread_notifications, 1)
+
+            resp = client.post("/api/v1/notifications/read", json={})
+            self.assertEqual(resp.status_code, 204)
+            self.assertEqual(self.author().unread_notifications, 0)
+
+    def test_events_for_deleted_messages_are_dropped(self):
+        services.like_messages(self.fan_ids[0], [self.msg_id])
+        services.delete_message(db.session.get(Message, self.msg_id))
+
+        self.assertEqual(notification_buffer.flush(), 0)
+        self.assertEqual(Notification.query.count(), 0)
+
+    def test_inbox_page_and_api(self):
+        services.like_messages(self.fan_ids[0], [self.msg_id])
+        services.like_messages(self.fan_ids[1], [self.msg_id])
+        notification_buffer.flush()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.author_id
+
+            data = client.get("/api/v1/notifications").json
+            self.assertEqual(data['unread'], 2)
+            self.assertEqual(data['notifications'][0]['count'], 2)
+
+            html = client.get("/notifications").get_data(as_text=True)
+            self.assertIn("@u2", html)
+            self.assertIn("and 1 other", html)
+            self.assertIn("liked your warble", html)
+            self.assertNotIn('id="unread-notifications"', html)
+
+            data = client.get("/api/v1/notifications").json
+            self.assertEqual(data['unread'], 0)
+            self.assertTrue(data['notifications'][0]['read'])
@@ -0,0 +1,142 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, password_limiter
+from passwords import (
+    hasher, PasswordHasher, ConcurrencyLimiter, HashingBusy, TooManyAttempts)
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class PasswordHasherTestCase(TestCase):
+    def setUp(self):
+        self.hasher = PasswordHasher(rounds=4)
+
+    def test_hash_and_verify(self):
+        hashed = self.hasher.hash("password")
+
+        self.assertTrue(hashed.startswith("$2b$04$"))
+        self.assertTrue(self.hasher.verify(hashed, "password"))
+        self.assertFalse(self.hasher.verify(hashed, "wrong"))
+        self.assertFalse(self.hasher.verify(hashed, None))
+
+        with self.assertRaises(ValueError):
+            self.hasher.hash(None)
+
+    def test_needs_rehash(self):
+        hashed = self.hasher.hash("password")
+
+        self.assertFalse(self.hasher.needs_rehash(hashed))
+        self.hasher.rounds = 5
+        self.assertTrue(self.hasher.needs_rehash(hashed))
+
+    def test_busy_when_queue_is_full(self):
+        busy = PasswordHasher(rounds=4, max_pending=1, timeout=0)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(*args):
+            started.set()
+            release.wait()
+
+        worker = threading.Thread(target=busy._run, args=(slow,))
+        worker.start()
+        started.wait()
+
+        self.assertEqual(busy.stats()['pending'], 1)
+        with self.assertRaises(HashingBusy):
+            busy.hash("password")
+
+        release.set()
+        worker.join()
+
+        self.assertEqual(busy.stats()['rejected'], 1)
+        self.assertEqual(busy.stats()['pending'], 0)
+
+    def test_process_pool(self):
+        pooled = PasswordHasher(rounds=4, workers=1)
+        self.addCleanup(pooled.shutdown)
+
+        hashed = pooled.hash("password")
+
+        self.assertTrue(pooled.verify(hashed, "password"))
+        self.assertEqual(pooled.stats()['completed'], 2)
+
+
+class ConcurrencyLimiterTestCase(TestCase):
+    def test_limits_per_user_and_ip(self):
+        limiter = ConcurrencyLimiter(per_user=1, per_ip=2)
+
+        with limiter.hold("u1", "1.2.3.4"):
+            with self.assertRaises(TooManyAttempts):
+                with limiter.hold("u1", "5.6.7.8"):
+                    pass
+
+            with limiter.hold("u2", "1.2.3.4"):
+                with self.assertRaises(TooManyAttempts):
+                    with limiter.hold("u3", "1.2.3.4"):
+                        pass
+
+        # Everything was released.
+        with limiter.hold("u1", "1.2.3.4"):
+            pass
+
+
+class LoginViewTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.rounds = hasher.rounds
+        hasher.rounds = 4
+
+        User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        hasher.rounds = self.rounds
+
+    def test_login_rehashes_with_new_cost(self):
+        hasher.rounds = 5
+
+        with app.test_client() as c:
+            resp = c.post("/login", data={"username": "u1",
+                                          "password": "password"})
+
+        self.assertEqual(resp.status_code, 302)
+
+        user = User.query.filter_by(username="u1").one()
+        self.assertTrue(user.password.startswith("$2b$05$"))
+
+    def test_concurrent_login_limited(self):
+        with password_limiter.hold("u1"), password_limiter.hold("u1"):
+            with app.test_client() as c:
+                resp = c.post("/login", data={"username": "u1",
+                                              "password": "password"})
+
+        self.assertEqual(resp.status_code, 429)
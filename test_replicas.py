@@ -0,0 +1,152 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+#
+# A second database, warbler_test_replica, stands in for the replica; it is
+# created if it doesn't exist.
+
+
+import os
+import threading
+from unittest import TestCase
+
+from sqlalchemy import create_engine, text
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from replicas import router
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+REPLICA_URL = "postgresql:///warbler_test_replica"
+
+db.drop_all()
+db.create_all()
+
+
+def create_replica_database():
+    engine = create_engine("postgresql:///postgres",
+                           isolation_level="AUTOCOMMIT")
+
+    with engine.connect() as conn:
+        exists = conn.scalar(text(
+            "SELECT 1 FROM pg_database WHERE datname = 'warbler_test_replica'"))
+        if not exists:
+            conn.execute(text("CREATE DATABASE warbler_test_replica"))
+
+    engine.dispose()
+
+
+class ReplicaRoutingTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        create_replica_database()
+
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        router.configure([REPLICA_URL], max_lag=5, sticky_seconds=5)
+        replica = router.replicas[0].engine
+
+        # The replica has the same user under another name, so pages show
+        # which database they were read from.
+        db.metadata.drop_all(replica)
+        db.metadata.create_all(replica)
+        with replica.begin() as conn:
+            conn.execute(User.__table__.insert().values(
+                id=self.u1_id,
+                username="on-replica",
+                email="u1@email.com",
+                password="x",
+            ))
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        router.configure([])
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def get_profile(self, client):
+        self.login(client)
+        resp = client.get(f"/users/{self.u1_id}")
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True)
+
+    def test_get_reads_from_replica(self):
+        with self.client as c:
+            self.assertIn("on-replica", self.get_profile(c))
+
+    def test_reads_own_writes_from_primary(self):
+        with self.client as c:
+            self.login(c)
+            c.post("/messages/new", data={"text": "hello"})
+
+            html = self.get_profile(c)
+
+            self.assertNotIn("on-replica", html)
+            self.assertIn("hello", html)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        router.replicas[0].measure_lag = lambda: 60
+
+        with self.client as c:
+            self.assertNotIn("on-replica", self.get_profile(c))
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        router.configure(["postgresql:///warbler_no_such_replica"])
+
+        with self.client as c:
+            self.assertNotIn("on-replica", self.get_profile(c))
+
+    def test_slow_lag_check_does_not_block_other_requests(self):
+        """While one request measures a slow replica, others use the last
+        measurement instead of waiting."""
+
+        replica = router.replicas[0]
+        replica.lag, replica.checked_at = 0, 0
+        measuring, release = threading.Event(), threading.Event()
+
+        def slow_lag():
+            measuring.set()
+            release.wait(10)
+            return 0
+
+        replica.measure_lag = slow_lag
+        checker = threading.Thread(target=self.get_profile,
+                                   args=(app.test_client(),))
+        checker.start()
+
+        try:
+            self.assertTrue(measuring.wait(10))
+
+            with self.client as c:
+                self.assertIn("on-replica", self.get_profile(c))
+
+            # Still measuring.
+            self.assertTrue(checker.is_alive())
+        finally:
+            release.set()
+            checker.join()
@@ -0,0 +1,158 @@
+"""Username search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+import threading
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY, search_index
+from search import UsernameIndex
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class SearchBaseTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        for username in ["bob", "bobby", "abob", "alice", "kabobs"]:
+            User.signup(username, f"{username}@email.com", "password", None)
+        db.session.commit()
+
+        self.ids = {user.username: user.id for user in User.query}
+
+
+class UsernameIndexTestCase(SearchBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = UsernameIndex()
+
+    def test_ranking(self):
+        """Exact match, then prefix matches, then shortest substring matches."""
+
+        found = self.index.search("BOB")
+
+        self.assertEqual(found, [self.ids[name] for name in
+                                 ["bob", "bobby", "abob", "kabobs"]])
+
+    def test_limit_and_short_queries(self):
+        self.assertEqual(self.index.search("bob", limit=2),
+                         [self.ids["bob"], self.ids["bobby"]])
+        self.assertEqual(self.index.search("al"), [self.ids["alice"]])
+        self.assertEqual(self.index.search("ob"),
+                         [self.ids[name]
+                          for name in ["abob", "bob", "bobby", "kabobs"]])
+        self.assertEqual(self.index.search("bo", limit=3),
+                         [self.ids[name] for name in ["bob", "bobby", "abob"]])
+        self.assertEqual(self.index.search("  "), [])
+
+    def test_add_and_remove(self):
+        self.index.search("x")
+
+        self.index.add(self.ids["alice"], "zebra")
+        self.index.remove(self.ids["bob"])
+
+        self.assertEqual(self.index.search("alice"), [])
+        self.assertEqual(self.index.search("zeb"), [self.ids["alice"]])
+        self.assertNotIn(self.ids["bob"], self.index.search("bob"))
+
+    def test_refresh_merges_new_users(self):
+        """Users signed up elsewhere are merged into the sorted list once."""
+
+        self.index.search("x")
+
+        aaron = User.signup("aaron", "aaron@email.com", "password", None)
+        bobo = User.signup("bobo", "bobo@email.com", "password", None)
+        db.session.commit()
+
+        # bobo signed up through this process, aaron through another.
+        self.index.add(bobo.id, "bobo")
+        self.index._refreshed_at = 0
+
+        self.assertEqual(self.index.search("a", limit=1), [aaron.id])
+        self.assertEqual(self.index._sorted, sorted(set(self.index._sorted)))
+        self.assertEqual(self.index.search("bob")[:3],
+                         [self.ids["bob"], self.ids["bobby"], bobo.id])
+
+
+    def test_refresh_picks_up_renames(self):
+        """Users renamed through another process are re-indexed."""
+
+        self.index.search("x")
+
+        alice = db.session.get(User, self.ids["alice"])
+        alice.username = "zebra"
+        alice.renamed_at = datetime.utcnow()
+        db.session.commit()
+
+        self.index._refreshed_at = 0
+
+        self.assertEqual(self.index.search("zeb"), [alice.id])
+        self.assertEqual(self.index.search("alice"), [])
+        self.assertEqual(self.index._sorted, sorted(self.index._sorted))
+        self.assertEqual(len(self.index._sorted), len(self.ids))
+
+    def test_searches_dont_wait_for_a_refresh(self):
+        """The index isn't locked while a refresh waits on the database."""
+
+        self.index.search("x")
+
+        fetching = threading.Event()
+        release = threading.Event()
+
+        def slow_fetch(*args):
+            fetching.set()
+            release.wait(5)
+            return []
+
+        self.index._fetch = slow_fetch
+        self.index._refreshed_at = 0
+
+        refresher = threading.Thread(target=self.index.search, args=("x",))
+        refresher.start()
+        self.assertTrue(fetching.wait(5))
+
+        try:
+            self.assertEqual(self.index.search("bob", limit=1),
+                             [self.ids["bob"]])
+            self.assertTrue(refresher.is_alive())
+        finally:
+            release.set()
+            refresher.join(5)
+
+
+class TypeaheadViewTestCase(SearchBaseTestCase):
+    def test_typeahead(self):
+        search_index.build()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids["alice"]
+
+            resp = c.get("/users/typeahead?q=bob&limit=2")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([user['username'] for user in resp.json['users']],
+                             ["bob", "bobby"])
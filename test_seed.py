@@ -0,0 +1,124 @@
+"""Seed script tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_seed.py
+
+
+import csv
+import os
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from sqlalchemy import inspect, select
+
+from models import db, User, Message, Follows, LikedWarble, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+import seed
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Users are split over two files, as generator/create_csvs.py partitions
+# them.
+CSVS = {
+    'users_0.csv': [
+        ['email', 'username', 'image_url', 'password'],
+        ['a@email.com', 'a', '/static/images/default-pic.png', 'x'],
+        ['b@email.com', 'b', '/static/images/default-pic.png', 'x'],
+    ],
+    'users_1.csv': [
+        ['email', 'username', 'image_url', 'password'],
+        ['c@email.com', 'c', '/static/images/default-pic.png', 'x'],
+    ],
+    'messages.csv': [
+        ['text', 'timestamp', 'user_id'],
+        ['a1', '2020-01-01 00:00:00', '1'],
+        ['a2', '2020-01-02 00:00:00', '1'],
+        ['b1', '2020-01-03 00:00:00', '2'],
+    ],
+    'follows.csv': [
+        ['user_being_followed_id', 'user_following_id'],
+        ['1', '2'],
+        ['1', '3'],
+        ['2', '3'],
+    ],
+    'liked_warbles.csv': [
+        ['user_id', 'message_id'],
+        ['3', '1'],
+        ['3', '3'],
+    ],
+}
+
+
+class SeedTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+
+        self.data_dir = TemporaryDirectory()
+
+        for name, rows in CSVS.items():
+            with open(Path(self.data_dir.name) / name, 'w',
+                      newline='') as csv_file:
+                csv.writer(csv_file).writerows(rows)
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def test_copy_seed(self):
+        # Chunks of two rows, so most tables take more than one COPY.
+        with redirect_stdout(StringIO()):
+            seed.seed(self.data_dir.name, chunk_size=2)
+
+        for model, count in ((User, 3), (Message, 3), (Follows, 3),
+                             (LikedWarble, 2), (TimelineEntry, 8)):
+            self.assertEqual(model.query.count(), count, model.__tablename__)
+
+        self.assertEqual(
+            db.session.scalars(
+                select(TimelineEntry.message_id)
+                .where(TimelineEntry.user_id == 3)
+                .order_by(TimelineEntry.message_id)).all(),
+            [1, 2, 3])
+
+        def counters():
+            db.session.expire_all()
+
+            return {user.username: (user.messages_count,
+                                    user.following_count,
+                                    user.followers_count,
+                                    user.liked_messages_count)
+                    for user in User.query}
+
+        seeded = counters()
+        self.assertEqual(seeded['c'], (0, 2, 0, 2))
+
+        User.reconcile_counts()
+        self.assertEqual(counters(), seeded)
+
+        # Deferred indexes and foreign keys are back.
+        inspector = inspect(db.engine)
+        self.assertIn('ix_messages_user_id_timestamp',
+                      {idx['name'] for idx in inspector.get_indexes('messages')})
+        self.assertEqual(len(inspector.get_foreign_keys('liked_warbles')), 2)
+
+        # New rows get ids past the loaded ones.
+        user = User.signup("d", "d@email.com", "password", None)
+        db.session.commit()
+        self.assertEqual(user.id, 4)
@@ -0,0 +1,196 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import services
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+db.drop_all()
+db.create_all()
+
+
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        TimelineEntry.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_CELEBRITY_THRESHOLD'] = (
+            timeline.DEFAULT_CELEBRITY_THRESHOLD)
+        app.config['TIMELINE_LENGTH'] = timeline.DEFAULT_TIMELINE_LENGTH
+        app.config['TIMELINE_TRIM_EVERY'] = timeline.DEFAULT_TRIM_EVERY
+
+    def login(self, client, user_id):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def timeline_texts(self, user_id):
+        user = db.session.get(User, user_id)
+        return [msg.text for msg in timeline.home_timeline(user)]
+
+    def test_post_fans_out_to_followers(self):
+        """A new message shows up in the author's and followers' timelines."""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "hello followers"})
+
+        self.assertEqual(self.timeline_texts(self.u1_id), ["hello followers"])
+        self.assertEqual(self.timeline_texts(self.u2_id), ["hello followers"])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        """Following copies old messages in; unfollowing removes them."""
+
+        db.session.add(Message(text="older", user_id=self.u2_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertEqual(self.timeline_texts(self.u1_id), ["older"])
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            self.assertEqual(self.timeline_texts(self.u1_id), [])
+
+    def test_celebrity_messages_merged_on_read(self):
+        """Authors over the threshold are not fanned out but still appear."""
+
+        app.config['TIMELINE_CELEBRITY_THRESHOLD'] = 1
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "celebrity post"})
+
+        stored = TimelineEntry.query.filter_by(user_id=self.u1_id).count()
+
+        self.assertEqual(stored, 0)
+        self.assertEqual(self.timeline_texts(self.u1_id), ["celebrity post"])
+
+    def test_fan_out_after_backfill(self):
+        """Fan-out skips followers a backfill already delivered to."""
+
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+        db.session.add_all([
+            Follows(user_being_followed_id=self.u2_id, user_following_id=self.u1_id),
+            Follows(user_being_followed_id=self.u2_id, user_following_id=u3.id),
+        ])
+        msg = Message(text="raced", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        # u1's follow job runs before the message's fan-out job.
+        services.backfill_timeline(follower_id=self.u1_id,
+                                   followed_ids=[self.u2_id])
+        services.fan_out_message(message_id=msg.id)
+        db.session.commit()
+
+        self.assertEqual(self.timeline_texts(self.u1_id), ["raced"])
+        self.assertEqual(self.timeline_texts(u3.id), ["raced"])
+        self.assertEqual(self.timeline_texts(self.u2_id), ["raced"])
+
+    def test_fan_out_trims_timelines(self):
+        """Followers' timelines are trimmed back to TIMELINE_LENGTH."""
+
+        app.config['TIMELINE_LENGTH'] = 3
+        app.config['TIMELINE_TRIM_EVERY'] = 1
+
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        start = datetime(2023, 1, 1)
+
+        for i in range(5):
+            msg = Message(text=f"msg-{i}", user_id=self.u2_id,
+                          timestamp=start + timedelta(minutes=i))
+            db.session.add(msg)
+            db.session.flush()
+            timeline.fan_out_message(msg)
+
+        db.session.commit()
+
+        for user_id in (self.u1_id, self.u2_id):
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=user_id).count(), 3)
+            self.assertEqual(self.timeline_texts(user_id),
+                             ["msg-4", "msg-3", "msg-2"])
+
+    def test_trims_ties_at_the_cutoff(self):
+        """Messages sharing a timestamp are trimmed one by one, in the
+        order timelines are read."""
+
+        app.config['TIMELINE_LENGTH'] = 3
+
+        db.session.add(Follows(user_being_followed_id=self.u2_id,
+                               user_following_id=self.u1_id))
+        at = datetime(2023, 1, 1)
+        msgs = [Message(text=f"msg-{i}", user_id=self.u2_id, timestamp=at)
+                for i in range(5)]
+        db.session.add_all(msgs)
+        db.session.flush()
+
+        for msg in msgs:
+            timeline.fan_out_message(msg)
+
+        timeline.trim(self.u2_id)
+        timeline.trim_followers(self.u2_id)
+        db.session.commit()
+
+        for user_id in (self.u1_id, self.u2_id):
+            self.assertEqual(self.timeline_texts(user_id),
+                             ["msg-4", "msg-3", "msg-2"])
+
+    def test_messages_fanned_out_before_becoming_a_celebrity(self):
+        """Messages stored before their author crossed the threshold are
+        not shown twice."""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post(f"/users/follow/{self.u2_id}")
+
+            self.login(c, self.u2_id)
+            c.post("/messages/new", data={"text": "before fame"})
+
+        app.config['TIMELINE_CELEBRITY_THRESHOLD'] = 1
+
+        self.assertEqual(self.timeline_texts(self.u1_id), ["before fame"])
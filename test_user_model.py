@@ -10,7 +10,8 @@ from unittest import TestCase
 from flask_bcrypt import Bcrypt
 
 
-from models import db, User, Message, Follows
+from models import db, User, Message, Follows, LikedWarble
+from membership import Membership
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -54,6 +55,10 @@ class UserModelTestCase(TestCase):
     def tearDown(self):
         db.session.rollback()
 
+    def delete_likes(self):
+        LikedWarble.query.delete()
+        db.session.commit()
+
     def test_user_model(self):
         u1 = User.query.get(self.u1_id)
 
@@ -143,11 +148,46 @@ class UserModelTestCase(TestCase):
         self.assertEqual(test_fake_password, False)
 
 
-    
+    def test_reconcile_counts(self):
+        """Tests whether User.reconcile_counts rebuilds drifted counters from the base tables."""
 
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
 
+        u1.following.append(u2)
+        db.session.add(Message(text="counted", user_id=self.u1_id))
+        User.adjust_counts(self.u2_id, followers_count=5)
+        db.session.commit()
+
+        User.reconcile_counts()
+        db.session.commit()
+        db.session.expire_all()
+
+        self.assertEqual(u1.messages_count, 1)
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual(u2.following_count, 0)
 
-    
 
+    def test_membership(self):
+        """Tests whether Membership answers follow and like checks for a page of users and messages."""
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+
+        m1 = Message(text="liked", user_id=self.u2_id)
+        m2 = Message(text="not liked", user_id=self.u2_id)
+        u1.following.append(u2)
+        db.session.add_all([m1, m2])
+        db.session.flush()
+        db.session.add(LikedWarble(user_id=self.u1_id, message_id=m1.id))
+        db.session.commit()
+        self.addCleanup(self.delete_likes)
 
+        membership = Membership(self.u1_id)
+        membership.load(users=[u1, u2], messages=[m1, m2])
 
+        self.assertTrue(membership.is_following(u2))
+        self.assertFalse(membership.is_following(u1))
+        self.assertTrue(membership.has_liked(m1))
+        self.assertFalse(membership.has_liked(m2))
@@ -0,0 +1,217 @@
+"""User View tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_user_views.py
+
+
+import os
+import re
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, LikedWarble
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY, PAGE_SIZE
+import timeline
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['MAX_QUERIES_PER_REQUEST'] = 10
+
+db.drop_all()
+db.create_all()
+
+
+class UserBaseViewTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.flush()
+
+        start = datetime(2023, 1, 1)
+        db.session.add_all([
+            Message(text=f"msg-{i}",
+                    user_id=u1.id,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(PAGE_SIZE + 5)
+        ])
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+        self.client = app.test_client()
+
+    def login(self, client):
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+
+class UserShowPaginationTestCase(UserBaseViewTestCase):
+    def test_first_page_has_next_cursor(self):
+        with self.client as c:
+            self.login(c)
+            resp = c.get(f"/users/{self.u1_id}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f"msg-{PAGE_SIZE + 4}", html)
+            self.assertNotIn("msg-4<", html)
+            self.assertIn("after=", html)
+
+    def test_next_page_continues_after_cursor(self):
+        with self.client as c:
+            self.login(c)
+            last = Message.query.filter_by(text="msg-5").one()
+            cursor = f"{last.timestamp.isoformat()}_{last.id}"
+
+            resp = c.get(f"/users/{self.u1_id}?after={cursor}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("msg-4<", html)
+            self.assertIn("msg-0<", html)
+            self.assertNotIn("msg-5<", html)
+            self.assertNotIn("after=", html)
+
+    def test_malformed_cursor(self):
+        with self.client as c:
+            self.login(c)
+            resp = c.get(f"/users/{self.u1_id}?after=nonsense")
+
+            self.assertEqual(resp.status_code, 400)
+
+    def test_unknown_user(self):
+        with self.client as c:
+            self.login(c)
+
+            self.assertEqual(c.get("/users/0").status_code, 404)
+            self.assertEqual(c.get("/users/0/liked_messages").status_code, 404)
+
+
+class HomepageQueryCountTestCase(UserBaseViewTestCase):
+    def test_timeline_authors_loaded_up_front(self):
+        """The homepage doesn't query once per message author."""
+
+        user = User.query.get(self.u1_id)
+
+        for i in range(15):
+            author = User.signup(f"author{i}", f"author{i}@email.com",
+                                 "password", None)
+            db.session.flush()
+            db.session.add(Message(text=f"by author{i}", user_id=author.id))
+            user.following.append(author)
+
+        db.session.commit()
+        User.reconcile_counts()
+        timeline.rebuild_all()
+        db.session.commit()
+
+        # Start with an empty identity map so authors must really be loaded.
+        db.session.remove()
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("by author14", resp.get_data(as_text=True))
+
+
+class UserCacheViewTestCase(UserBaseViewTestCase):
+    def test_profile_edit_refreshes_cached_user(self):
+        with self.client as c:
+            self.login(c)
+            c.get("/")
+
+            resp = c.post("/users/profile", data={
+                "username": "renamed",
+                "email": "u1@email.com",
+                "password": "password",
+                "image_url": "http://example.com/pic.png",
+                "header_image_url": "",
+                "bio": "",
+            })
+            self.assertEqual(resp.status_code, 302)
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn('alt="renamed"', html)
+            self.assertIsNotNone(db.session.get(User, self.u1_id).renamed_at)
+
+
+class DeleteUserViewTestCase(UserBaseViewTestCase):
+    def test_delete_removes_rows_and_fixes_counters(self):
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        u2_msg = Message(text="by u2", user_id=u2.id)
+        db.session.add_all([
+            u2_msg,
+            Follows(user_being_followed_id=self.u1_id, user_following_id=u2.id),
+            Follows(user_being_followed_id=u2.id, user_following_id=self.u1_id),
+        ])
+        db.session.flush()
+
+        u1_msgs = Message.query.filter_by(user_id=self.u1_id).limit(2).all()
+        db.session.add_all(
+            [LikedWarble(user_id=u2.id, message_id=msg.id) for msg in u1_msgs]
+            + [LikedWarble(user_id=self.u1_id, message_id=u2_msg.id)])
+        db.session.commit()
+        User.reconcile_counts()
+        db.session.commit()
+
+        u2_id = u2.id
+
+        with self.client as c:
+            self.login(c)
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        db.session.expire_all()
+        u2 = db.session.get(User, u2_id)
+
+        self.assertIsNone(db.session.get(User, self.u1_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 0)
+        self.assertEqual(LikedWarble.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual((u2.messages_count,
+                          u2.following_count,
+                          u2.followers_count,
+                          u2.liked_messages_count), (1, 0, 0, 0))
+
+
+class CsrfTokenViewTestCase(UserBaseViewTestCase):
+    def setUp(self):
+        super().setUp()
+        app.config['WTF_CSRF_ENABLED'] = True
+
+    def tearDown(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+
+    def test_token_is_signed_for_each_session(self):
+        """A page rendered for one session mustn't reuse the previous
+        session's token, which is kept in `g`."""
+
+        other = app.test_client()
+        other.get("/login")
+
+        self.login(self.client)
+        html = self.client.get("/messages/new").get_data(as_text=True)
+        token = re.search(r'name="csrf_token"[^>]*value="([^"]+)"',
+                          html).group(1)
+
+        resp = self.client.post("/messages/new",
+                                data={"csrf_token": token, "text": "hello"})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Message.query.filter_by(text="hello").count(), 1)
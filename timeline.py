@@ -0,0 +1,307 @@
+"""Precomputed home timelines for Chirper.
+
+New messages are written into the home timeline of every follower when they
+are posted (fan-out-on-write), so building a home page is a single indexed
+read instead of a scan over everything the user follows.
+
+Authors with a very large number of followers are skipped at write time; their
+messages are merged in when a timeline is read (fan-out-on-read), so one
+celebrity post never turns into millions of inserts.
+"""
+
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, literal, select, tuple_
+
+from models import db, insert_new, Follows, Message, TimelineEntry, User
+
+DEFAULT_CELEBRITY_THRESHOLD = 10000
+DEFAULT_TIMELINE_LENGTH = 800
+DEFAULT_TRIM_EVERY = 20
+
+
+def _celebrity_threshold():
+    return current_app.config.get('TIMELINE_CELEBRITY_THRESHOLD',
+                                  DEFAULT_CELEBRITY_THRESHOLD)
+
+
+def _timeline_length():
+    return current_app.config.get('TIMELINE_LENGTH', DEFAULT_TIMELINE_LENGTH)
+
+
+def _trim_every():
+    return current_app.config.get('TIMELINE_TRIM_EVERY', DEFAULT_TRIM_EVERY)
+
+
+def is_celebrity(user_id):
+    """Are messages by `user_id` merged on read rather than fanned out?"""
+
+    followers_count = db.session.scalar(
+        select(User.followers_count).where(User.id == user_id))
+
+    return followers_count >= _celebrity_threshold()
+
+
+def _followed_celebrity_ids(user_id):
+    """Return ids of the users `user_id` follows that are read on demand."""
+
+    return db.session.scalars(
+        select(Follows.user_being_followed_id)
+        .join(User, User.id == Follows.user_being_followed_id)
+        .where(Follows.user_following_id == user_id)
+        .where(User.followers_count >= _celebrity_threshold())).all()
+
+
+def fan_out_message(message):
+    """Deliver a newly-posted `message` into its followers' timelines.
+
+    The author always receives their own message. Followers only receive it
+    when the author is below the celebrity threshold. Timelines that already
+    have the message (e.g. from a backfill that ran first) are skipped, so
+    the job can run more than once.
+
+    Trimming every receiving timeline on each post would cost more than the
+    fan-out itself, so it is amortized: messages whose id is a multiple of
+    `TIMELINE_TRIM_EVERY` trim the timelines they were delivered to. Each
+    timeline receives messages from many authors, so it is trimmed about
+    every `TIMELINE_TRIM_EVERY` messages it receives.
+    """
+
+    rows = [select(literal(message.user_id),
+                   literal(message.id),
+                   literal(message.timestamp))]
+    fanned_out = not is_celebrity(message.user_id)
+
+    if fanned_out:
+        rows.append(
+            select(Follows.user_following_id,
+                   literal(message.id),
+                   literal(message.timestamp))
+            .where(Follows.user_being_followed_id == message.user_id))
+
+    for row in rows:
+        db.session.execute(
+            insert_new(TimelineEntry)
+            .from_select(['user_id', 'message_id', 'timestamp'], row))
+
+    if message.id % _trim_every() == 0:
+        if fanned_out:
+            trim_followers(message.user_id)
+        else:
+            trim(message.user_id)
+
+
+def backfill(follower_id, followed_ids):
+    """Copy recent messages of `followed_ids` into `follower_id`'s timeline.
+
+    `followed_ids` is a single id or a list of ids. Messages by celebrities
+    are skipped, since they're merged in on read.
+    """
+
+    if isinstance(followed_ids, int):
+        followed_ids = [followed_ids]
+
+    recent = (select(literal(follower_id), Message.id, Message.timestamp)
+              .join(User, User.id == Message.user_id)
+              .where(Message.user_id.in_(followed_ids))
+              .where(User.followers_count < _celebrity_threshold())
+              .order_by(Message.timestamp.desc())
+              .limit(_timeline_length()))
+
+    db.session.execute(
+        insert_new(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'timestamp'], recent))
+
+    trim(follower_id)
+
+
+def remove_follow(follower_id, followed_ids):
+    """Drop messages of `followed_ids` (an id or list of ids) from
+    `follower_id`'s timeline."""
+
+    if isinstance(followed_ids, int):
+        followed_ids = [followed_ids]
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == follower_id)
+        .where(TimelineEntry.message_id.in_(
+            select(Message.id).where(Message.user_id.in_(followed_ids)))))
+
+
+def remove_message(message_id):
+    """Drop message `message_id` from every timeline it was delivered to."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.message_id == message_id))
+
+
+def purge_user(user_id):
+    """Drop the timeline of `user_id` and their messages in other timelines."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id))
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.message_id.in_(
+            select(Message.id).where(Message.user_id == user_id))))
+
+
+def trim(user_id):
+    """Keep only the newest entries of `user_id`'s timeline.
+
+    Entries are ranked by `(timestamp, message_id)`, as timelines are read,
+    so messages sharing a timestamp at the cutoff are kept or dropped one
+    by one rather than together.
+    """
+
+    older = (select(TimelineEntry.message_id)
+             .where(TimelineEntry.user_id == user_id)
+             .order_by(TimelineEntry.timestamp.desc(),
+                       TimelineEntry.message_id.desc())
+             .offset(_timeline_length()))
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+        .where(TimelineEntry.message_id.in_(older)))
+
+
+def trim_followers(user_id):
+    """Keep only the newest entries of the timelines of `user_id` and
+    everyone following them, with one statement (ranked like `trim`)."""
+
+    timeline_ids = (select(Follows.user_following_id)
+                    .where(Follows.user_being_followed_id == user_id)
+                    .union_all(select(literal(user_id))))
+
+    ranked = (select(TimelineEntry.user_id,
+                     TimelineEntry.message_id,
+                     func.row_number().over(
+                         partition_by=TimelineEntry.user_id,
+                         order_by=(TimelineEntry.timestamp.desc(),
+                                   TimelineEntry.message_id.desc()),
+                     ).label('position'))
+              .where(TimelineEntry.user_id.in_(timeline_ids))
+              .subquery())
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(tuple_(TimelineEntry.user_id, TimelineEntry.message_id).in_(
+            select(ranked.c.user_id, ranked.c.message_id)
+            .where(ranked.c.position > _timeline_length()))))
+
+
+def rebuild_all(user_ids=None):
+    """Rebuild stored timelines from the follows and messages tables.
+
+    Rebuilds every timeline, or only those of `user_ids` (a list or select
+    of ids). Used after seeding or to backfill a database created before
+    timelines were stored. Each timeline keeps only its newest entries.
+    Relies on `User.followers_count` being up to date.
+    """
+
+    clear = delete(TimelineEntry)
+
+    celebrities = (select(User.id)
+                   .where(User.followers_count >= _celebrity_threshold()))
+
+    followed = (select(Follows.user_following_id.label('user_id'),
+                       Message.id.label('message_id'),
+                       Message.timestamp.label('timestamp'))
+                .join(Message,
+                      Message.user_id == Follows.user_being_followed_id)
+                .where(Follows.user_being_followed_id.not_in(celebrities)))
+    own = select(Message.user_id, Message.id, Message.timestamp)
+
+    if user_ids is not None:
+        clear = clear.where(TimelineEntry.user_id.in_(user_ids))
+        followed = followed.where(Follows.user_following_id.in_(user_ids))
+        own = own.where(Message.user_id.in_(user_ids))
+
+    db.session.execute(clear)
+
+    delivered = followed.union_all(own).subquery()
+
+    ranked = (select(delivered,
+                     func.row_number().over(
+                         partition_by=delivered.c.user_id,
+                         order_by=(delivered.c.timestamp.desc(),
+                                   delivered.c.message_id.desc()),
+                     ).label('position'))
+              .subquery())
+
+    db.session.execute(
+        insert(TimelineEntry)
+        .from_select(['user_id', 'message_id', 'timestamp'],
+                     select(ranked.c.user_id,
+                            ranked.c.message_id,
+                            ranked.c.timestamp)
+                     .where(ranked.c.position <= _timeline_length())))
+
+
+def _messages(columns):
+    if columns is None:
+        return Message.with_authors()
+
+    return (db.session.query(*columns)
+            .select_from(Message)
+            .join(User, User.id == Message.user_id))
+
+
+def stored_timeline(user_id, limit=100, before=None, columns=None):
+    """The query for the newest `limit` messages in `user_id`'s stored
+    timeline (see `home_timeline`)."""
+
+    stored = (_messages(columns)
+              .join(TimelineEntry,
+                    and_(TimelineEntry.message_id == Message.id,
+                         TimelineEntry.user_id == user_id)))
+
+    if before:
+        stored = stored.filter(
+            tuple_(TimelineEntry.timestamp, TimelineEntry.message_id) < before)
+
+    return (stored
+            .order_by(TimelineEntry.timestamp.desc(),
+                      TimelineEntry.message_id.desc())
+            .limit(limit))
+
+
+def home_timeline(user, limit=100, before=None, columns=None):
+    """Return the newest `limit` messages for `user`'s home page.
+
+    Reads the stored timeline and merges in messages from any followed
+    celebrities, whose posts are not fanned out. If `before` is a
+    `(timestamp, id)` pair, only messages older than it are returned.
+
+    If `columns` is given (message and author columns, including
+    `Message.timestamp` and `Message.id`), rows of just those columns are
+    returned instead of `Message` instances.
+    """
+
+    messages = stored_timeline(user.id, limit, before, columns).all()
+
+    celebrity_ids = _followed_celebrity_ids(user.id)
+
+    if celebrity_ids:
+        merged = (_messages(columns)
+                  .filter(Message.user_id.in_(celebrity_ids)))
+
+        if before:
+            merged = merged.filter(tuple_(Message.timestamp, Message.id) < before)
+
+        messages += (merged
+                     .order_by(Message.timestamp.desc(), Message.id.desc())
+                     .limit(limit)
+                     .all())
+
+        # Messages fanned out before their author crossed the threshold
+        # are in both lists.
+        messages = sorted({msg.id: msg for msg in messages}.values(),
+                          key=lambda msg: (msg.timestamp, msg.id),
+                          reverse=True)
+
+    return messages[:limit]
@@ -0,0 +1,122 @@
+"""Cache of the logged-in user, shared across requests.
+
+Every request needs to know who is logged in, but most only read a handful of
+profile fields and counters. Rather than loading the `User` row each time, we
+keep a small LRU cache of compact snapshots keyed by user id. Entries expire
+after a short TTL (so other worker processes see changes soon) and are
+dropped immediately by the routes that change a user in this process.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import select
+
+from models import db, User
+
+SNAPSHOT_FIELDS = (
+    'id',
+    'username',
+    'email',
+    'image_url',
+    'header_image_url',
+    'bio',
+    'location',
+    'messages_count',
+    'following_count',
+    'followers_count',
+    'liked_messages_count',
+    'version',
+    'unread_notifications',
+)
+
+
+class CachedUser:
+    """Snapshot of a user's profile fields and counters.
+
+    Reading anything not in the snapshot (relationships, `password`,
+    methods) loads the full `User` row, at most once per request; use
+    `.instance` directly when changing or deleting the user.
+    """
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+        self._instance = None
+
+    @property
+    def instance(self):
+        """The full `User` row in the current session."""
+
+        if self._instance is None:
+            self._instance = db.session.get(User, self.id)
+        return self._instance
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't in the snapshot.
+        return getattr(self.instance, name)
+
+    def __eq__(self, other):
+        return (isinstance(other, (CachedUser, User))
+                and other.id == self.id)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<CachedUser #{self.id}: {self.username}, {self.email}>"
+
+
+class UserCache:
+    """LRU cache of user snapshots with a time-to-live."""
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id):
+        """Return a `CachedUser` for `user_id`, or None if there is no such user."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return CachedUser(entry[1])
+
+        values = db.session.execute(
+            select(*(getattr(User, field) for field in SNAPSHOT_FIELDS))
+            .where(User.id == user_id)).mappings().first()
+
+        if values is None:
+            return None
+
+        values = dict(values)
+
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, values)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return CachedUser(values)
+
+    def invalidate(self, *user_ids):
+        """Drop cached snapshots of `user_ids`."""
+
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every app in the process, configured by `create_app`.
+user_cache = UserCache()